@@ -0,0 +1,237 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Spreads chat completions across several OpenAI compatible backends, such as
+multiple Ollama or RamaLama servers, and keeps serving when one goes down.
+
+Each request goes to the backend with the lowest load for its weight, where
+load is either the number of outstanding requests or their moving average
+latency. A backend failing consecutive requests is ejected by its circuit
+breaker, and only tried again after a cool down. Requests failing on one
+backend fail over to the next.
+
+Backends can be configured with the ENV variable OPENAI_BACKENDS, as a JSON
+list like this:
+[{"base_url": "http://localhost:11434/v1", "model": "qwen2.5:0.5b", "weight": 2},
+ {"base_url": "http://localhost:8080/v1"}]
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from http_transport import async_http_client, attempt_span, http_client
+from openai import AsyncOpenAI, OpenAI
+from retry_policy import is_retryable
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures. Once reset_timeout
+    seconds pass, lets one trial request through, closing again if it
+    succeeds."""
+
+    def __init__(
+        self, failure_threshold: int = 3, reset_timeout: float = 30.0
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def record_cancelled(self) -> None:
+        """Lets another trial through, as a cancelled one tells nothing."""
+        with self._lock:
+            self._trial = False
+
+
+class Backend:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str | None = None,
+        model: str | None = None,
+        weight: float = 1.0,
+    ) -> None:
+        self.base_url = base_url
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "unused")
+        self.model = model
+        self.weight = weight
+        self.client = OpenAI(
+            base_url=base_url,
+            api_key=self.api_key,
+            http_client=http_client(),
+            max_retries=0,
+        )
+        self.breaker = CircuitBreaker()
+        self.outstanding = 0
+        self.latency: Optional[float] = None  # EWMA in seconds
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._async_http_client = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        http_client = async_http_client()
+        if self._async_http_client is not http_client:
+            self._async_client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=http_client,
+                max_retries=0,
+            )
+            self._async_http_client = http_client
+        return self._async_client
+
+
+class BackendPool:
+    def __init__(
+        self,
+        backends: list[Backend],
+        strategy: str = "least_outstanding",
+        alpha: float = 0.3,
+    ) -> None:
+        if strategy not in ("least_outstanding", "ewma"):
+            raise ValueError(f"unknown strategy: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["BackendPool"]:
+        """Returns a pool of the backends in OPENAI_BACKENDS, or None if it is
+        unset."""
+        if not (value := os.getenv("OPENAI_BACKENDS")):
+            return None
+        backends = [Backend(**backend) for backend in json.loads(value)]
+        strategy = os.getenv("OPENAI_BACKENDS_STRATEGY", "least_outstanding")
+        return cls(backends, strategy=strategy)
+
+    @property
+    def key(self) -> str:
+        """Identifies the pool in cache keys, like a base URL would."""
+        return ",".join(sorted(b.base_url for b in self.backends))
+
+    def _load(self, backend: Backend) -> float:
+        load = backend.outstanding + 1
+        if self.strategy == "ewma":
+            # Unmeasured backends look fast, so they get tried.
+            load *= backend.latency or 0.0
+        return load / backend.weight
+
+    def choose(self, exclude: set[str] = frozenset()) -> Optional[Backend]:
+        """Returns the least loaded backend whose breaker allows a request, or
+        None if none is left to try."""
+        candidates = [b for b in self.backends if b.base_url not in exclude]
+        if not candidates:
+            return None
+        with self._lock:
+            # Shuffle first, so that ties are broken randomly.
+            random.shuffle(candidates)
+            candidates.sort(key=self._load)
+        for backend in candidates:
+            if backend.breaker.allow():
+                return backend
+        # When everything is ejected, it is better to try than to fail.
+        return candidates[0]
+
+    def _started(self, backend: Backend) -> float:
+        with self._lock:
+            backend.outstanding += 1
+        return time.perf_counter()
+
+    def _finished(
+        self, backend: Backend, start: float, error: Optional[BaseException]
+    ) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None:
+                latency = time.perf_counter() - start
+                if backend.latency is None:
+                    backend.latency = latency
+                else:
+                    backend.latency += self.alpha * (latency - backend.latency)
+        if error is not None and not isinstance(error, Exception):
+            backend.breaker.record_cancelled()
+        elif error is None or not is_retryable(error):
+            # The backend answered, if only to reject the request.
+            backend.breaker.record_success()
+        else:
+            backend.breaker.record_failure()
+
+    def call(self, fn: Callable[[Backend], T]) -> T:
+        """Calls fn with the chosen backend, failing over to the next one on
+        errors which another backend may not have."""
+        tried = set()
+        while True:
+            backend = self.choose(exclude=tried)
+            start = self._started(backend)
+            try:
+                with attempt_span("backend attempt"):
+                    result = fn(backend)
+            except BaseException as e:
+                self._finished(backend, start, e)
+                if not isinstance(e, Exception):
+                    raise  # e.g. cancelled, so not worth failing over
+                tried.add(backend.base_url)
+                if not is_retryable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self._finished(backend, start, None)
+            return result
+
+    async def acall(self, fn: Callable[[Backend], Awaitable[T]]) -> T:
+        """Like call, for async functions."""
+        tried = set()
+        while True:
+            backend = self.choose(exclude=tried)
+            start = self._started(backend)
+            try:
+                with attempt_span("backend attempt"):
+                    result = await fn(backend)
+            except BaseException as e:
+                self._finished(backend, start, e)
+                if not isinstance(e, Exception):
+                    raise  # e.g. cancelled, so not worth failing over
+                tried.add(backend.base_url)
+                if not is_retryable(e) or len(tried) == len(self.backends):
+                    raise
+                continue
+            self._finished(backend, start, None)
+            return result
@@ -0,0 +1,107 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+
+import httpx
+import openai
+import pytest
+from backends import Backend, BackendPool, CircuitBreaker
+
+ollama = "http://localhost:11434/v1"
+ramalama = "http://localhost:8080/v1"
+
+
+def status_error(status_code: int):
+    request = httpx.Request("POST", f"{ollama}/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+
+    # After the timeout, only one trial request is allowed
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+
+
+def test_choose_least_outstanding_by_weight():
+    pool = BackendPool([Backend(ollama, weight=1), Backend(ramalama, weight=3)])
+    pool.backends[1].outstanding = 1
+
+    # (1 + 1) / 3 is less load than (0 + 1) / 1
+    assert pool.choose().base_url == ramalama
+
+
+def test_choose_skips_ejected():
+    pool = BackendPool([Backend(ollama), Backend(ramalama, weight=10)])
+    pool.backends[1].breaker.reset_timeout = 60
+    for _ in range(3):
+        pool.backends[1].breaker.record_failure()
+
+    assert pool.choose().base_url == ollama
+
+
+def test_call_fails_over():
+    pool = BackendPool([Backend(ollama), Backend(ramalama)])
+
+    def chat(backend):
+        if backend.base_url == ollama:
+            raise status_error(503)
+        return "Atlantic Ocean"
+
+    assert pool.call(chat) == "Atlantic Ocean"
+
+
+def test_call_does_not_fail_over_bad_requests():
+    pool = BackendPool([Backend(ollama), Backend(ramalama)])
+    tried = []
+
+    def chat(backend):
+        tried.append(backend.base_url)
+        raise status_error(400)
+
+    with pytest.raises(openai.APIStatusError):
+        pool.call(chat)
+    assert len(tried) == 1
+
+
+def test_bad_request_closes_trial():
+    pool = BackendPool([Backend(ollama)])
+    breaker = pool.backends[0].breaker
+    breaker.reset_timeout = 0
+    for _ in range(3):
+        breaker.record_failure()
+
+    def chat(backend):
+        raise status_error(400)
+
+    # The backend answered the trial, so it is back, not ejected for good.
+    with pytest.raises(openai.APIStatusError):
+        pool.call(chat)
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_cancelled_call_finishes():
+    pool = BackendPool([Backend(ollama)])
+    backend = pool.backends[0]
+    backend.breaker.reset_timeout = 0
+    for _ in range(3):
+        backend.breaker.record_failure()
+
+    async def chat(backend):
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(pool.acall(chat))
+    assert backend.outstanding == 0
+    assert backend.breaker.allow()  # the trial can be tried again
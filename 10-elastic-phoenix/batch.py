@@ -0,0 +1,149 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Answers many questions in one process, instead of running main.py once per
+question. Questions are read as JSONL, one object per line with a "message"
+(or "body") and optional "id" (or "request_id"). Answers are written as JSONL
+as soon as they complete, so in a different order than the questions:
+    {"id": "q1", "answer": "South Atlantic Ocean.", "span_id": "..."}
+
+Pass --checkpoint to record the ids of answered questions. If the run is
+interrupted, running it again with the same checkpoint skips them. A question
+may be answered twice if the process dies between writing its answer and
+checkpointing it, but never skipped.
+
+Run it like this:
+    python batch.py questions.jsonl --output answers.jsonl \
+        --checkpoint answers.checkpoint
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Iterator, Optional, TextIO
+
+from client import AsyncOpenAIClient
+from dotenv import load_dotenv
+from main import disable_unused_instrumentations
+from opentelemetry.instrumentation import auto_instrumentation
+
+
+def read_questions(lines: TextIO) -> Iterator[tuple[str, str]]:
+    """Yields (id, message) for each non-blank line. Lines without an id are
+    identified by their line number."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        question_id = record.get("id", record.get("request_id", number))
+        message = record.get("message", record.get("body"))
+        if message is None:
+            raise ValueError(f"line {number} has no message")
+        yield str(question_id), message
+
+
+def read_checkpoint(path: str) -> set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return {line.rstrip("\n") for line in file if line.strip()}
+
+
+async def run(
+    client: AsyncOpenAIClient,
+    questions: Iterator[tuple[str, str]],
+    output: TextIO,
+    checkpoint: Optional[TextIO] = None,
+    done: frozenset[str] = frozenset(),
+) -> int:
+    """Answers questions not in done with at most client.max_concurrency in
+    flight, returning how many failed. Failed questions are written with an
+    "error" instead of an answer, and are not checkpointed, so a resumed run
+    asks them again."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=client.max_concurrency)
+    failures = 0
+
+    async def produce():
+        # Read in a thread, as input may be a pipe which is slow to fill.
+        while question := await asyncio.to_thread(next, questions, None):
+            if question[0] not in done:
+                await queue.put(question)
+        for _ in range(client.max_concurrency):
+            await queue.put(None)
+
+    async def work():
+        nonlocal failures
+        while (question := await queue.get()) is not None:
+            question_id, message = question
+            try:
+                response = await client.achat(message)
+            except Exception as e:
+                failures += 1
+                record = {"id": question_id, "error": str(e)}
+            else:
+                record = {
+                    "id": question_id,
+                    "answer": response.content,
+                    "span_id": response.span_id,
+                }
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if checkpoint is not None and "error" not in record:
+                checkpoint.write(question_id + "\n")
+                checkpoint.flush()
+
+    workers = [work() for _ in range(client.max_concurrency)]
+    await asyncio.gather(produce(), *workers)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "input", nargs="?", default="-", help="JSONL questions, or - for stdin"
+    )
+    parser.add_argument("--output", help="JSONL answers, default stdout")
+    parser.add_argument("--checkpoint", help="ids of answered questions")
+    parser.add_argument("--concurrency", type=int, help="requests in flight")
+    parser.add_argument("--fast-start", action="store_true")
+    args = parser.parse_args()
+
+    # Load environment variables used by OpenTelemetry and AsyncOpenAIClient().
+    load_dotenv(dotenv_path="../.env", override=False)
+    if args.fast_start:
+        disable_unused_instrumentations()
+    auto_instrumentation.initialize()
+
+    done = frozenset()
+    checkpoint = None
+    if args.checkpoint:
+        done = frozenset(read_checkpoint(args.checkpoint))
+        checkpoint = open(args.checkpoint, "a")
+    # Append when resuming, so answers from before the interruption are kept.
+    output = open(args.output, "a" if done else "w") if args.output else None
+    lines = sys.stdin if args.input == "-" else open(args.input)
+    client = AsyncOpenAIClient(max_concurrency=args.concurrency)
+    try:
+        failures = asyncio.run(
+            run(
+                client,
+                read_questions(lines),
+                output or sys.stdout,
+                checkpoint,
+                done,
+            )
+        )
+    finally:
+        for file in (lines, output, checkpoint):
+            if file not in (None, sys.stdin):
+                file.close()
+    if failures:
+        sys.exit(f"{failures} questions failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import io
+import json
+
+import pytest
+from batch import read_checkpoint, read_questions, run
+from client import ChatResponse
+
+questions = """\
+{"id": "q1", "message": "Which ocean contains Bouvet Island?"}
+
+{"request_id": "q2", "body": "Which ocean contains Easter Island?"}
+{"message": "Which ocean contains Fiji?"}
+"""
+
+
+class EchoClient:
+    """Answers with the message, failing for messages containing "fail"."""
+
+    max_concurrency = 2
+
+    def __init__(self):
+        self.messages = []
+
+    async def achat(self, message: str) -> ChatResponse:
+        self.messages.append(message)
+        if "fail" in message:
+            raise RuntimeError("boom")
+        return ChatResponse(message.upper(), span_id="span-" + message[-5:])
+
+
+def test_read_questions():
+    assert list(read_questions(io.StringIO(questions))) == [
+        ("q1", "Which ocean contains Bouvet Island?"),
+        ("q2", "Which ocean contains Easter Island?"),
+        ("4", "Which ocean contains Fiji?"),
+    ]
+
+
+def test_read_questions_without_message():
+    with pytest.raises(ValueError, match="line 1 has no message"):
+        list(read_questions(io.StringIO('{"id": "q1"}\n')))
+
+
+def test_run_resumes_from_checkpoint(tmp_path):
+    client = EchoClient()
+    output = io.StringIO()
+    with open(tmp_path / "checkpoint", "w") as checkpoint:
+        failures = asyncio.run(
+            run(
+                client,
+                read_questions(io.StringIO(questions)),
+                output,
+                checkpoint,
+                done=frozenset({"q1"}),
+            )
+        )
+
+    assert failures == 0
+    assert sorted(client.messages) == [
+        "Which ocean contains Easter Island?",
+        "Which ocean contains Fiji?",
+    ]
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert sorted(records, key=lambda r: r["id"]) == [
+        {
+            "id": "4",
+            "answer": "WHICH OCEAN CONTAINS FIJI?",
+            "span_id": "span-Fiji?",
+        },
+        {
+            "id": "q2",
+            "answer": "WHICH OCEAN CONTAINS EASTER ISLAND?",
+            "span_id": "span-land?",
+        },
+    ]
+    assert read_checkpoint(tmp_path / "checkpoint") == {"4", "q2"}
+
+
+def test_run_does_not_checkpoint_failures(tmp_path):
+    output = io.StringIO()
+    with open(tmp_path / "checkpoint", "w") as checkpoint:
+        failures = asyncio.run(
+            run(
+                EchoClient(),
+                iter([("q1", "please fail"), ("q2", "hello")]),
+                output,
+                checkpoint,
+            )
+        )
+
+    assert failures == 1
+    records = {
+        r["id"]: r for r in map(json.loads, output.getvalue().splitlines())
+    }
+    assert records["q1"] == {"id": "q1", "error": "boom"}
+    assert read_checkpoint(tmp_path / "checkpoint") == {"q2"}
@@ -2,40 +2,458 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import asyncio
 import os
-from openai import OpenAI
+import time
+from openai import AsyncOpenAI, OpenAI, Stream
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from openinference.instrumentation import capture_span_context
-from typing import Optional
+from backends import BackendPool
+from hedging import HedgePolicy
+from http_transport import async_http_client, http_client
+from opentelemetry import metrics, trace
+from opentelemetry.trace import Link, NonRecordingSpan, SpanContext
+from opentelemetry.trace.span import format_span_id
+from response_cache import Cache, ResponseCache, cache_key
+from retry_policy import RetryPolicy
+from single_flight import AsyncSingleFlight, SingleFlight
+from typing import Iterator, Optional
+
+tracer = trace.get_tracer(__name__)
 
 
 class ChatResponse:
-    def __init__(self, content: str, span_id: Optional[str]):
+    """The answer to a message, with what it cost to get it. Token counts are
+    zero when the answer didn't come from the API, such as from the cache."""
+
+    # Many responses can be in memory at once, e.g. in batch mode, so avoid a
+    # __dict__ per instance.
+    __slots__ = (
+        "content",
+        "span_id",
+        "cached",
+        "model",
+        "system_fingerprint",
+        "prompt_tokens",
+        "completion_tokens",
+        "cached_tokens",
+        "latency",
+        "time_to_first_token",
+    )
+
+    def __init__(
+        self,
+        content: str,
+        span_id: Optional[str],
+        cached: bool = False,
+        model: Optional[str] = None,
+        system_fingerprint: Optional[str] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+        latency: Optional[float] = None,
+        time_to_first_token: Optional[float] = None,
+    ):
         self.content = content
         self.span_id = span_id
+        self.cached = cached
+        self.model = model
+        self.system_fingerprint = system_fingerprint
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+        self.latency = latency
+        self.time_to_first_token = time_to_first_token
+
+    @classmethod
+    def from_completion(
+        cls,
+        content: str,
+        span_id: Optional[str],
+        completion: ChatCompletion | ChatCompletionChunk,
+        latency: float,
+        time_to_first_token: Optional[float] = None,
+    ) -> "ChatResponse":
+        usage = completion.usage
+        details = usage and usage.prompt_tokens_details
+        return cls(
+            content,
+            span_id,
+            model=completion.model,
+            system_fingerprint=completion.system_fingerprint,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=(details and details.cached_tokens) or 0,
+            latency=latency,
+            time_to_first_token=time_to_first_token,
+        )
 
     def __str__(self):
         return self.content
 
 
+meter = metrics.get_meter(__name__)
+duration_histogram = meter.create_histogram(
+    "gen_ai.client.operation.duration",
+    unit="s",
+    description="Wall-clock time of chat completions, including retries.",
+)
+token_histogram = meter.create_histogram(
+    "gen_ai.client.token.usage",
+    unit="{token}",
+    description="Tokens used by chat completions.",
+)
+
+
+def _record_metrics(
+    response: ChatResponse, span_context: Optional[SpanContext]
+) -> None:
+    """Records latency and token usage. Measurements are made in the context
+    of the LLM span, so exemplars link to it."""
+    context = None
+    if span_context is not None:
+        context = trace.set_span_in_context(NonRecordingSpan(span_context))
+    attributes = {
+        "gen_ai.operation.name": "chat",
+        "gen_ai.system": "openai",
+        "gen_ai.response.model": response.model or "",
+    }
+    duration_histogram.record(response.latency, attributes, context)
+    for token_type, count in (
+        ("input", response.prompt_tokens),
+        ("output", response.completion_tokens),
+        # Not a standard type, but shows how much prompt caching saves.
+        ("cached_input", response.cached_tokens),
+    ):
+        token_histogram.record(
+            count, {**attributes, "gen_ai.token.type": token_type}, context
+        )
+
+
+class ChatStream:
+    """Yields content deltas as they arrive. Once exhausted, response holds the
+    complete ChatResponse, including time-to-first-token in seconds, and it is
+    put in cache under key."""
+
+    def __init__(
+        self,
+        chunks: Optional[Stream[ChatCompletionChunk]],
+        span_context: Optional[SpanContext],
+        start: float,
+        cache: Optional[Cache] = None,
+        key: str = "",
+    ) -> None:
+        self._chunks = chunks
+        self._span_context = span_context
+        self._start = start
+        self._cache = cache
+        self._key = key
+        self.response: Optional[ChatResponse] = None
+
+    @classmethod
+    def of(cls, response: ChatResponse) -> "ChatStream":
+        """Returns a stream of a complete response, e.g. from the cache."""
+        stream = cls(None, None, 0.0)
+        stream.response = response
+        return stream
+
+    def __iter__(self) -> Iterator[str]:
+        if self._chunks is None:
+            # Already complete, so there is only one chunk.
+            yield self.response.content
+            return
+        parts = []
+        time_to_first_token = None
+        last = None
+        for chunk in self._chunks:
+            # With include_usage, the last chunk has usage and no choices.
+            last = chunk
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - self._start
+            parts.append(chunk.choices[0].delta.content)
+            yield parts[-1]
+        if last is None:
+            # e.g. the connection closed before the first chunk
+            raise ValueError("chat completion stream ended without chunks")
+        span_id = None
+        if self._span_context is not None:
+            span_id = format_span_id(self._span_context.span_id)
+        self.response = ChatResponse.from_completion(
+            "".join(parts),
+            span_id,
+            last,
+            latency=time.perf_counter() - self._start,
+            time_to_first_token=time_to_first_token,
+        )
+        if self._cache is not None:
+            self._cache.put(self._key, self.response.content)
+        _record_metrics(self.response, self._span_context)
+
+
+def _user_messages(message: str) -> list[dict]:
+    return [
+        {
+            "role": "user",
+            "content": message,
+        },
+    ]
+
+
+def _last_span_context(
+    capture: capture_span_context,
+) -> Optional[SpanContext]:
+    contexts = capture.get_span_contexts()
+    return contexts[-1] if contexts else None
+
+
+def _completed(
+    cache: Optional[Cache],
+    key: str,
+    completion: ChatCompletion,
+    span_context: Optional[SpanContext],
+    start: float,
+) -> tuple[ChatResponse, Optional[SpanContext]]:
+    """Caches and records metrics of a completion, returning its response and
+    the context of its span."""
+    content = completion.choices[0].message.content
+    if cache is not None:
+        cache.put(key, content)
+    span_id = None
+    if span_context is not None:
+        span_id = format_span_id(span_context.span_id)
+    response = ChatResponse.from_completion(
+        content, span_id, completion, latency=time.perf_counter() - start
+    )
+    _record_metrics(response, span_context)
+    return response, span_context
+
+
+def _local_response(
+    content: str,
+    model: str,
+    cached: bool = False,
+    leader: Optional[SpanContext] = None,
+) -> ChatResponse:
+    """Records a response which didn't need a request of its own as a
+    lightweight span, so it is still visible and can be annotated like any
+    other. A response shared from a concurrent request links to its span."""
+    attributes = {"gen_ai.request.model": model}
+    if cached:
+        attributes["cache.hit"] = True
+    links = []
+    if leader is not None:
+        attributes["single_flight.shared"] = True
+        if leader.is_valid:
+            links.append(Link(leader))
+    with tracer.start_as_current_span(
+        f"chat {model}", attributes=attributes, links=links
+    ) as span:
+        span_context = span.get_span_context()
+        span_id = (
+            format_span_id(span_context.span_id)
+            if span_context.is_valid
+            else None
+        )
+        return ChatResponse(content, span_id, cached=cached)
+
+
 class OpenAIClient:
     """Provides chat completions for models accessed by the OpenAI API."""
 
-    def __init__(self, model: str | None = None) -> None:
-        self.client = OpenAI()
+    def __init__(
+        self,
+        model: str | None = None,
+        cache: Cache | None = None,
+        retry: RetryPolicy | None = None,
+        hedge: HedgePolicy | None = None,
+        backends: BackendPool | None = None,
+    ) -> None:
+        # Retries are up to the RetryPolicy, which shares a budget.
+        self.client = OpenAI(http_client=http_client(), max_retries=0)
         self.model = model or os.getenv("CHAT_MODEL", "gpt-4o-mini")
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge or HedgePolicy.from_env()
+        self.backends = backends or BackendPool.from_env()
+        self._flights = SingleFlight()
+
+    @property
+    def base_url(self) -> str:
+        if self.backends is not None:
+            return self.backends.key
+        return str(self.client.base_url)
+
+    def _create(self, **kwargs):
+        """Creates a completion, using the chosen backend if there are
+        several."""
+        if self.backends is None:
+            return self.client.chat.completions.create(
+                model=self.model, **kwargs
+            )
+        return self.backends.call(
+            lambda backend: backend.client.chat.completions.create(
+                model=backend.model or self.model, **kwargs
+            )
+        )
 
     def chat(self, message: str) -> ChatResponse:
-        messages = [
-            {
-                "role": "user",
-                "content": message,
-            },
-        ]
+        messages = _user_messages(message)
+        key = cache_key(self.base_url, self.model, messages, 0)
+        if self.cache is not None:
+            if (content := self.cache.get(key)) is not None:
+                return _local_response(content, self.model, cached=True)
+        # Identical requests in flight at the same time share one API call.
+        (response, span_context), leader = self._flights.do(
+            key, lambda: self._complete(key, messages)
+        )
+        if leader:
+            return response
+        return _local_response(
+            response.content, self.model, leader=span_context
+        )
+
+    def _complete(
+        self, key: str, messages: list[dict]
+    ) -> tuple[ChatResponse, Optional[SpanContext]]:
+        start = time.perf_counter()
+
+        def attempt() -> tuple[ChatCompletion, Optional[SpanContext]]:
+            with capture_span_context() as capture:
+                completion = self.retry.call(
+                    lambda: self._create(messages=messages, temperature=0)
+                )
+                return completion, _last_span_context(capture)
+
+        if self.hedge is None:
+            completion, span_context = attempt()
+        else:
+            completion, span_context = self.hedge.call(attempt)
+        return _completed(self.cache, key, completion, span_context, start)
+
+    def chat_stream(self, message: str) -> ChatStream:
+        """Like chat, but streams the completion instead of waiting for it.
+        A cached response is one chunk. Unlike chat, identical streams in
+        flight at the same time each make their own API call."""
+        messages = _user_messages(message)
+        key = cache_key(self.base_url, self.model, messages, 0)
+        if self.cache is not None:
+            if (content := self.cache.get(key)) is not None:
+                return ChatStream.of(
+                    _local_response(content, self.model, cached=True)
+                )
+        start = time.perf_counter()
         with capture_span_context() as capture:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0,
+            chunks = self.retry.call(
+                lambda: self._create(
+                    messages=messages,
+                    temperature=0,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
             )
-            content = response.choices[0].message.content
-            return ChatResponse(content, capture.get_last_span_id())
+            return ChatStream(
+                chunks, _last_span_context(capture), start, self.cache, key
+            )
+
+
+class AsyncOpenAIClient:
+    """Like OpenAIClient, but completions share one event loop instead of
+    blocking a thread each."""
+
+    def __init__(
+        self,
+        model: str | None = None,
+        max_concurrency: int | None = None,
+        cache: Cache | None = None,
+        retry: RetryPolicy | None = None,
+        hedge: HedgePolicy | None = None,
+        backends: BackendPool | None = None,
+    ) -> None:
+        self.model = model or os.getenv("CHAT_MODEL", "gpt-4o-mini")
+        self.max_concurrency = max_concurrency or int(
+            os.getenv("CHAT_MAX_CONCURRENCY", "10")
+        )
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge or HedgePolicy.from_env()
+        self.backends = backends or BackendPool.from_env()
+        self._client: AsyncOpenAI | None = None
+        self._http_client = None
+        self._flights = AsyncSingleFlight()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """The OpenAI client using the pool of the running event loop, as
+        async connections cannot be shared between loops."""
+        http_client = async_http_client()
+        if self._http_client is not http_client:
+            self._client = AsyncOpenAI(http_client=http_client, max_retries=0)
+            self._http_client = http_client
+        return self._client
+
+    @property
+    def base_url(self) -> str:
+        if self.backends is not None:
+            return self.backends.key
+        return str(self.client.base_url)
+
+    async def _create(self, **kwargs):
+        """Creates a completion, using the chosen backend if there are
+        several."""
+        if self.backends is None:
+            return await self.client.chat.completions.create(
+                model=self.model, **kwargs
+            )
+        return await self.backends.acall(
+            lambda backend: backend.async_client.chat.completions.create(
+                model=backend.model or self.model, **kwargs
+            )
+        )
+
+    async def achat(self, message: str) -> ChatResponse:
+        messages = _user_messages(message)
+        key = cache_key(self.base_url, self.model, messages, 0)
+        if self.cache is not None:
+            if (content := self.cache.get(key)) is not None:
+                return _local_response(content, self.model, cached=True)
+        (response, span_context), leader = await self._flights.do(
+            key, lambda: self._complete(key, messages)
+        )
+        if leader:
+            return response
+        return _local_response(
+            response.content, self.model, leader=span_context
+        )
+
+    async def _complete(
+        self, key: str, messages: list[dict]
+    ) -> tuple[ChatResponse, Optional[SpanContext]]:
+        start = time.perf_counter()
+
+        async def attempt() -> tuple[ChatCompletion, Optional[SpanContext]]:
+            # capture_span_context is backed by a ContextVar, so each task sees
+            # only the span of its own request.
+            with capture_span_context() as capture:
+                completion = await self.retry.acall(
+                    lambda: self._create(messages=messages, temperature=0)
+                )
+                return completion, _last_span_context(capture)
+
+        if self.hedge is None:
+            completion, span_context = await attempt()
+        else:
+            completion, span_context = await self.hedge.acall(attempt)
+        return _completed(self.cache, key, completion, span_context, start)
+
+    async def chat_many(self, messages: list[str]) -> list[ChatResponse]:
+        """Answers each message, in order, with at most max_concurrency
+        requests in flight."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded_chat(message: str) -> ChatResponse:
+            async with semaphore:
+                return await self.achat(message)
+
+        return await asyncio.gather(*(bounded_chat(m) for m in messages))
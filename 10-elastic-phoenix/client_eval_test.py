@@ -8,6 +8,7 @@ import textwrap
 import pandas as pd
 import pytest
 from client import OpenAIClient
+from combined_evaluator import CombinedJudge
 from main import message
 from phoenix.evals import (
     HallucinationEvaluator,
@@ -16,13 +17,31 @@ from phoenix.evals import (
     run_evals,
 )
 from ocean_evaluator import OceanEvaluator
+from tiered_judge import TieredJudge
+
+
+@pytest.fixture
+def judge(request):
+    """Builds the judge named by the test parameter, closing its runner."""
+    if request.param == "combined":
+        combined = CombinedJudge()
+        yield combined
+        combined.runner.close()
+    elif request.param == "tiered":
+        # Failing labels are still explained, so failure messages have them.
+        yield TieredJudge(run_evals)
+    else:
+        yield run_evals
 
 
 @pytest.mark.skipif(
     not os.getenv("OPENAI_API_KEY"), reason="OPENAI_API_KEY not set"
 )
 @pytest.mark.eval
-def test_chat_eval(traced_test):
+@pytest.mark.parametrize(
+    "judge", ["separate", "combined", "tiered"], indirect=True
+)
+def test_chat_eval(traced_test, judge):
     # Share the same model output across all evaluators.
     actual_output = OpenAIClient().chat(message)
 
@@ -48,7 +67,7 @@ def test_chat_eval(traced_test):
     ]
 
     # Run evaluations on the test case
-    evals = run_evals(
+    evals = judge(
         dataframe=test_case,
         evaluators=[e[0] for e in evaluators_with_labels],
         provide_explanation=True,
@@ -2,9 +2,12 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import asyncio
+import time
 
 import pytest
-from client import OpenAIClient
+from client import AsyncOpenAIClient, ChatStream, OpenAIClient
+from response_cache import LRUCache, ResponseCache
 from main import message
 
 
@@ -26,8 +29,81 @@ def test_chat(default_openai_env):
     assert response.span_id is None
 
 
+@pytest.mark.vcr
+def test_chat_usage(default_openai_env):
+    response = OpenAIClient().chat(message)
+
+    assert response.model == "gpt-4o-mini-2024-07-18"
+    assert response.system_fingerprint == "fp_62a23a81ef"
+    assert (response.prompt_tokens, response.completion_tokens) == (22, 4)
+    assert response.cached_tokens == 0
+    assert response.latency > 0
+
+
 @pytest.mark.vcr
 def test_chat_with_span_id(default_openai_env, instrumented_openai):
     response = OpenAIClient().chat(message)
     assert response.content == "South Atlantic Ocean."
     assert response.span_id != 0
+
+
+@pytest.mark.vcr
+def test_chat_many(default_openai_env, instrumented_openai):
+    client = AsyncOpenAIClient(max_concurrency=1)
+    responses = asyncio.run(client.chat_many([message, message]))
+
+    assert [r.content for r in responses] == ["South Atlantic Ocean."] * 2
+    # Each response has the span of its own request
+    assert len({r.span_id for r in responses}) == 2
+
+
+@pytest.mark.vcr
+def test_chat_cached(default_openai_env):
+    client = OpenAIClient(cache=ResponseCache(LRUCache()))
+    first = client.chat(message)
+    # The cassette has only one response, so this must not hit the API.
+    second = client.chat(message)
+
+    assert not first.cached
+    assert second.cached
+    assert second.content == first.content
+
+
+@pytest.mark.vcr
+def test_chat_stream(default_openai_env):
+    stream = OpenAIClient().chat_stream(message)
+    deltas = list(stream)
+
+    assert deltas == ["South", " Atlantic", " Ocean", "."]
+    response = stream.response
+    assert response.content == "South Atlantic Ocean."
+    assert 0 < response.time_to_first_token <= response.latency
+    assert response.completion_tokens == 4
+
+
+@pytest.mark.vcr
+def test_chat_stream_cached(default_openai_env):
+    client = OpenAIClient(cache=ResponseCache(LRUCache()))
+    list(client.chat_stream(message))
+    # The cassette has only one response, so this must not hit the API.
+    stream = client.chat_stream(message)
+
+    assert list(stream) == ["South Atlantic Ocean."]
+    assert stream.response.cached
+    assert client.chat(message).cached
+
+
+def test_chat_stream_without_chunks():
+    stream = ChatStream(iter([]), None, time.perf_counter())
+
+    with pytest.raises(ValueError, match="without chunks"):
+        list(stream)
+    assert stream.response is None
+
+
+@pytest.mark.vcr
+def test_chat_retry(default_openai_env):
+    # The first response is a 429 with retry-after-ms: 20
+    response = OpenAIClient().chat(message)
+
+    assert response.content == "South Atlantic Ocean."
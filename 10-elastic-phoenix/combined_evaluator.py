@@ -0,0 +1,170 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Judges the QA, hallucination and ocean criteria in one call per row, instead
+of one call per evaluator, as each resends the same input and output.
+
+CombinedJudge has the same signature as run_evals, and returns a result per
+evaluator, so evaluations are logged under the same names either way. Calls
+are made by a JudgeRunner, like the separate evaluators in eval_job.py. See
+judge_benchmark.py for how well its labels agree with separate evaluators.
+"""
+
+import functools
+import json
+from typing import Optional
+
+import pandas as pd
+from judge_runner import JudgeRunner
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import (
+    HallucinationEvaluator,
+    LLMEvaluator,
+    PromptTemplate,
+    QAEvaluator,
+)
+
+# Criteria by the evaluator they replace, in the order they are asked.
+CRITERIA = {
+    QAEvaluator: "qa",
+    HallucinationEvaluator: "hallucination",
+    OceanEvaluator: "ocean",
+}
+
+COMBINED_PROMPT_TEMPLATE_PREFIX = """
+You are given a question, reference text and an answer. You must judge the
+answer on each of the criteria below, independently of the others.
+
+"qa": "correct" means that the question is correctly and fully answered by the
+answer, based on the reference text. "incorrect" means that the question is
+not correctly or only partially answered by the answer.
+
+"hallucination": "hallucinated" means that the answer is not based on the
+reference text or assumes information that is not available in the reference
+text. "factual" means that the answer to the question is correct relative to
+the reference text, and does not contain made up information.
+
+"ocean": ignoring the reference text, "correct" means that the answer includes
+an ocean name defined by the NOAA (Atlantic, Pacific, Indian, Arctic and
+Southern Ocean), which is relevant to the question asked. The answer may
+include qualifiers like "South" or "North" if they are relevant to the
+question. "incorrect" means an incorrect ocean, irrelevant part of the ocean,
+a made up ocean name, or an irrelevant answer.
+
+Here is the data:
+    [BEGIN DATA]
+    ************
+    [Question]: {input}
+    ************
+    [Reference]: {reference}
+    ************
+    [Answer]: {output}
+    [END DATA]
+"""
+
+COMBINED_PROMPT_BASE_TEMPLATE = f"""{COMBINED_PROMPT_TEMPLATE_PREFIX}
+Your response must be a JSON object, and nothing else. It must have the keys
+"qa", "hallucination" and "ocean", each with the label for that criterion as
+a string value.
+"""
+
+COMBINED_PROMPT_TEMPLATE_WITH_EXPLANATION = f"""{COMBINED_PROMPT_TEMPLATE_PREFIX}
+Your response must be a JSON object, and nothing else. It must have the keys
+"qa", "hallucination" and "ocean". The value of each is an object with the
+keys "explanation" and "label". In "explanation", write out in a step by step
+manner how to determine the label for that criterion. Avoid simply stating the
+label at the outset. "label" is the label for that criterion.
+"""
+
+
+def parse_response(response: str, index: int) -> dict:
+    """Returns the label and explanation of each criterion as columns, e.g.
+    "qa_label". Missing or malformed criteria are left out."""
+    try:
+        # Some models wrap JSON in a code block, despite the instructions.
+        parsed = json.loads(
+            response[response.find("{") : response.rfind("}") + 1]
+        )
+    except ValueError:
+        return {}
+    columns = {}
+    for criterion in CRITERIA.values():
+        value = parsed.get(criterion) if isinstance(parsed, dict) else None
+        if isinstance(value, dict):
+            columns[f"{criterion}_explanation"] = value.get("explanation")
+            value = value.get("label")
+        if isinstance(value, str):
+            columns[f"{criterion}_label"] = value.strip().strip('"').lower()
+    return columns
+
+
+class CombinedJudge:
+    """A drop-in for run_evals, judging all evaluators in one call per row.
+    The evaluators must share one model, and be of types in CRITERIA. Calls
+    are made by runner, with the settings of the evaluator named COMBINED,
+    e.g. EVAL_COMBINED_CONCURRENCY."""
+
+    # Part of eval cache keys, so results of each judge are cached apart.
+    template = COMBINED_PROMPT_TEMPLATE_WITH_EXPLANATION
+
+    def __init__(self, runner: Optional[JudgeRunner] = None) -> None:
+        self.runner = runner or JudgeRunner()
+
+    def __call__(
+        self,
+        dataframe: pd.DataFrame,
+        evaluators: list[LLMEvaluator],
+        provide_explanation: bool = False,
+        **kwargs,
+    ) -> list[pd.DataFrame]:
+        models = {id(evaluator._model) for evaluator in evaluators}
+        if len(models) != 1:
+            raise ValueError("evaluators must share one model")
+        criteria = [CRITERIA[type(evaluator)] for evaluator in evaluators]
+        model = evaluators[0]._model
+
+        template = PromptTemplate(COMBINED_PROMPT_BASE_TEMPLATE)
+        if provide_explanation:
+            template = PromptTemplate(COMBINED_PROMPT_TEMPLATE_WITH_EXPLANATION)
+        prompts = [
+            template.format(record) for record in dataframe.to_dict("records")
+        ]
+        responses = self.runner.run(
+            [
+                self.runner.call(
+                    "COMBINED",
+                    model,
+                    functools.partial(model._async_generate, prompt),
+                )
+                for prompt in prompts
+            ]
+        )
+        generated = pd.DataFrame(
+            [
+                parse_response(response, i) if response is not None else {}
+                for i, response in enumerate(responses)
+            ],
+            index=dataframe.index,
+        )
+
+        evals = []
+        for evaluator, criterion in zip(evaluators, criteria):
+            rails = evaluator._template.rails
+            label = generated.get(f"{criterion}_label")
+            label = pd.Series(label, index=dataframe.index, dtype=object)
+            label = label.where(label.isin(rails), None)  # invalid failed
+            score = label.map(evaluator._template.score).where(label.notna())
+            explanation = generated.get(f"{criterion}_explanation")
+            evals.append(
+                pd.DataFrame(
+                    {
+                        "label": label,
+                        "score": score,
+                        "explanation": explanation,
+                    },
+                    index=dataframe.index,
+                )
+            )
+        return evals
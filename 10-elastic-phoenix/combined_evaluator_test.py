@@ -0,0 +1,62 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import json
+
+import pandas as pd
+from combined_evaluator import CombinedJudge, parse_response
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import HallucinationEvaluator, OpenAIModel, QAEvaluator
+
+
+def test_parse_response():
+    response = json.dumps(
+        {
+            "qa": {"explanation": "It's right.", "label": "correct"},
+            "hallucination": {"explanation": "It's made up.", "label": 1},
+            "ocean": "Correct",
+        }
+    )
+
+    assert parse_response(f"```json\n{response}\n```", 0) == {
+        "qa_explanation": "It's right.",
+        "qa_label": "correct",
+        "hallucination_explanation": "It's made up.",
+        "ocean_label": "correct",
+    }
+    assert parse_response("correct", 0) == {}
+
+
+def test_combined_judge(monkeypatch, default_openai_env):
+    responses = [
+        {"qa": "correct", "hallucination": "factual", "ocean": "correct"},
+        {"qa": "incorrect", "hallucination": "hallucinated", "ocean": "nope"},
+    ]
+    prompts = []
+
+    async def fake_generate(prompt, **kwargs):
+        prompts.append(prompt)
+        return json.dumps(responses[len(prompts) - 1])
+
+    model = OpenAIModel(model="o3-mini")
+    monkeypatch.setattr(model, "_async_generate", fake_generate)
+    evaluators = [
+        QAEvaluator(model),
+        HallucinationEvaluator(model),
+        OceanEvaluator(model),
+    ]
+    spans = pd.DataFrame(
+        {"input": "q", "output": "a", "reference": "r"}, index=["s0", "s1"]
+    )
+
+    qa, hallucination, ocean = CombinedJudge()(spans, evaluators)
+
+    # All evaluators are judged in one call per row.
+    assert len(prompts) == 2
+    assert list(qa["label"]) == ["correct", "incorrect"]
+    assert list(qa["score"]) == [1, 0]
+    assert list(hallucination["label"]) == ["factual", "hallucinated"]
+    assert list(hallucination["score"]) == [0, 1]
+    # Labels outside the evaluator's rails fail, like in run_evals.
+    assert list(ocean["label"]) == ["correct", None]
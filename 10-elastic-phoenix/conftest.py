@@ -55,8 +55,14 @@ def vcr_config():
 @pytest.fixture
 def vcr_cassette_name(request):
     test_name = request.node.name
-    if test_name == "test_chat_with_span_id":
+    if test_name in (
+        "test_chat_with_span_id",
+        "test_chat_cached",
+        "test_chat_usage",
+    ):
         return "test_chat"
+    if test_name == "test_chat_stream_cached":
+        return "test_chat_stream"
     return test_name
 
 
@@ -0,0 +1,160 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Caches evaluations by what was evaluated, instead of by span. Many spans have
+the same input, output and reference, e.g. the same question answered the same
+way, so only one of them needs a judge call per evaluator.
+
+The key is the evaluator class, a hash of its template, the judge model, the
+judge arguments, e.g. provide_explanation, and the content of the row.
+Changing any of these misses the cache, so results of an older prompt or model
+are never reused. Only labeled results are cached, so failed evaluations are
+retried.
+
+Evaluators with a prefilter method, like OceanEvaluator, label what they can
+with rules first. Only the rows they leave unlabeled go to the judge.
+"""
+
+import hashlib
+import json
+import os
+from typing import Callable, Optional
+
+import pandas as pd
+from phoenix.evals import LLMEvaluator, run_evals
+from response_cache import SQLiteCache
+
+COLUMNS = ["input", "output", "reference"]
+RESULT_COLUMNS = ["label", "score", "explanation", "path"]
+# Judge arguments which don't change the evaluation, so aren't part of the key.
+UNKEYED_KWARGS = {"concurrency", "verbose"}
+
+
+def _hash(value) -> str:
+    payload = json.dumps(
+        value, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def template_hash(evaluator: LLMEvaluator) -> str:
+    template = evaluator._template
+    return _hash(
+        [
+            [part.template for part in template.template],
+            [part.template for part in template.explanation_template or []],
+            template.rails,
+            template._scores,
+        ]
+    )
+
+
+def eval_key(
+    evaluator: LLMEvaluator, content: str, judge=None, **kwargs
+) -> str:
+    """Returns a stable hash of everything that affects the evaluation,
+    including the judge arguments kwargs."""
+    key = [
+        type(evaluator).__qualname__,
+        template_hash(evaluator),
+        evaluator._model.model,
+        content,
+    ]
+    if kwargs := {k: v for k, v in kwargs.items() if k not in UNKEYED_KWARGS}:
+        key.append(kwargs)
+    # A judge other than run_evals, e.g. CombinedJudge, has its own prompt.
+    if (template := getattr(judge, "template", None)) is not None:
+        key.append(template)
+    return _hash(key)
+
+
+class EvalCache(SQLiteCache):
+    """Evaluation results on disk, so they are reused across runs."""
+
+    @classmethod
+    def from_env(cls) -> Optional["EvalCache"]:
+        """Returns a cache at EVAL_CACHE_PATH, or None if it is empty."""
+        if not (path := os.getenv("EVAL_CACHE_PATH", "eval_cache.db")):
+            return None
+        ttl = float(os.getenv("EVAL_CACHE_TTL", str(30 * 86400)))
+        return cls(path, ttl=ttl)
+
+
+def _records(dataframe: pd.DataFrame) -> list[dict]:
+    """Returns result rows via JSON, so they have no numpy types, and NaN is
+    None."""
+    dataframe = dataframe.reindex(columns=RESULT_COLUMNS)
+    return json.loads(dataframe.to_json(orient="records"))
+
+
+def run_cached_evals(
+    dataframe: pd.DataFrame,
+    evaluators: list[LLMEvaluator],
+    cache: Optional[EvalCache] = None,
+    judge: Optional[Callable[..., list[pd.DataFrame]]] = None,
+    **kwargs,
+) -> list[pd.DataFrame]:
+    """Like run_evals, but evaluates each distinct row once, and only if the
+    evaluator's prefilter can't label it and it isn't in the cache. The rest
+    are evaluated by judge, which has the signature of run_evals and defaults
+    to it. Results are fanned out to every row with the same content, with a
+    path column of "rule" or "llm" for what labeled them."""
+    judge = judge or run_evals
+    columns = [c for c in COLUMNS if c in dataframe]
+    contents = [_hash(row) for row in dataframe[columns].to_dict("records")]
+    first = {}  # content to the position of the first row with it
+    for position, content in enumerate(contents):
+        first.setdefault(content, position)
+    unique = dataframe.iloc[list(first.values())]
+
+    results = [{} for _ in evaluators]  # content to result, per evaluator
+    needs = {}  # content to the evaluators which need the judge for it
+    for i, evaluator in enumerate(evaluators):
+        if prefilter := getattr(evaluator, "prefilter", None):
+            for content, row in zip(first, _records(prefilter(unique))):
+                if row["label"] is not None:
+                    results[i][content] = row
+        for content in first:
+            if content in results[i]:
+                continue
+            if cache is not None and (
+                cached := cache.get(
+                    eval_key(evaluator, content, judge, **kwargs)
+                )
+            ):
+                results[i][content] = json.loads(cached)
+            else:
+                needs.setdefault(content, []).append(i)
+
+    # Rows needing the same evaluators are judged together, concurrently.
+    groups = {}
+    for content, indices in needs.items():
+        groups.setdefault(tuple(indices), []).append(first[content])
+    for indices, positions in groups.items():
+        positions.sort()
+        evals = judge(
+            dataframe=dataframe.iloc[positions],
+            evaluators=[evaluators[i] for i in indices],
+            **kwargs,
+        )
+        for i, evaluated in zip(indices, evals):
+            for position, row in zip(positions, _records(evaluated)):
+                if row["label"] is None:
+                    continue  # failed, so retried next time
+                content = contents[position]
+                results[i][content] = row | {"path": "llm"}
+                if cache is not None:
+                    key = eval_key(evaluators[i], content, judge, **kwargs)
+                    cache.put(key, json.dumps(results[i][content]))
+
+    failed = dict.fromkeys(RESULT_COLUMNS) | {"path": "llm"}
+    return [
+        pd.DataFrame(
+            [result.get(content, failed) for content in contents],
+            index=dataframe.index,
+            columns=RESULT_COLUMNS,
+        )
+        for result in results
+    ]
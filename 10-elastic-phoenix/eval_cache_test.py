@@ -0,0 +1,83 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import eval_cache
+import pandas as pd
+from eval_cache import EvalCache, run_cached_evals
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import OpenAIModel, QAEvaluator
+
+question = "Which ocean contains Bouvet Island?"
+
+
+class FakeRunEvals:
+    """Labels rows "correct", except those with failing output."""
+
+    def __init__(self):
+        self.rows = []
+
+    def __call__(self, dataframe, evaluators, **kwargs):
+        self.rows.append(list(dataframe.index))
+        labels = [
+            None if output == "failing" else "correct"
+            for output in dataframe["output"]
+        ]
+        return [
+            pd.DataFrame(
+                {"label": labels, "score": 1, "explanation": "ok"},
+                index=dataframe.index,
+            )
+            for _ in evaluators
+        ]
+
+
+def spans(outputs):
+    return pd.DataFrame(
+        {"input": question, "output": outputs, "reference": "Atlantic Ocean"},
+        index=pd.Index([f"span{i}" for i in range(len(outputs))]),
+    )
+
+
+def evaluators(model="o3-mini"):
+    eval_model = OpenAIModel(model=model)
+    return [QAEvaluator(eval_model), OceanEvaluator(eval_model)]
+
+
+def test_run_cached_evals(monkeypatch, tmp_path, default_openai_env):
+    fake_run_evals = FakeRunEvals()
+    monkeypatch.setattr(eval_cache, "run_evals", fake_run_evals)
+    path = str(tmp_path / "eval_cache.db")
+    outputs = ["Atlantic Ocean", "Indian Ocean", "Atlantic Ocean", "failing"]
+
+    # Rows with the same content are evaluated once, then fanned out.
+    qa, ocean = run_cached_evals(spans(outputs), evaluators(), EvalCache(path))
+    assert fake_run_evals.rows == [["span0", "span1"], ["span3"]]
+    assert list(qa.index) == ["span0", "span1", "span2", "span3"]
+    assert list(qa["label"]) == ["correct"] * 3 + [None]
+    assert qa.loc["span2"].to_dict() == {
+        "label": "correct",
+        "score": 1,
+        "explanation": "ok",
+        "path": "llm",
+    }
+    # The ocean evaluator labeled the answer naming no ocean by rule.
+    assert list(ocean["label"]) == ["correct"] * 3 + ["incorrect"]
+    assert list(ocean["path"]) == ["llm"] * 3 + ["rule"]
+
+    # Later runs only evaluate what failed, or isn't in the cache yet.
+    outputs = ["Atlantic Ocean", "Southern Ocean", "failing"]
+    run_cached_evals(spans(outputs), evaluators(), EvalCache(path))
+    assert fake_run_evals.rows[2:] == [["span1"], ["span2"]]
+
+    # A different judge model doesn't reuse results.
+    run_cached_evals(spans(outputs[:1]), evaluators("gpt-4o"), EvalCache(path))
+    assert fake_run_evals.rows[4:] == [["span0"]]
+
+    # Nor do results judged with other arguments, e.g. without explanations.
+    kwargs = {"provide_explanation": True, "concurrency": 4}
+    for _ in range(2):
+        run_cached_evals(
+            spans(outputs[:1]), evaluators(), EvalCache(path), **kwargs
+        )
+    assert fake_run_evals.rows[5:] == [["span0"]]
@@ -0,0 +1,330 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Runs eval_job.py continuously, so spans are evaluated soon after they are
+exported, instead of once a minute. Run it like this:
+    python eval_job.py --daemon
+
+Spans are fetched, evaluated and logged in a pipeline: one thread fetches the
+next window of spans, split into chunks of EVAL_CHUNK_SIZE (default 100), and
+another logs the evaluations of the last chunk, while the current chunk is
+judged. The queues between them hold at most EVAL_QUEUE_SIZE chunks
+(default 2), so a slow judge or Phoenix holds back fetching, instead of
+buffering spans without limit. The watermark is saved as each chunk is logged,
+in order, so a crash only re-evaluates the chunks in flight.
+
+When there are no new spans, polling backs off from EVAL_POLL_MIN seconds
+(default 1), doubling up to EVAL_POLL_MAX (default 30). Lower EVAL_SETTLE for
+fresher evaluations, as long as spans are exported within it.
+
+SIGTERM or SIGINT stop fetching, and the chunks already fetched are evaluated
+and logged before exiting. The lag of the watermark behind now and the queued
+chunks are exported as metrics. Set EVAL_HEALTH_PORT to serve them at /health,
+which fails once the watermark hasn't moved for EVAL_STALL_TIMEOUT seconds
+(default 300).
+"""
+
+import copy
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import phoenix as px
+from eval_cache import EvalCache
+from eval_job import (
+    chunks,
+    fetch_retries,
+    judge_spans,
+    select,
+    setup,
+    span_query,
+)
+from eval_sampling import Sampler
+from eval_shard import Shard
+from eval_watermark import Watermark
+from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
+from phoenix.evals import LLMEvaluator
+
+_daemons: weakref.WeakSet["EvalDaemon"] = weakref.WeakSet()
+
+
+def _observe_lag(options: CallbackOptions):
+    for daemon in _daemons:
+        yield Observation(daemon.lag())
+
+
+def _observe_queued(options: CallbackOptions):
+    for daemon in _daemons:
+        for stage, queued in daemon.queued().items():
+            yield Observation(queued, {"eval.stage": stage})
+
+
+meter = metrics.get_meter(__name__)
+meter.create_observable_gauge(
+    "eval.lag",
+    callbacks=[_observe_lag],
+    unit="s",
+    description="Time since the start of the watermark of the eval daemon.",
+)
+meter.create_observable_up_down_counter(
+    "eval.queued_chunks",
+    callbacks=[_observe_queued],
+    unit="{chunk}",
+    description="Chunks of spans waiting for the evaluate or log stage.",
+)
+spans_counter = meter.create_counter(
+    "eval.spans",
+    unit="{span}",
+    description="Spans evaluated by the eval daemon, by outcome.",
+)
+
+
+class EvalDaemon:
+    """Fetches, evaluates and logs spans until stop is called. The judge is
+    called from the thread calling run."""
+
+    def __init__(
+        self,
+        phoenix_client,
+        evaluators: list[LLMEvaluator],
+        judge: Callable,
+        cache: Optional[EvalCache] = None,
+        shard: Optional[Shard] = None,
+        sampler: Optional[Sampler] = None,
+    ) -> None:
+        self.phoenix_client = phoenix_client
+        self.evaluators = evaluators
+        self.judge = judge
+        self.cache = cache
+        self.shard = shard
+        self.sampler = sampler
+        self.query = span_query()
+        self.watermark = Watermark.load(
+            shard.watermark_path() if shard else None
+        )
+        self.poll_min = float(os.getenv("EVAL_POLL_MIN", "1"))
+        self.poll_max = float(os.getenv("EVAL_POLL_MAX", "30"))
+        self.stall_timeout = float(os.getenv("EVAL_STALL_TIMEOUT", "300"))
+        self.chunk_size = int(os.getenv("EVAL_CHUNK_SIZE", "100"))
+        size = int(os.getenv("EVAL_QUEUE_SIZE", "2"))
+        self._fetched: queue.Queue = queue.Queue(size)
+        self._evaluated: queue.Queue = queue.Queue(size)
+        self._stop = threading.Event()
+        # The log thread updates the watermark, while the fetch thread takes
+        # failed spans to retry from it.
+        self._lock = threading.Lock()
+        self._progress = time.monotonic()  # when the watermark last moved
+        self.evaluated = self.failed = 0
+        _daemons.add(self)
+
+    def stop(self) -> None:
+        """Stops fetching. run returns once fetched spans are logged."""
+        self._stop.set()
+
+    def run(self) -> None:
+        threads = [
+            threading.Thread(
+                target=self._fetch, name="eval-fetch", daemon=True
+            ),
+            threading.Thread(target=self._log, name="eval-log", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self._evaluate()
+        finally:
+            self._stop.set()
+            self._evaluated.put(None)
+            threads[1].join()
+
+    def lag(self) -> float:
+        """Returns seconds between now and the start of the watermark."""
+        now = datetime.now(timezone.utc)
+        return (now - self.watermark.start_time).total_seconds()
+
+    def queued(self) -> dict[str, int]:
+        return {
+            "evaluate": self._fetched.qsize(),
+            "log": self._evaluated.qsize(),
+        }
+
+    def health(self) -> dict:
+        stalled = time.monotonic() - self._progress > self.stall_timeout
+        return {
+            "status": "stalled" if stalled else "ok",
+            "lag_seconds": round(self.lag(), 3),
+            "queued_chunks": self.queued(),
+            "spans_evaluated": self.evaluated,
+            "spans_failed": self.failed,
+        }
+
+    def _backoff(self, delay: float) -> float:
+        """Waits delay, or until stopped, returning the next delay."""
+        self._stop.wait(delay)
+        return min(delay * 2, self.poll_max)
+
+    def _fetch(self) -> None:
+        # The cursor moves as soon as spans are fetched, while the watermark
+        # only moves once their evaluations are logged.
+        cursor = copy.deepcopy(self.watermark)
+        delay = self.poll_min
+        try:
+            while not self._stop.is_set():
+                start = cursor.start_time
+                try:
+                    spans, end = cursor.fetch(self.phoenix_client, self.query)
+                except Exception as e:
+                    print(f"Fetching spans failed: {e!r}", flush=True)
+                    delay = self._backoff(delay)
+                    continue
+                # Windows without spans are passed on too, so the watermark
+                # keeps up with now while idle.
+                if end > start:
+                    # Only the last chunk of a window moves the watermark.
+                    chunked = chunks(spans, self.chunk_size)
+                    for chunk in chunked[:-1]:
+                        self._fetched.put((chunk, None, False))
+                    self._fetched.put((chunked[-1], end, False))
+                    cursor.advance(end)
+                if spans.empty:
+                    self._retry()
+                    delay = self._backoff(delay)
+                else:
+                    delay = self.poll_min
+        finally:
+            self._fetched.put(None)
+
+    def _retry(self) -> None:
+        """Queues spans which failed before and are due another attempt, as
+        described in eval_watermark.py."""
+        with self._lock:
+            retries = self.watermark.take_retries()
+        try:
+            spans = fetch_retries(self.phoenix_client, retries)
+        except Exception as e:
+            print(f"Fetching spans to retry failed: {e!r}", flush=True)
+            return
+        with self._lock:
+            # Spans no longer in Phoenix can't succeed, so count as failed.
+            self.watermark.record_failed(set(retries) - set(spans.index))
+        if not spans.empty:
+            for chunk in chunks(spans, self.chunk_size):
+                self._fetched.put((chunk, None, True))
+
+    def _evaluate(self) -> None:
+        while (chunk := self._fetched.get()) is not None:
+            spans, end, retry = chunk
+            span_evaluations, failed = [], set()
+            # Retried spans are of this shard, and were sampled already.
+            shard = None if retry else self.shard
+            if not (mine := select(spans, shard)).empty:
+                if self.sampler is not None and not retry:
+                    mine, span_evaluations = self.sampler.sample(
+                        self.phoenix_client, mine
+                    )
+                judged, failed = judge_spans(
+                    self.evaluators, mine, self.cache, self.judge
+                )
+                span_evaluations += judged
+                spans_counter.add(
+                    len(mine) - len(failed), {"eval.outcome": "evaluated"}
+                )
+                spans_counter.add(len(failed), {"eval.outcome": "failed"})
+                self.evaluated += len(mine)
+                self.failed += len(failed)
+            self._evaluated.put((spans, end, span_evaluations, failed))
+
+    def _log(self) -> None:
+        lost = False
+        while (chunk := self._evaluated.get()) is not None:
+            spans, end, span_evaluations, failed = chunk
+            # Once a chunk isn't logged, later ones mustn't move the watermark
+            # past it, so its spans are fetched again on the next start.
+            if lost or not self._log_evaluations(span_evaluations):
+                lost = True
+                continue
+            with self._lock:
+                self.watermark.record_evaluated(spans.index.difference(failed))
+                self.watermark.record_failed(failed)
+                if end is not None:
+                    self.watermark.advance(end)
+                self.watermark.save()
+            self._progress = time.monotonic()
+
+    def _log_evaluations(self, span_evaluations) -> bool:
+        """Logs evaluations, retrying until done or stopped."""
+        delay = self.poll_min
+        while True:
+            try:
+                if span_evaluations:
+                    self.phoenix_client.log_evaluations(*span_evaluations)
+                return True
+            except Exception as e:
+                print(f"Logging evaluations failed: {e!r}", flush=True)
+                if self._stop.is_set():
+                    return False
+                delay = self._backoff(delay)
+
+
+def serve_health(daemon: EvalDaemon, port: int) -> ThreadingHTTPServer:
+    """Serves the health of daemon at /health in a background thread."""
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_error(404)
+                return
+            health = daemon.health()
+            body = json.dumps(health).encode()
+            self.send_response(200 if health["status"] == "ok" else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # probes would flood the output
+
+    server = ThreadingHTTPServer(("", port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_daemon() -> None:
+    phoenix_client = px.Client()
+    evaluators, runner, judge = setup()
+    daemon = EvalDaemon(
+        phoenix_client,
+        evaluators,
+        judge,
+        EvalCache.from_env(),
+        Shard.from_env(),
+        Sampler.from_env(evaluators, judge, periodic=True),
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: daemon.stop())
+    server = None
+    if port := os.getenv("EVAL_HEALTH_PORT"):
+        server = serve_health(daemon, int(port))
+
+    started = time.perf_counter()
+    try:
+        daemon.run()
+    finally:
+        runner.close()
+        if server:
+            server.shutdown()
+    elapsed = time.perf_counter() - started
+    print(f"Evaluations of {daemon.evaluated} spans logged to Phoenix")
+    if daemon.evaluated:
+        print(f"Evaluated {runner.stats.summary(daemon.evaluated, elapsed)}")
@@ -0,0 +1,104 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from eval_daemon import EvalDaemon
+from eval_job import setup
+from eval_job_test import FakeSpansClient, fake_judge
+from eval_watermark import Watermark
+from judge_runner import JudgeRunner
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_daemon_evaluates_new_spans(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    now = datetime.now(timezone.utc)
+    client = FakeSpansClient(
+        {
+            span_id: now - timedelta(minutes=minutes)
+            for span_id, minutes in (("a", 10), ("b", 9), ("c", 8))
+        }
+    )
+    logged = []
+    client.log_evaluations = lambda *evals: logged.extend(
+        evals[0].dataframe.index
+    )
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    path = str(tmp_path / "watermark.json")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", path)
+    monkeypatch.setenv("EVAL_CHUNK_SIZE", "2")
+    monkeypatch.setenv("EVAL_SETTLE", "0")
+    monkeypatch.setenv("EVAL_POLL_MIN", "0.01")
+    monkeypatch.setenv("EVAL_POLL_MAX", "0.05")
+
+    evaluators, runner, judge = setup()
+    daemon = EvalDaemon(client, evaluators, judge)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        wait_for(lambda: len(logged) == 3)
+        # Spans exported while running are evaluated on a later poll.
+        client.spans["d"] = datetime.now(timezone.utc)
+        wait_for(lambda: len(logged) == 4)
+        assert daemon.health()["status"] == "ok"
+    finally:
+        daemon.stop()
+        thread.join(timeout=10)
+        runner.close()
+
+    assert not thread.is_alive()
+    assert logged == ["a", "b", "c", "d"]
+    assert daemon.evaluated == 4 and daemon.failed == 1
+    watermark = Watermark.load(path)
+    assert list(watermark.failed) == ["b"]
+    assert watermark.start_time > client.spans["d"]
+
+
+def test_daemon_stalls_while_logging_fails(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    client = FakeSpansClient(
+        {"a": datetime.now(timezone.utc) - timedelta(minutes=10)}
+    )
+    attempts = []
+
+    def log_evaluations(*evals):
+        attempts.append(evals)
+        raise ConnectionError("Phoenix is down")
+
+    client.log_evaluations = log_evaluations
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    path = str(tmp_path / "watermark.json")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", path)
+    monkeypatch.setenv("EVAL_SETTLE", "0")
+    monkeypatch.setenv("EVAL_POLL_MIN", "0.01")
+    monkeypatch.setenv("EVAL_POLL_MAX", "0.05")
+    monkeypatch.setenv("EVAL_STALL_TIMEOUT", "0")
+
+    evaluators, runner, judge = setup()
+    daemon = EvalDaemon(client, evaluators, judge)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        wait_for(lambda: len(attempts) > 1)  # retried
+        assert daemon.health()["status"] == "stalled"
+    finally:
+        daemon.stop()
+        thread.join(timeout=10)
+        runner.close()
+
+    # Shutdown gives up on logging, without moving the watermark past "a".
+    assert not thread.is_alive()
+    watermark = Watermark.load(path)
+    assert watermark.start_time < client.spans["a"]
@@ -3,80 +3,268 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 """
-Queries Phoenix for spans within the last minute. Computes and logs evaluations
-back to Phoenix. This script is intended to run once a minute as a cron job.
+Queries Phoenix for spans since the last run. Computes and logs evaluations
+back to Phoenix. This script is intended to run once a minute as a cron job,
+or continuously with --daemon, as described in eval_daemon.py. Replicas can
+run at the same time, each evaluating a share of the spans, as described in
+eval_shard.py. At high volume, evaluate a sample of spans instead, as described
+in eval_sampling.py.
 """
 
 import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
 
+import pandas as pd
 import phoenix as px
 from phoenix.evals import (
     HallucinationEvaluator,
+    LLMEvaluator,
     QAEvaluator,
     OpenAIModel,
-    run_evals,
 )
+from combined_evaluator import CombinedJudge
 from dotenv import load_dotenv
+from eval_cache import EvalCache, run_cached_evals
+from eval_sampling import Sampler
+from eval_shard import Shard
+from eval_watermark import Watermark
+from judge_runner import JudgeRunner
 from ocean_evaluator import OceanEvaluator
+from tiered_judge import TieredJudge
 
 from phoenix.trace import SpanEvaluations
 from phoenix.trace.dsl import SpanQuery
 
 
-def main():
-    # Load environment variables used by Phoenix
-    load_dotenv(dotenv_path="../.env", override=False)
+EVAL_NAMES = ["QA Eval", "Hallucination Eval", "Ocean Eval"]
+# All spans are evaluated against the same reference. A real job would look up
+# reference answers vs hard-coding one.
+REFERENCE = "Atlantic Ocean"
 
-    # Note: We don't trace this job as evaluation would result in spans which
-    # would be evaluated by this job, creating an infinite loop.
 
-    phoenix_client = px.Client()
+def setup() -> tuple[list[LLMEvaluator], JudgeRunner, Callable]:
+    """Returns the evaluators, the runner of their judge calls, and the judge
+    to evaluate spans with. Close the runner when done."""
     eval_model = OpenAIModel(
         model=os.getenv("EVAL_MODEL", "o3-mini"), temperature=0.0
     )
+    evaluators = [
+        # "Generic" (built-in) evaluators
+        QAEvaluator(eval_model),
+        HallucinationEvaluator(eval_model),
+        # "Application-specific" (from error analysis) evaluators
+        OceanEvaluator(eval_model),
+    ]
+    # Judge calls share one connection pool, with limits per evaluator and
+    # judge model. See judge_runner.py for their ENV variables.
+    runner = JudgeRunner()
+    # EVAL_JUDGE=combined judges all evaluators in one call per span, instead
+    # of one call per evaluator. The evaluations are logged the same way.
+    judge = runner
+    if os.getenv("EVAL_JUDGE") == "combined":
+        judge = CombinedJudge(runner)
+    # EVAL_EXPLAIN=failing judges labels first, and only asks for explanations
+    # of those which didn't pass, as described in tiered_judge.py.
+    if os.getenv("EVAL_EXPLAIN") == "failing":
+        judge = TieredJudge(judge)
+    return evaluators, runner, judge
 
-    # Lookup LLM spans missing evals. A real job would be more specific in the
-    # query and look up reference answers vs hard-coding one.
-    reference = "Atlantic Ocean"
-    query = (
+
+SPAN_COLUMNS = {
+    "input": "llm.input_messages",
+    "output": "llm.output_messages",
+    "start_time": "start_time",  # for the watermark
+    "model": "llm.model_name",  # for stratified sampling
+    "status_code": "status_code",  # errors are always evaluated
+}
+
+
+def span_query() -> SpanQuery:
+    """Returns the query for LLM spans missing evals. A real job would be more
+    specific."""
+    return (
         SpanQuery()
         .where(
             "span_kind == 'LLM' and evals['QA Eval'].label is None and evals['Hallucination Eval'].label is None and evals['Ocean Eval'].label is None",
         )
-        .select(
-            input="llm.input_messages",
-            output="llm.output_messages",
-        )
+        .select(**SPAN_COLUMNS)
     )
-    spans = phoenix_client.query_spans(query)
-    if spans.empty:
-        print("No spans found for evaluation.")
-        return
 
-    # All spans are evaluated against the same reference
-    spans["reference"] = reference  # ignored by OceanEvaluator
-    qa_eval, hallucination_eval, ocean_eval = run_evals(
-        dataframe=spans,
-        evaluators=[
-            # "Generic" (built-in) evaluators
-            QAEvaluator(eval_model),
-            HallucinationEvaluator(eval_model),
-            # "Application-specific" (from error analysis) evaluators
-            OceanEvaluator(eval_model),
-        ],
-        provide_explanation=True,
+
+def fetch_retries(phoenix_client, span_ids: list[str]) -> pd.DataFrame:
+    """Returns the spans of span_ids, e.g. which failed evaluation before.
+    Those which are partly evaluated are returned too."""
+    if not span_ids:
+        return pd.DataFrame()
+    query = (
+        SpanQuery()
+        .where(f"span_kind == 'LLM' and span_id in {list(span_ids)!r}")
+        .select(**SPAN_COLUMNS)
     )
+    spans = phoenix_client.query_spans(query, limit=None)
+    if spans is None or spans.empty:
+        return pd.DataFrame()
+    return spans[spans.index.isin(span_ids)]
 
-    # Annotate the eval response, regardless of pass or fail to the trace. This
-    # ensures we don't redundantly process the same trace later.
-    phoenix_client.log_evaluations(
-        SpanEvaluations(eval_name="QA Eval", dataframe=qa_eval),
-        SpanEvaluations(
-            eval_name="Hallucination Eval", dataframe=hallucination_eval
-        ),
-        SpanEvaluations(eval_name="Ocean Eval", dataframe=ocean_eval),
+
+def select(spans: pd.DataFrame, shard: Optional[Shard]) -> pd.DataFrame:
+    """Returns the spans of a fetch to evaluate: those of shard, if set."""
+    mine = spans
+    if shard and not spans.empty:
+        mine = spans[shard.owns(spans.index)]
+    mine = mine.copy()
+    mine["reference"] = REFERENCE  # ignored by OceanEvaluator
+    return mine
+
+
+def chunks(spans: pd.DataFrame, size: int) -> list[pd.DataFrame]:
+    """Splits spans into chunks of at most size, returning one if empty."""
+    return [spans[i : i + size] for i in range(0, max(len(spans), 1), size)]
+
+
+def judge_spans(
+    evaluators, spans, cache=None, judge=None
+) -> tuple[list[SpanEvaluations], set[str]]:
+    """Evaluates spans, returning evaluations to log to Phoenix and ids of
+    spans which failed evaluation."""
+    if spans.empty:
+        return [], set()
+    evals = run_cached_evals(
+        spans,
+        evaluators,
+        cache,
+        judge,
+        provide_explanation=True,
     )
-    print("Evaluations logged to Phoenix")
+
+    # Annotate the eval response, regardless of pass or fail to the trace.
+    # Evals without a label failed, e.g. the model errored, so they are
+    # recorded in the watermark instead.
+    failed = set()
+    span_evaluations = []
+    for eval_name, dataframe in zip(EVAL_NAMES, evals):
+        failed.update(dataframe.index[dataframe["label"].isna()])
+        labeled = dataframe.dropna(subset=["label"]).copy()
+        # Phoenix only keeps the label, score and explanation of evaluations,
+        # so rows labeled by rule, instead of the judge, say so in the last.
+        rule = labeled["path"] == "rule"
+        labeled.loc[rule, "explanation"] = "Labeled by rule: " + labeled.loc[
+            rule, "explanation"
+        ].fillna("")
+        if not labeled.empty:
+            span_evaluations.append(
+                SpanEvaluations(eval_name=eval_name, dataframe=labeled)
+            )
+    return span_evaluations, failed
+
+
+def evaluate(
+    phoenix_client, evaluators, spans, cache=None, judge=None, sampler=None
+) -> tuple[int, set[str]]:
+    """Evaluates spans, or a sample of them, and logs the evaluations to
+    Phoenix, returning how many were evaluated and ids of those which
+    failed."""
+    span_evaluations = []
+    if sampler is not None:
+        spans, span_evaluations = sampler.sample(phoenix_client, spans)
+    judged, failed = judge_spans(evaluators, spans, cache, judge)
+    span_evaluations += judged
+    if span_evaluations:
+        phoenix_client.log_evaluations(*span_evaluations)
+    return len(spans), failed
+
+
+def main():
+    # Load environment variables used by Phoenix
+    load_dotenv(dotenv_path="../.env", override=False)
+
+    # Note: We don't trace this job as evaluation would result in spans which
+    # would be evaluated by this job, creating an infinite loop.
+
+    if "--daemon" in sys.argv:
+        from eval_daemon import run_daemon
+
+        run_daemon()
+        return
+
+    phoenix_client = px.Client()
+    evaluators, runner, judge = setup()
+    query = span_query()
+
+    # Evaluate and log spans a chunk at a time, so judging memory is bounded
+    # and a crash only loses the evaluations of the current chunk. Windows are
+    # fetched with EVAL_FETCH_LIMIT, as described in eval_watermark.py.
+    chunk_size = int(os.getenv("EVAL_CHUNK_SIZE", "100"))
+    max_spans = int(os.getenv("EVAL_LIMIT", "1000"))
+    # Replicas with the same EVAL_SHARD_COUNT split spans between them.
+    shard = Shard.from_env()
+    watermark = Watermark.load(shard.watermark_path() if shard else None)
+    # Spans with the same content share evaluations, within and across runs.
+    cache = EvalCache.from_env()
+    # EVAL_SAMPLING and EVAL_BUDGET_* limit the spans judged by this run.
+    sampler = Sampler.from_env(evaluators, judge)
+    now = datetime.now(timezone.utc)  # spans after this are for the next run
+    evaluated = failures = 0
+    started = time.perf_counter()
+    try:
+        # Spans which failed before are tried again, as described in
+        # eval_watermark.py. They were sampled already, so aren't again.
+        retries = watermark.take_retries()
+        spans = fetch_retries(phoenix_client, retries)
+        # Spans no longer in Phoenix can't succeed, so count as failed.
+        watermark.record_failed(set(retries) - set(spans.index))
+        for chunk in chunks(spans, chunk_size):
+            if not chunk.empty:
+                count, failed = evaluate(
+                    phoenix_client,
+                    evaluators,
+                    select(chunk, None),
+                    cache,
+                    judge,
+                )
+                watermark.record_evaluated(chunk.index.difference(failed))
+                watermark.record_failed(failed)
+                evaluated += count
+                failures += len(failed)
+        watermark.save()
+
+        while evaluated < max_spans:
+            start = watermark.start_time
+            spans, end = watermark.fetch(phoenix_client, query, now=now)
+            if end <= start:
+                break  # caught up
+
+            for chunk in chunks(spans, chunk_size):
+                if evaluated >= max_spans:
+                    # Spans of this window already logged have evals, so
+                    # the query skips them next run.
+                    break
+                if not (mine := select(chunk, shard)).empty:
+                    count, failed = evaluate(
+                        phoenix_client, evaluators, mine, cache, judge, sampler
+                    )
+                    watermark.record_failed(failed)
+                    evaluated += count
+                    failures += len(failed)
+            else:
+                # Only move past the window once its evaluations are logged.
+                # Spans of other shards are passed too, as those evaluate them.
+                watermark.advance(end)
+            watermark.save()
+    finally:
+        runner.close()
+    elapsed = time.perf_counter() - started
+
+    if not evaluated:
+        print("No spans found for evaluation.")
+        return
+    print(f"Evaluations of {evaluated} spans logged to Phoenix")
+    print(f"Evaluated {runner.stats.summary(evaluated, elapsed)}")
+    if failures:
+        print(f"{failures} spans failed evaluation")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+from datetime import datetime, timedelta, timezone
+
+import eval_job
+import pandas as pd
+from eval_watermark import Watermark
+from eval_watermark_test import FakePhoenixClient
+from judge_runner import JudgeRunner
+
+
+class FakeSpansClient(FakePhoenixClient):
+    def query_spans(self, *args, **kwargs):
+        spans = super().query_spans(*args, **kwargs)
+        spans["input"] = spans.index  # so spans aren't deduplicated
+        return spans
+
+
+def fake_judge(self, dataframe, evaluators, provide_explanation):
+    # Span "b" fails the Ocean Eval, e.g. as the model returned an error.
+    labels = ["correct"] * len(dataframe)
+    ocean = [None if i == "b" else "correct" for i in dataframe.index]
+    return [
+        pd.DataFrame({"label": labels}, index=dataframe.index),
+        pd.DataFrame({"label": labels}, index=dataframe.index),
+        pd.DataFrame({"label": ocean}, index=dataframe.index),
+    ]
+
+
+def test_main_evaluates_in_chunks(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    now = datetime.now(timezone.utc)
+    client = FakeSpansClient(
+        {
+            span_id: now - timedelta(minutes=minutes)
+            for span_id, minutes in (("a", 10), ("b", 9), ("c", 8))
+        }
+    )
+    logged = []
+    client.log_evaluations = lambda *evals: logged.append(
+        {e.eval_name: list(e.dataframe.index) for e in evals}
+    )
+    monkeypatch.setattr(eval_job.px, "Client", lambda: client)
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    path = str(tmp_path / "watermark.json")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", path)
+    monkeypatch.setenv("EVAL_CACHE_PATH", str(tmp_path / "eval_cache.db"))
+    monkeypatch.setenv("EVAL_CHUNK_SIZE", "2")
+
+    eval_job.main()
+
+    # Each chunk is logged as soon as it is evaluated.
+    assert len(logged) > 1
+    qa_evals = [i for chunk in logged for i in chunk["QA Eval"]]
+    ocean_evals = [i for chunk in logged for i in chunk.get("Ocean Eval", [])]
+    assert qa_evals == ["a", "b", "c"]
+    assert ocean_evals == ["a", "c"]
+
+    watermark = Watermark.load(path)
+    assert list(watermark.failed) == ["b"]
+    assert watermark.start_time > now - timedelta(minutes=1)
+
+
+def test_main_shards_split_spans(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    now = datetime.now(timezone.utc)
+    client = FakeSpansClient(
+        {f"span{i}": now - timedelta(minutes=10, seconds=i) for i in range(10)}
+    )
+    logged = []
+    client.log_evaluations = lambda *evals: logged.extend(
+        evals[0].dataframe.index
+    )
+    monkeypatch.setattr(eval_job.px, "Client", lambda: client)
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", str(tmp_path / "watermark.json"))
+    monkeypatch.setenv("EVAL_CACHE_PATH", "")
+    monkeypatch.setenv("EVAL_CHUNK_SIZE", "3")
+    monkeypatch.setenv("EVAL_SHARD_COUNT", "2")
+
+    by_shard = []
+    for index in ("0", "1"):
+        monkeypatch.setenv("EVAL_SHARD_INDEX", index)
+        eval_job.main()
+        by_shard.append(set(logged))
+        logged.clear()
+
+    # Each span is evaluated by exactly one of the replicas.
+    assert by_shard[0] and by_shard[1]
+    assert by_shard[0].isdisjoint(by_shard[1])
+    assert by_shard[0] | by_shard[1] == set(client.spans)
+    assert len(list(tmp_path.glob("watermark-*-of-2.json"))) == 2
+
+
+def test_main_continues_past_failed_spans(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    now = datetime.now(timezone.utc)
+    earlier = now - timedelta(hours=3)
+    client = FakeSpansClient(
+        {
+            "a": earlier + timedelta(minutes=1),
+            "b": earlier + timedelta(minutes=1),
+            "c": now - timedelta(minutes=10),
+        }
+    )
+    logged = []
+    client.log_evaluations = lambda *evals: logged.extend(
+        evals[0].dataframe.index
+    )
+    monkeypatch.setattr(eval_job.px, "Client", lambda: client)
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    path = str(tmp_path / "watermark.json")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", path)
+    monkeypatch.setenv("EVAL_CACHE_PATH", "")
+    monkeypatch.setenv("EVAL_FETCH_LIMIT", "2")
+    watermark = Watermark(path, earlier)
+    watermark.record_failed(["a", "b"])
+    watermark.save()
+
+    eval_job.main()
+
+    # A full window of spans which failed before doesn't stop the run.
+    assert logged == ["c"]
+
+
+def test_main_retries_failed_spans(
+    monkeypatch, tmp_path, default_openai_env, default_phoenix_env
+):
+    now = datetime.now(timezone.utc)
+    client = FakeSpansClient({"b": now - timedelta(minutes=10)})
+    logged = []
+    client.log_evaluations = lambda *evals: logged.append(
+        {e.eval_name: list(e.dataframe.index) for e in evals}
+    )
+    monkeypatch.setattr(eval_job.px, "Client", lambda: client)
+    monkeypatch.setattr(JudgeRunner, "__call__", fake_judge)
+    path = str(tmp_path / "watermark.json")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", path)
+    monkeypatch.setenv("EVAL_CACHE_PATH", "")
+    monkeypatch.setenv("EVAL_RETRY_DELAY", "0")
+
+    eval_job.main()
+    assert Watermark.load(path).failed["b"]["attempts"] == 1
+
+    # The next run tries "b" again, though the watermark is past it.
+    def judge_once_more(self, dataframe, evaluators, provide_explanation):
+        labels = pd.DataFrame({"label": "correct"}, index=dataframe.index)
+        return [labels] * len(evaluators)
+
+    monkeypatch.setattr(JudgeRunner, "__call__", judge_once_more)
+    eval_job.main()
+
+    assert logged[-1]["Ocean Eval"] == ["b"]
+    assert not Watermark.load(path).failed
+
+
+def test_judge_spans_records_rule_labels(default_openai_env):
+    evaluators, runner, judge = eval_job.setup()
+    runner.close()
+    spans = pd.DataFrame(
+        {"input": ["q1", "q2"], "output": ["Atlantic Ocean", "No idea."]},
+        index=pd.Index(["a", "b"], name="context.span_id"),
+    )
+
+    def judge_all(dataframe, evaluators, provide_explanation):
+        return [
+            pd.DataFrame(
+                {"label": "correct", "explanation": "step by step"},
+                index=dataframe.index,
+            )
+            for _ in evaluators
+        ]
+
+    span_evaluations, _ = eval_job.judge_spans(
+        evaluators, eval_job.select(spans, None), judge=judge_all
+    )
+
+    # What is logged to Phoenix tells rule labels from those of the judge.
+    (ocean,) = [e for e in span_evaluations if e.eval_name == "Ocean Eval"]
+    assert list(ocean.dataframe["explanation"]) == [
+        "step by step",
+        "Labeled by rule: The answer names no NOAA ocean.",
+    ]
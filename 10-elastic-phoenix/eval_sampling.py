@@ -0,0 +1,378 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Samples the spans eval_job.py evaluates, so the cost of judging follows a
+budget instead of the traffic it measures.
+
+EVAL_SAMPLING selects how spans are sampled:
+* all - every span (default)
+* uniform - each span with probability EVAL_SAMPLE_RATE (default 0.1)
+* reservoir - about EVAL_SAMPLE_SIZE spans (default 10) per EVAL_SAMPLE_WINDOW
+  seconds (default 60) of span start times, as traffic changes
+* stratified - like reservoir, but about EVAL_SAMPLE_SIZE spans per value of
+  the EVAL_SAMPLE_STRATA columns of the span query (default model), so that
+  models with little traffic are still evaluated
+
+Spans with an error status or thumbs-down user feedback are always evaluated.
+Feedback is only seen if given before the span is fetched, so raise
+EVAL_SETTLE to wait longer for it.
+
+EVAL_BUDGET_REQUESTS and EVAL_BUDGET_TOKENS cap the judge calls and tokens
+spent by a run of the cron job, however long it takes. The daemon runs without
+end, so it spends them each EVAL_BUDGET_PERIOD seconds (default 60, like the
+cron job) instead. EVAL_BUDGET_PERIOD is ignored by the cron job.
+Tokens are estimated from the length of the prompts, plus EVAL_OUTPUT_TOKENS
+(default 500) per call. Spans always evaluated are spent on first, and spans
+past the budget are skipped, so lower the sample rate or size if many are.
+
+Each decision is logged as the "Eval Sampling" evaluation of the span. Its
+label is why the span was evaluated or skipped, and its score the weight of
+the span: the inverse of the probability it was evaluated with. Weighting the
+scores of other evals by it, e.g. the mean QA score, estimates them for all
+spans, not only those sampled.
+"""
+
+import hashlib
+import os
+import random
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+from phoenix.evals import LLMEvaluator
+from phoenix.trace import SpanEvaluations
+from phoenix.trace.dsl import SpanQuery
+
+SAMPLING_EVAL_NAME = "Eval Sampling"
+CHARS_PER_TOKEN = 4
+CONTENT_COLUMNS = ["input", "output", "reference"]
+
+
+def feedback_query() -> SpanQuery:
+    return (
+        SpanQuery()
+        .where(
+            "span_kind == 'LLM' and annotations['user feedback'].label == 'thumbs-down'"
+        )
+        .select(start_time="start_time")
+    )
+
+
+class Uniform:
+    """Samples each span with probability rate."""
+
+    def __init__(self, rate: float, rng: Optional[random.Random] = None):
+        if not 0 < rate <= 1:
+            raise ValueError(f"sample rate {rate} not in (0, 1]")
+        self.rate = rate
+        self.random = rng or random.Random()
+
+    def sample(self, spans: pd.DataFrame) -> pd.Series:
+        """Returns the probability each span was sampled with, or 0 if it
+        wasn't."""
+        return pd.Series(
+            [
+                self.rate if self.random.random() < self.rate else 0.0
+                for _ in spans.index
+            ],
+            index=spans.index,
+            dtype=float,
+        )
+
+
+def _uniform(span_id) -> float:
+    """Returns a number in [0, 1) for span_id, which is the same in every
+    process, and uniform across span ids."""
+    digest = hashlib.sha256(str(span_id).encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class Reservoir:
+    """Samples about size spans per window seconds of start time, and per
+    value of the strata columns. A span is sampled if the hash of its id is
+    below the threshold of its window and stratum, so a window split between
+    fetches is sampled as if fetched at once. The threshold is size over the
+    spans of the window before in the stratum, or of the first fetch of the
+    window if there is none, and stays fixed while the window is fetched."""
+
+    def __init__(self, size: int, window: float, strata: tuple[str, ...] = ()):
+        self.size = size
+        self.window = pd.Timedelta(seconds=window)
+        self.strata = strata
+        # By window and stratum, while the window is being fetched.
+        self._thresholds: dict[tuple, float] = {}
+        self._counts: dict[tuple, int] = {}
+        # Spans of the last window which ended, by stratum.
+        self._last: dict[tuple, int] = {}
+
+    def _expected(self, key: tuple, count: int) -> int:
+        """Returns the spans expected in the window and stratum of key: those
+        of the window of the stratum before it, else count."""
+        window, stratum = key[0], key[1:]
+        # Spans are fetched in order of start time, so earlier windows have
+        # every span already.
+        earlier = [
+            k for k in self._counts if k[1:] == stratum and k[0] < window
+        ]
+        if earlier:
+            return self._counts[max(earlier)]
+        return self._last.get(stratum, count)
+
+    def sample(self, spans: pd.DataFrame) -> pd.Series:
+        """Returns the probability each span was sampled with, or 0 if it
+        wasn't."""
+        probabilities = pd.Series(0.0, index=spans.index)
+        if spans.empty:
+            return probabilities
+        windows = pd.to_datetime(spans["start_time"], utc=True).dt.floor(
+            self.window
+        )
+        for key in sorted(k for k in self._counts if k[0] < windows.min()):
+            self._last[key[1:]] = self._counts.pop(key)
+            del self._thresholds[key]
+
+        keys = [windows.rename("window")] + [
+            spans.get(column, pd.Series(None, index=spans.index))
+            .astype(str)
+            .rename(column)
+            for column in self.strata
+        ]
+        for key, ids in spans.groupby(keys).groups.items():
+            key = key if isinstance(key, tuple) else (key,)
+            self._counts[key] = self._counts.get(key, 0) + len(ids)
+            if (threshold := self._thresholds.get(key)) is None:
+                expected = self._expected(key, len(ids))
+                threshold = min(1.0, self.size / expected)
+                self._thresholds[key] = threshold
+            chosen = [i for i in ids if _uniform(i) < threshold]
+            probabilities[chosen] = threshold
+        return probabilities
+
+
+def judge_costs(
+    spans: pd.DataFrame,
+    evaluators: list[LLMEvaluator],
+    judge: Optional[Callable] = None,
+    output_tokens: int = 500,
+) -> pd.DataFrame:
+    """Returns the estimated judge requests and tokens to evaluate each span."""
+    content = sum(
+        spans[column].astype(str).str.len()
+        for column in CONTENT_COLUMNS
+        if column in spans
+    )
+    # A TieredJudge costs at most what the judge it wraps does, as explanations
+    # are only asked of rows which didn't pass.
+    judge = getattr(judge, "judge", judge)
+    # A judge other than run_evals, e.g. CombinedJudge, makes one call per span.
+    if (template := getattr(judge, "template", None)) is not None:
+        calls, prompts = 1, len(template)
+    else:
+        calls = len(evaluators)
+        prompts = sum(
+            len(part.template)
+            for evaluator in evaluators
+            for part in (
+                evaluator._template.explanation_template
+                or evaluator._template.template
+            )
+        )
+    tokens = (prompts + calls * content) / CHARS_PER_TOKEN
+    return pd.DataFrame(
+        {"requests": calls, "tokens": tokens + calls * output_tokens},
+        index=spans.index,
+    )
+
+
+class Budget:
+    """Judge requests and tokens which may be spent each period seconds, or
+    in total if period is None."""
+
+    def __init__(
+        self,
+        max_requests: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        period: Optional[float] = None,
+    ) -> None:
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.period = period
+        self.requests = self.tokens = 0.0
+        self._started = time.monotonic()
+
+    @classmethod
+    def from_env(cls, periodic: bool = False) -> Optional["Budget"]:
+        """Returns the budget configured by ENV variables, or None if there
+        is no limit. Only a periodic budget, e.g. of the daemon, is spent
+        again each EVAL_BUDGET_PERIOD."""
+        requests = os.getenv("EVAL_BUDGET_REQUESTS")
+        tokens = os.getenv("EVAL_BUDGET_TOKENS")
+        if not requests and not tokens:
+            return None
+        return cls(
+            max_requests=int(requests) if requests else None,
+            max_tokens=int(tokens) if tokens else None,
+            period=(
+                float(os.getenv("EVAL_BUDGET_PERIOD", "60"))
+                if periodic
+                else None
+            ),
+        )
+
+    def spend(self, costs: pd.DataFrame) -> pd.Series:
+        """Spends the budget on spans in order, until one doesn't fit,
+        returning which were spent on."""
+        if (
+            self.period is not None
+            and time.monotonic() - self._started >= self.period
+        ):
+            self.requests = self.tokens = 0.0
+            self._started = time.monotonic()
+        spent = pd.Series(False, index=costs.index)
+        for span_id, requests, tokens in zip(
+            costs.index, costs["requests"], costs["tokens"]
+        ):
+            if (
+                self.max_requests is not None
+                and self.requests + requests > self.max_requests
+            ) or (
+                self.max_tokens is not None
+                and self.tokens + tokens > self.max_tokens
+            ):
+                break
+            self.requests += requests
+            self.tokens += tokens
+            spent[span_id] = True
+        return spent
+
+
+class Sampler:
+    """Chooses which spans to evaluate, with strategy and within budget,
+    recording why as evaluations."""
+
+    def __init__(
+        self,
+        evaluators: list[LLMEvaluator],
+        judge: Optional[Callable] = None,
+        strategy=None,
+        budget: Optional[Budget] = None,
+        output_tokens: int = 500,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.evaluators = evaluators
+        self.judge = judge
+        self.strategy = strategy
+        self.budget = budget
+        self.output_tokens = output_tokens
+        self.random = rng or random.Random()
+        self.query = feedback_query()
+
+    @classmethod
+    def from_env(
+        cls,
+        evaluators: list[LLMEvaluator],
+        judge: Optional[Callable] = None,
+        periodic: bool = False,
+    ) -> Optional["Sampler"]:
+        """Returns the sampler configured by ENV variables, or None if every
+        span is evaluated. periodic is as in Budget.from_env."""
+        name = os.getenv("EVAL_SAMPLING", "all")
+        size = int(os.getenv("EVAL_SAMPLE_SIZE", "10"))
+        window = float(os.getenv("EVAL_SAMPLE_WINDOW", "60"))
+        if name == "all":
+            strategy = None
+        elif name == "uniform":
+            strategy = Uniform(float(os.getenv("EVAL_SAMPLE_RATE", "0.1")))
+        elif name == "reservoir":
+            strategy = Reservoir(size, window)
+        elif name == "stratified":
+            strata = os.getenv("EVAL_SAMPLE_STRATA", "model").split(",")
+            strategy = Reservoir(size, window, tuple(strata))
+        else:
+            raise ValueError(f"unknown EVAL_SAMPLING {name!r}")
+        budget = Budget.from_env(periodic)
+        if strategy is None and budget is None:
+            return None
+        return cls(
+            evaluators,
+            judge,
+            strategy,
+            budget,
+            output_tokens=int(os.getenv("EVAL_OUTPUT_TOKENS", "500")),
+        )
+
+    def always(self, phoenix_client, spans: pd.DataFrame) -> pd.Series:
+        """Returns why each span must be evaluated, or None if it needn't.
+        If feedback can't be queried, spans are sampled as if they had none,
+        rather than stopping evaluation."""
+        reasons = pd.Series(None, index=spans.index, dtype=object)
+        if "status_code" in spans:
+            reasons[spans["status_code"] == "ERROR"] = "error"
+        starts = pd.to_datetime(spans["start_time"], utc=True)
+        try:
+            # No limit, as spans of other queries, e.g. with evals, may have
+            # feedback in the same time range.
+            disliked = phoenix_client.query_spans(
+                self.query,
+                start_time=starts.min(),
+                end_time=starts.max() + pd.Timedelta(microseconds=1),
+                limit=None,
+            )
+        except Exception as e:
+            print(f"Querying feedback failed: {e!r}", flush=True)
+            disliked = None
+        if disliked is not None and not disliked.empty:
+            reasons[spans.index.isin(disliked.index)] = "feedback"
+        return reasons
+
+    def sample(
+        self, phoenix_client, spans: pd.DataFrame
+    ) -> tuple[pd.DataFrame, list[SpanEvaluations]]:
+        """Returns the spans to evaluate, and evaluations recording the
+        decision for each span."""
+        if spans.empty:
+            return spans, []
+        always = self.always(phoenix_client, spans)
+        probabilities = pd.Series(1.0, index=spans.index)
+        reasons = always.fillna("sampled")
+        rest = always.isna()
+        if self.strategy is not None and rest.any():
+            probabilities[rest] = self.strategy.sample(spans[rest])
+            reasons[rest & (probabilities == 0)] = "skipped"
+
+        if self.budget is not None:
+            # Spend on spans always evaluated first, then the rest in random
+            # order, so those over budget are a random share of each.
+            chosen = [i for i in spans.index if probabilities[i] > 0]
+            self.random.shuffle(chosen)
+            chosen.sort(key=lambda i: pd.isna(always[i]))
+            costs = judge_costs(
+                spans.loc[chosen],
+                self.evaluators,
+                self.judge,
+                self.output_tokens,
+            )
+            spent = self.budget.spend(costs)
+            for tier in (always.notna(), always.isna()):
+                ids = spent.index[tier[spent.index]]
+                if kept := spent[ids].sum():
+                    probabilities[ids] *= kept / len(ids)
+            over = spent.index[~spent]
+            probabilities[over] = 0.0
+            reasons[over] = "over budget"
+
+        sampled = probabilities > 0
+        weights = (1 / probabilities).where(sampled, 0.0)
+        explanations = [
+            f"Evaluated with probability {p:.3g}." if p else "Not evaluated."
+            for p in probabilities
+        ]
+        decisions = pd.DataFrame(
+            {"label": reasons, "score": weights, "explanation": explanations},
+            index=spans.index,
+        )
+        return spans[sampled], [
+            SpanEvaluations(eval_name=SAMPLING_EVAL_NAME, dataframe=decisions)
+        ]
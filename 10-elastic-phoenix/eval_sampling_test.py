@@ -0,0 +1,176 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import random
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+from eval_sampling import Budget, Reservoir, Sampler, Uniform, judge_costs
+from phoenix.evals import OpenAIModel, QAEvaluator
+from tiered_judge import TieredJudge
+
+start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+
+class FakeFeedbackClient:
+    """Returns spans in the time range with thumbs-down feedback."""
+
+    def __init__(self, spans: pd.DataFrame, disliked=()):
+        self.spans = spans
+        self.disliked = disliked
+
+    def query_spans(self, query, start_time, end_time, limit):
+        if isinstance(self.disliked, Exception):
+            raise self.disliked
+        starts = self.spans["start_time"]
+        matches = self.spans[
+            self.spans.index.isin(self.disliked)
+            & (starts >= start_time)
+            & (starts < end_time)
+        ]
+        return matches[:limit]
+
+
+def spans(count, seconds=1, **columns):
+    return pd.DataFrame(
+        {
+            "start_time": [
+                start + timedelta(seconds=i * seconds) for i in range(count)
+            ],
+            "input": "Which ocean contains Bouvet Island?",
+            "output": "Atlantic Ocean",
+            **columns,
+        },
+        index=pd.Index(
+            [f"span{i}" for i in range(count)], name="context.span_id"
+        ),
+    )
+
+
+def test_uniform():
+    probabilities = Uniform(0.25, random.Random(1)).sample(spans(1000))
+    assert set(probabilities) == {0, 0.25}
+    assert 200 < (probabilities > 0).sum() < 300
+
+    with pytest.raises(ValueError):
+        Uniform(0)
+
+
+def test_reservoir_per_window_and_stratum():
+    reservoir = Reservoir(2, window=60, strata=("model",))
+    models = ["gpt-4o-mini"] * 9 + ["o3-mini"]
+    first = spans(10, seconds=10, model=models)  # windows of 6 and 4 spans
+
+    probabilities = reservoir.sample(first)
+    # Spans of a model in a window are sampled with the same probability, set
+    # by how many spans of it the window before had, else this one.
+    assert set(probabilities[:6]) <= {0, 2 / 6}
+    assert set(probabilities[6:9]) <= {0, 2 / 6}
+    assert probabilities["span9"] == 1  # fewer spans than the size
+
+    later = spans(18, seconds=10, model="gpt-4o-mini")[12:]
+    assert set(reservoir.sample(later)) <= {0, 2 / 3}
+
+
+def test_reservoir_independent_of_fetches():
+    dataframe = spans(1000, seconds=0.6)  # ten windows of 100 spans
+    at_once = Reservoir(20, window=60).sample(dataframe)
+    reservoir = Reservoir(20, window=60)
+    fetched = pd.concat(
+        [reservoir.sample(dataframe[i : i + 37]) for i in range(0, 1000, 37)]
+    )
+
+    # After the first window, decisions don't depend on how spans are split
+    # between fetches, and weights add up to the spans they stand for.
+    assert fetched[100:].equals(at_once[100:])
+    sampled = fetched[fetched > 0]
+    assert (1 / sampled).sum() == pytest.approx(1000, rel=0.2)
+    assert 150 < len(sampled) < 300
+
+
+def test_budget_spends_in_order_until_full():
+    budget = Budget(max_requests=4)
+    costs = pd.DataFrame(
+        {"requests": [2, 2, 1, 1], "tokens": 0}, index=list("abcd")
+    )
+    assert list(budget.spend(costs)) == [True, True, False, False]
+    assert budget.requests == 4
+
+
+def test_budget_from_env(monkeypatch):
+    monkeypatch.setenv("EVAL_BUDGET_REQUESTS", "10")
+    monkeypatch.setenv("EVAL_BUDGET_PERIOD", "0")
+    costs = pd.DataFrame({"requests": [10], "tokens": 0}, index=["a"])
+
+    # A run of the cron job spends its budget once, however long it takes.
+    budget = Budget.from_env()
+    assert list(budget.spend(costs)) == [True]
+    assert list(budget.spend(costs)) == [False]
+
+    # The daemon spends it again each period.
+    budget = Budget.from_env(periodic=True)
+    assert list(budget.spend(costs)) == [True]
+    assert list(budget.spend(costs)) == [True]
+
+
+def test_judge_costs(default_openai_env):
+    evaluators = [QAEvaluator(OpenAIModel())] * 3
+    costs = judge_costs(spans(2), evaluators, output_tokens=100)
+    assert list(costs["requests"]) == [3, 3]
+    assert (costs["tokens"] > 300).all()
+    tiered = judge_costs(spans(2), evaluators, TieredJudge(), 100)
+    assert tiered.equals(costs)
+
+
+def test_sampler_records_decisions(default_openai_env):
+    evaluators = [QAEvaluator(OpenAIModel())]
+    dataframe = spans(100, status_code=["ERROR"] + ["OK"] * 99)
+    client = FakeFeedbackClient(dataframe, disliked=["span1"])
+    sampler = Sampler(
+        evaluators,
+        strategy=Uniform(0.5, random.Random(1)),
+        budget=Budget(max_requests=20),
+        rng=random.Random(1),
+    )
+
+    sampled, (evaluation,) = sampler.sample(client, dataframe)
+
+    assert evaluation.eval_name == "Eval Sampling"
+    decisions = evaluation.dataframe
+    assert list(decisions.index) == list(dataframe.index)
+    assert decisions.loc["span0", "label"] == "error"
+    assert decisions.loc["span1", "label"] == "feedback"
+    assert set(decisions["label"][2:]) == {"sampled", "skipped", "over budget"}
+    # The budget of one request per span caps how many are evaluated.
+    assert len(sampled) == 20
+    assert set(sampled.index) == set(decisions.index[decisions["score"] > 0])
+    assert list(decisions.loc[["span0", "span1"], "score"]) == [1, 1]
+    # Weights add up to the spans they stand for.
+    assert decisions["score"].sum() == pytest.approx(100, rel=0.2)
+
+
+def test_sampler_without_feedback(default_openai_env):
+    dataframe = spans(10, status_code=["ERROR"] + ["OK"] * 9)
+    client = FakeFeedbackClient(dataframe, disliked=ConnectionError("down"))
+    sampler = Sampler([], strategy=Uniform(0.5, random.Random(1)))
+
+    _, (evaluation,) = sampler.sample(client, dataframe)
+
+    # Spans are still sampled, and errors still always evaluated.
+    labels = evaluation.dataframe["label"]
+    assert labels["span0"] == "error"
+    assert set(labels[1:]) == {"sampled", "skipped"}
+
+
+def test_sampler_finds_all_feedback(default_openai_env):
+    dataframe = spans(10)
+    client = FakeFeedbackClient(dataframe, disliked=list(dataframe.index))
+    sampler = Sampler([], strategy=Uniform(0.5, random.Random(1)))
+
+    # Spans between these, e.g. evaluated already, have feedback too.
+    fetched = dataframe[::2]
+    _, (evaluation,) = sampler.sample(client, fetched)
+
+    assert set(evaluation.dataframe["label"]) == {"feedback"}
@@ -0,0 +1,52 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Splits spans between replicas of eval_job.py, so they can run at the same time
+without evaluating a span twice.
+
+Each replica is configured with the same EVAL_SHARD_COUNT and a different
+EVAL_SHARD_INDEX, from 0. A replica only evaluates spans whose span id hashes
+to its index, so no coordination between replicas is needed. Each still
+fetches every span, to move its own watermark past the spans of the others.
+
+When changing the shard count, start the new replicas from the watermark of
+the replica furthest behind, so that no span is skipped.
+"""
+
+import os
+import zlib
+from typing import Optional
+
+import pandas as pd
+
+
+class Shard:
+    def __init__(self, index: int, count: int) -> None:
+        if not 0 <= index < count:
+            raise ValueError(f"shard index {index} not in 0..{count - 1}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def from_env(cls) -> Optional["Shard"]:
+        """Returns the shard configured by ENV variables, or None if
+        EVAL_SHARD_COUNT is unset or one."""
+        count = int(os.getenv("EVAL_SHARD_COUNT", "1"))
+        if count <= 1:
+            return None
+        return cls(int(os.getenv("EVAL_SHARD_INDEX", "0")), count)
+
+    def owns(self, span_ids: pd.Index) -> pd.Series:
+        """Returns which of span_ids belong to this shard. The hash is stable
+        across processes, unlike hash()."""
+        shards = span_ids.map(lambda i: zlib.crc32(str(i).encode()))
+        return pd.Series(shards % self.count == self.index, index=span_ids)
+
+    def watermark_path(self) -> str:
+        """Returns the path of the watermark of this shard, as replicas on the
+        same host would otherwise share one."""
+        path = os.getenv("EVAL_WATERMARK_PATH", "eval_watermark.json")
+        root, extension = os.path.splitext(path)
+        return f"{root}-{self.index}-of-{self.count}{extension}"
@@ -0,0 +1,35 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import pandas as pd
+import pytest
+from eval_shard import Shard
+
+span_ids = pd.Index([f"{i:016x}" for i in range(1000)])
+
+
+def test_shards_split_spans():
+    owned = [Shard(i, 3).owns(span_ids) for i in range(3)]
+
+    # Each span belongs to exactly one shard, and shards get similar shares.
+    assert (sum(o.astype(int) for o in owned) == 1).all()
+    assert all(250 < o.sum() < 420 for o in owned)
+    # The split is the same every time, even in another process.
+    assert list(Shard(0, 3).owns(span_ids[:4])) == [True, False, False, True]
+
+
+def test_from_env(monkeypatch):
+    assert Shard.from_env() is None
+
+    monkeypatch.setenv("EVAL_SHARD_COUNT", "4")
+    monkeypatch.setenv("EVAL_SHARD_INDEX", "2")
+    monkeypatch.setenv("EVAL_WATERMARK_PATH", "/data/watermark.json")
+    shard = Shard.from_env()
+
+    assert (shard.index, shard.count) == (2, 4)
+    assert shard.watermark_path() == "/data/watermark-2-of-4.json"
+
+    monkeypatch.setenv("EVAL_SHARD_INDEX", "4")
+    with pytest.raises(ValueError):
+        Shard.from_env()
@@ -0,0 +1,159 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Tracks how far eval_job.py got, so each run only queries spans which started
+since the last, instead of scanning every span for missing evals. This keeps
+run time the same, no matter how many spans Phoenix has.
+
+The watermark is the end of the last window of spans processed. Each fetch
+queries a window from the watermark, up to EVAL_WINDOW seconds later and at
+most EVAL_FETCH_LIMIT spans. Phoenix doesn't order spans within a limit, so a
+full result may be missing earlier spans. When that happens, the window is
+halved until it fits. A window of MIN_WINDOW which is still full is fetched
+again with double the limit, until it has every span, as there is no way to
+page through it in order. The end of the window also stays EVAL_SETTLE seconds
+behind now, so spans still being exported aren't skipped.
+
+Spans which failed evaluation are recorded, and the watermark moves past them,
+so they aren't fetched again every run. Instead, they are tried again by id
+EVAL_RETRY_DELAY seconds (default 300) after each failure, until they failed
+EVAL_MAX_ATTEMPTS times (default 3).
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import pandas as pd
+
+# Smallest window to halve to, when more than the limit of spans started
+# within it. Past this, the limit is raised instead.
+MIN_WINDOW = timedelta(seconds=1)
+MAX_FAILED = 1000
+
+
+class Watermark:
+    def __init__(self, path: str, start_time: datetime) -> None:
+        self.path = path
+        self.start_time = start_time
+        # Span id to failed attempts, and when the last one started.
+        self.failed: dict[str, dict] = {}
+        self.max_attempts = int(os.getenv("EVAL_MAX_ATTEMPTS", "3"))
+        self.retry_delay = timedelta(
+            seconds=float(os.getenv("EVAL_RETRY_DELAY", "300"))
+        )
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "Watermark":
+        """Loads the watermark, or starts one EVAL_LOOKBACK seconds ago."""
+        path = path or os.getenv("EVAL_WATERMARK_PATH", "eval_watermark.json")
+        if not os.path.exists(path):
+            lookback = float(os.getenv("EVAL_LOOKBACK", "3600"))
+            start = datetime.now(timezone.utc) - timedelta(seconds=lookback)
+            return cls(path, start)
+        with open(path) as file:
+            state = json.load(file)
+        watermark = cls(path, datetime.fromisoformat(state["start_time"]))
+        watermark.failed = {
+            # Files from before attempts were counted have when it failed.
+            span_id: {"attempts": 1, "at": failure}
+            if isinstance(failure, str)
+            else failure
+            for span_id, failure in state["failed"].items()
+        }
+        return watermark
+
+    def save(self) -> None:
+        """Replaces the file atomically, so a crash never leaves half of it."""
+        state = {
+            "start_time": self.start_time.isoformat(),
+            "failed": self.failed,
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, delete=False
+        ) as file:
+            json.dump(state, file)
+        os.replace(file.name, self.path)
+
+    def fetch(
+        self,
+        phoenix_client,
+        query,
+        limit: Optional[int] = None,
+        window: Optional[timedelta] = None,
+        settle: Optional[timedelta] = None,
+        now: Optional[datetime] = None,
+    ) -> tuple[pd.DataFrame, datetime]:
+        """Returns every span of the query in a window after the watermark,
+        sorted by start time, with the end of the window. The query must
+        select start_time."""
+        limit = limit or int(os.getenv("EVAL_FETCH_LIMIT", "1000"))
+        if window is None:
+            window = timedelta(seconds=float(os.getenv("EVAL_WINDOW", "3600")))
+        if settle is None:
+            settle = timedelta(seconds=float(os.getenv("EVAL_SETTLE", "30")))
+        now = now or datetime.now(timezone.utc)
+
+        start = self.start_time
+        end = min(start + window, now - settle)
+        if end <= start:
+            return pd.DataFrame(), start
+        while True:
+            spans = phoenix_client.query_spans(
+                query, start_time=start, end_time=end, limit=limit
+            )
+            if spans is None:
+                spans = pd.DataFrame()
+            if len(spans) < limit:
+                break
+            if end - start > MIN_WINDOW:
+                end = start + (end - start) / 2
+            else:
+                limit *= 2
+
+        if spans.empty:
+            return spans, end
+        spans = spans.sort_index().sort_values("start_time", kind="stable")
+        return spans[~spans.index.isin(self.failed)], end
+
+    def advance(self, end: datetime) -> None:
+        """Moves the watermark to the end of a window fetched. Call this after
+        its spans are processed."""
+        self.start_time = end
+
+    def take_retries(self, now: Optional[datetime] = None) -> list[str]:
+        """Returns ids of failed spans due another attempt, which starts now,
+        so they aren't returned again until retry_delay later."""
+        now = now or datetime.now(timezone.utc)
+        due = [
+            span_id
+            for span_id, failure in self.failed.items()
+            if failure["attempts"] < self.max_attempts
+            and now - datetime.fromisoformat(failure["at"]) >= self.retry_delay
+        ]
+        for span_id in due:
+            self.failed[span_id]["at"] = now.isoformat()
+        return due
+
+    def record_evaluated(self, span_ids) -> None:
+        """Forgets spans which were retried and didn't fail this time."""
+        for span_id in span_ids:
+            self.failed.pop(span_id, None)
+
+    def record_failed(self, span_ids) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        for span_id in span_ids:
+            # Moved to the end, as the latest failure.
+            failure = self.failed.pop(span_id, {"attempts": 0})
+            self.failed[span_id] = {
+                "attempts": failure["attempts"] + 1,
+                "at": now,
+            }
+        # Keep only the latest failures, so the file doesn't grow forever.
+        for span_id in list(self.failed)[:-MAX_FAILED]:
+            del self.failed[span_id]
@@ -0,0 +1,139 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from eval_watermark import Watermark
+
+start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+now = start + timedelta(hours=2)
+
+
+class FakePhoenixClient:
+    """Returns spans in the time range, if any, unordered like Phoenix."""
+
+    def __init__(self, spans: dict[str, datetime]):
+        self.spans = spans
+        self.queries = []
+
+    def query_spans(self, query, start_time=None, end_time=None, limit=None):
+        self.queries.append((start_time, end_time))
+        matches = {
+            span_id: span_start
+            for span_id, span_start in reversed(self.spans.items())
+            if (start_time is None or start_time <= span_start)
+            and (end_time is None or span_start < end_time)
+        }
+        rows = list(matches.items())[:limit]
+        return pd.DataFrame(
+            {"start_time": [span_start for _, span_start in rows]},
+            index=pd.Index(
+                [span_id for span_id, _ in rows], name="context.span_id"
+            ),
+        )
+
+
+def fetch(watermark, client, limit=10):
+    return watermark.fetch(
+        client,
+        query=None,
+        limit=limit,
+        window=timedelta(hours=1),
+        settle=timedelta(seconds=30),
+        now=now,
+    )
+
+
+def test_fetch_window_then_advance(tmp_path):
+    client = FakePhoenixClient(
+        {
+            "b": start + timedelta(minutes=2),
+            "a": start + timedelta(minutes=1),
+            "c": start + timedelta(minutes=90),  # after the window
+        }
+    )
+    watermark = Watermark(str(tmp_path / "watermark.json"), start)
+
+    spans, end = fetch(watermark, client)
+    assert list(spans.index) == ["a", "b"]
+    assert end == start + timedelta(hours=1)
+
+    watermark.advance(end)
+    spans, end = fetch(watermark, client)
+    assert list(spans.index) == ["c"]
+    # The end of the window stays behind now, for spans being exported.
+    assert end == now - timedelta(seconds=30)
+
+
+def test_fetch_halves_full_windows(tmp_path):
+    client = FakePhoenixClient(
+        {
+            "a": start + timedelta(minutes=1),
+            "b": start + timedelta(minutes=20),
+            "c": start + timedelta(minutes=40),
+        }
+    )
+    watermark = Watermark(str(tmp_path / "watermark.json"), start)
+
+    spans, end = fetch(watermark, client, limit=2)
+    assert list(spans.index) == ["a"]
+    assert end == start + timedelta(minutes=15)
+
+
+def test_fetch_every_span_beyond_limit(tmp_path):
+    client = FakePhoenixClient({span_id: start for span_id in "abc"})
+    watermark = Watermark(str(tmp_path / "watermark.json"), start)
+
+    # A full result of one second can't be halved, so the limit is raised
+    # instead of returning the spans Phoenix picked.
+    spans, end = fetch(watermark, client, limit=2)
+    assert list(spans.index) == ["a", "b", "c"]
+    assert end <= start + timedelta(seconds=1)
+
+    watermark.advance(end)
+    spans, _ = fetch(watermark, client, limit=2)
+    assert spans.empty
+
+
+def test_fetch_skips_failed(tmp_path):
+    client = FakePhoenixClient({span_id: start for span_id in "ab"})
+    watermark = Watermark(str(tmp_path / "watermark.json"), start)
+    watermark.record_failed(["a"])
+
+    spans, _ = fetch(watermark, client)
+    assert list(spans.index) == ["b"]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "watermark.json")
+    watermark = Watermark(path, start)
+    watermark.record_failed(["b"])
+    watermark.save()
+
+    loaded = Watermark.load(path)
+    assert loaded.start_time == start
+    assert list(loaded.failed) == ["b"]
+    assert loaded.failed["b"]["attempts"] == 1
+
+
+def test_retries_until_max_attempts(monkeypatch, tmp_path):
+    monkeypatch.setenv("EVAL_MAX_ATTEMPTS", "2")
+    monkeypatch.setenv("EVAL_RETRY_DELAY", "60")
+    watermark = Watermark(str(tmp_path / "watermark.json"), start)
+    watermark.record_failed(["a", "b"])
+    failed_at = datetime.fromisoformat(watermark.failed["a"]["at"])
+
+    assert watermark.take_retries(failed_at) == []
+    later = failed_at + timedelta(minutes=1)
+    assert watermark.take_retries(later) == ["a", "b"]
+    # Retries in progress aren't taken again.
+    assert watermark.take_retries(later) == []
+
+    watermark.record_evaluated(["a"])
+    watermark.record_failed(["b"])
+    # "b" failed twice, so is given up on, but still not fetched again.
+    assert watermark.take_retries(later + timedelta(hours=1)) == []
+    assert watermark.failed["b"]["attempts"] == 2
+    assert "a" not in watermark.failed
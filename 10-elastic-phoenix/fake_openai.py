@@ -0,0 +1,151 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+A fake OpenAI API for benchmarks. It answers every chat completion with the
+same canned answer, optionally after a delay, so that benchmarks measure this
+app instead of a model or the network.
+
+Run it standalone like this, optionally with a delay in seconds, then point
+OPENAI_BASE_URL at it:
+    python fake_openai.py 8000 0.05
+    export OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=unused
+    python main.py
+"""
+
+import json
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ["South", " Atlantic", " Ocean", "."]
+USAGE = {"prompt_tokens": 22, "completion_tokens": 4, "total_tokens": 26}
+
+
+def _completion(model: str) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(ANSWER)},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": USAGE,
+    }
+
+
+def _chunk(model: str, delta: dict | None, finish_reason=None, usage=None):
+    choices = []
+    if delta is not None:
+        choices.append(
+            {"index": 0, "delta": delta, "finish_reason": finish_reason}
+        )
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": choices,
+        "usage": usage,
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    # Headers and body are written separately, so don't delay the body.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server: FakeOpenAIServer = self.server
+        server.record_request()
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        time.sleep(server.delay)
+
+        model = body.get("model", "fake")
+        if not body.get("stream"):
+            self._send(200, "application/json", json.dumps(_completion(model)))
+            return
+
+        chunks = [_chunk(model, {"role": "assistant", "content": ""})]
+        chunks += [_chunk(model, {"content": token}) for token in ANSWER]
+        chunks.append(_chunk(model, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunks.append(_chunk(model, None, usage=USAGE))
+        events = [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks]
+        events.append("data: [DONE]\n\n")
+        self._send(200, "text/event-stream", "".join(events))
+
+    def do_GET(self):
+        server: FakeOpenAIServer = self.server
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        stats = {"requests": server.requests}
+        self._send(200, "application/json", json.dumps(stats))
+
+    def _send(self, status: int, content_type: str, content: str):
+        data = content.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass  # don't slow down benchmarks with request logs
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, delay: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", port), FakeOpenAIHandler)
+        self.delay = delay
+        self.requests = 0
+        self.first_request_at: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            if self.first_request_at is None:
+                self.first_request_at = time.time()
+
+    def start(self) -> "FakeOpenAIServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def spawn(delay: float = 0.0) -> tuple[subprocess.Popen, str]:
+    """Runs the server in another process, so that it doesn't compete with
+    the benchmark for the GIL. Returns the process and its base URL. GET
+    /stats on its host returns how many requests it served."""
+    process = subprocess.Popen(
+        [sys.executable, __file__, "0", str(delay)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    return process, process.stdout.readline().split()[-1]
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server = FakeOpenAIServer(port, delay=delay)
+    print(f"Serving a fake OpenAI API on {server.base_url}", flush=True)
+    server.serve_forever()
@@ -0,0 +1,156 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Keeps user feedback on local disk until Phoenix has it, so that it survives
+Phoenix being down and the process exiting.
+
+Annotations are appended as JSON lines to a segment file. Appends only write
+to the OS, and a background thread fsyncs at most every fsync_interval, so
+many appends share one fsync. Segments are sealed once they reach
+segment_bytes, or when a drain has caught up with everything sealed before.
+
+Draining replays sealed segments to Phoenix in bulk, oldest first, deleting
+each once all of it is logged. A segment which fails part way is replayed in
+full next time. This is safe as Phoenix upserts annotations by span id and
+name, which is why they are the idempotency key: when a segment has several
+for the same key, only the last is sent.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+SUFFIX = ".jsonl"
+
+
+def _read(path: str) -> Iterator[dict]:
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                pass  # a line torn by a crash while writing it
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 1 << 20,
+        fsync_interval: float = 0.1,
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        # Never append to segments of a previous process, as they may end in
+        # a torn line.
+        existing = self._segments()
+        self._sequence = int(existing[-1][: -len(SUFFIX)]) if existing else 0
+        self._active = None
+        self._dirty = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._syncer = threading.Thread(
+            target=self._sync_periodically, name="feedback-spool", daemon=True
+        )
+        self._syncer.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["Spool"]:
+        """Returns a spool in FEEDBACK_SPOOL_DIR, or None if it is unset."""
+        if not (directory := os.getenv("FEEDBACK_SPOOL_DIR")):
+            return None
+        return cls(directory)
+
+    def _segments(self) -> list[str]:
+        names = os.listdir(self.directory)
+        return sorted(n for n in names if n.endswith(SUFFIX))
+
+    def sealed(self) -> list[str]:
+        """Returns paths of segments no longer written to, oldest first."""
+        with self._lock:
+            return self._sealed()
+
+    def _sealed(self) -> list[str]:
+        # Call with the lock held, or an append could start a segment between
+        # reading _active and listing it, which would then look sealed.
+        active = self._active and os.path.basename(self._active.name)
+        return [
+            os.path.join(self.directory, name)
+            for name in self._segments()
+            if name != active
+        ]
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._active is None:
+                self._sequence += 1
+                name = f"{self._sequence:016d}{SUFFIX}"
+                self._active = open(os.path.join(self.directory, name), "a")
+            self._active.write(line)
+            self._active.flush()
+            self._dirty = True
+            if self._active.tell() >= self.segment_bytes:
+                self._seal()
+
+    def _seal(self) -> None:
+        """Closes the active segment, so the next append starts another."""
+        if self._active is None:
+            return
+        os.fsync(self._active.fileno())
+        self._active.close()
+        self._active = None
+        self._dirty = False
+
+    def sync(self) -> None:
+        """Fsyncs appends so far, without blocking appends meanwhile."""
+        with self._lock:
+            if not self._dirty:
+                return
+            # fsync a duplicate, so sealing can close the original meanwhile.
+            fd = os.dup(self._active.fileno())
+            self._dirty = False
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _sync_periodically(self) -> None:
+        while not self._closed:
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    def drain(
+        self, send: Callable[[list[dict]], None], batch_size: int = 100
+    ) -> int:
+        """Calls send with batches of records from sealed segments, deleting
+        each segment once it is sent. Returns the count of records sent, and
+        raises what send raises."""
+        with self._drain_lock:
+            with self._lock:
+                if not (sealed := self._sealed()):
+                    self._seal()  # caught up, so send what is active too
+                    sealed = self._sealed()
+            sent = 0
+            for path in sealed:
+                latest = {}
+                for record in _read(path):
+                    latest[(record["span_id"], record["name"])] = record
+                records = list(latest.values())
+                for i in range(0, len(records), batch_size):
+                    send(records[i : i + batch_size])
+                os.remove(path)
+                sent += len(records)
+            return sent
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            self._seal()
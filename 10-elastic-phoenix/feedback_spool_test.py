@@ -0,0 +1,104 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import os
+import threading
+
+import pytest
+from feedback_spool import Spool
+
+
+def annotation(span_id, label="thumbs-up"):
+    return {"name": "user feedback", "span_id": span_id, "label": label}
+
+
+def test_drain_sends_and_deletes(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(annotation("a"))
+    spool.append(annotation("b"))
+
+    batches = []
+    assert spool.drain(batches.append, batch_size=1) == 2
+    assert batches == [[annotation("a")], [annotation("b")]]
+    assert os.listdir(tmp_path) == []
+    spool.close()
+
+
+def test_drain_sends_last_annotation_per_span(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(annotation("a"))
+    spool.append(annotation("a", label="thumbs-down"))
+
+    batches = []
+    spool.drain(batches.append)
+    assert batches == [[annotation("a", label="thumbs-down")]]
+    spool.close()
+
+
+def test_drain_keeps_failed_segments(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(annotation("a"))
+
+    def fail(batch):
+        raise ConnectionError("Phoenix is down")
+
+    with pytest.raises(ConnectionError):
+        spool.drain(fail)
+    spool.append(annotation("b"))
+    spool.close()
+
+    # A new process replays what the previous one couldn't send.
+    batches = []
+    spool = Spool(str(tmp_path))
+    spool.drain(batches.append)
+    assert batches == [[annotation("a")], [annotation("b")]]
+    spool.close()
+
+
+def test_rotates_by_size(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=1)
+    spool.append(annotation("a"))
+    spool.append(annotation("b"))
+
+    assert len(spool.sealed()) == 2
+    spool.close()
+
+
+def test_skips_torn_lines(tmp_path):
+    (tmp_path / "0000000000000001.jsonl").write_text(
+        '{"name": "user feedback", "span_id": "a", "label": "thumbs-up"}\n'
+        '{"name": "user feed'
+    )
+    spool = Spool(str(tmp_path))
+
+    batches = []
+    spool.drain(batches.append)
+    assert batches == [[annotation("a")]]
+    spool.close()
+
+
+def test_drain_races_no_append(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(annotation("a"))
+    spool.drain(lambda batch: None)  # seals the segment of "a"
+    spool.append(annotation("b"))
+    segments = spool._segments
+
+    def append_while_listing():
+        # An append between sealed() reading the active segment and listing
+        # the directory must wait, or its new segment would look sealed.
+        writer = threading.Thread(target=spool.append, args=[annotation("c")])
+        writer.start()
+        writer.join(timeout=0.1)
+        return segments()
+
+    spool._segments = append_while_listing
+    sent = []
+    spool.drain(lambda batch: sent.extend(r["span_id"] for r in batch))
+    spool._segments = segments
+    spool.append(annotation("d"))
+    spool.drain(lambda batch: sent.extend(r["span_id"] for r in batch))
+
+    assert sorted(sent) == ["b", "c", "d"]
+    spool.close()
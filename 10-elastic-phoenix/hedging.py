@@ -0,0 +1,187 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Hedged requests cut tail latency by sending a duplicate of a request which is
+slower than usual, and using whichever answer arrives first. This is safe for
+chat completions with temperature=0, as either answer is interchangeable.
+
+A request is "slower than usual" once it takes longer than a quantile (p95 by
+default) of recent latencies. Hedges are capped at a fraction of requests, so
+that when everything is slow, hedging doesn't double the load. Latencies of
+attempts which lost are recorded too, or slow ones would be missing from them.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from http_transport import attempt_span
+from opentelemetry import trace
+
+T = TypeVar("T")
+
+tracer = trace.get_tracer(__name__)
+
+
+def _spawn(fn: Callable[[], T]) -> Future:
+    """Runs fn in a thread of its own, in a copy of this context, so spans
+    are children of the current one. A thread per attempt means a slow one,
+    which can't be cancelled, holds no thread other calls need."""
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run() -> None:
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="hedge", daemon=True).start()
+    return future
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        max_rate: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+    ) -> None:
+        self.quantile = quantile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._hedged: deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgePolicy"]:
+        """Returns a policy configured by ENV variables, or None if
+        CHAT_HEDGE_MAX_RATE is unset or zero."""
+        max_rate = float(os.getenv("CHAT_HEDGE_MAX_RATE", "0"))
+        if max_rate <= 0:
+            return None
+        quantile = float(os.getenv("CHAT_HEDGE_QUANTILE", "0.95"))
+        return cls(quantile=quantile, max_rate=max_rate)
+
+    def threshold(self) -> Optional[float]:
+        """Returns seconds to wait before hedging, or None until there are
+        enough samples to know what is slow."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(self.quantile * (len(latencies) - 1))]
+
+    def _can_hedge(self) -> bool:
+        with self._lock:
+            hedges = sum(self._hedged)
+            return hedges + 1 <= self.max_rate * max(len(self._hedged), 1)
+
+    def _try_hedge(self) -> bool:
+        if not self._can_hedge():
+            return False
+        with self._lock:
+            self._hedged[-1] = True
+        return True
+
+    def _record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _timed(self, attempt: Callable[[], T], role: str) -> Callable[[], T]:
+        """Wraps attempt in a span of its own, and records its latency once
+        it succeeds, even if another attempt won."""
+
+        def timed() -> T:
+            with attempt_span("hedge attempt", **{"hedge.role": role}):
+                start = time.perf_counter()
+                result = attempt()
+                self._record(time.perf_counter() - start)
+                return result
+
+        return timed
+
+    def _start(self) -> Optional[float]:
+        with self._lock:
+            self._hedged.append(False)
+        return self.threshold()
+
+    def call(self, attempt: Callable[[], T]) -> T:
+        """Returns the first successful result of attempt, starting a second
+        one if the first is slow. A slower attempt in progress cannot be
+        cancelled, so its result is discarded."""
+        with tracer.start_as_current_span("hedged request") as span:
+            threshold = self._start()
+            primary = self._timed(attempt, "primary")
+            if threshold is None or not self._can_hedge():
+                # Nothing to hedge with, so run it in this thread.
+                span.set_attribute("hedge.winner", "primary")
+                return primary()
+            # The primary can't run in this thread, as it couldn't return the
+            # result of the hedge while the primary is stuck.
+            futures = [_spawn(primary)]
+            done, _ = wait(futures, timeout=threshold)
+            if not done and self._try_hedge():
+                span.set_attribute("hedge.threshold", threshold)
+                futures.append(_spawn(self._timed(attempt, "hedge")))
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=futures.index):
+                    if future.exception() is None:
+                        winner = "primary" if future is futures[0] else "hedge"
+                        span.set_attribute("hedge.winner", winner)
+                        return future.result()
+            raise futures[0].exception()
+
+    async def acall(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Like call, but the slower attempt is cancelled."""
+
+        async def timed(primary: bool) -> T:
+            role = "primary" if primary else "hedge"
+            with attempt_span("hedge attempt", **{"hedge.role": role}):
+                start = time.perf_counter()
+                try:
+                    result = await attempt()
+                except asyncio.CancelledError:
+                    # A primary which lost took at least this long. A hedge
+                    # which lost started late, so says little about latency.
+                    if primary:
+                        self._record(time.perf_counter() - start)
+                    raise
+                self._record(time.perf_counter() - start)
+                return result
+
+        with tracer.start_as_current_span("hedged request") as span:
+            threshold = self._start()
+            tasks = [asyncio.ensure_future(timed(primary=True))]
+            if threshold is not None:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                if not done and self._try_hedge():
+                    span.set_attribute("hedge.threshold", threshold)
+                    tasks.append(asyncio.ensure_future(timed(primary=False)))
+            pending = set(tasks)
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in sorted(done, key=tasks.index):
+                        if task.exception() is None:
+                            winner = "primary" if task is tasks[0] else "hedge"
+                            span.set_attribute("hedge.winner", winner)
+                            return task.result()
+                raise tasks[0].exception()
+            finally:
+                for task in pending:
+                    task.cancel()
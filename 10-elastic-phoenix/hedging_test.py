@@ -0,0 +1,72 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import threading
+import time
+
+from hedging import HedgePolicy
+
+
+def warmed_up(latency: float = 0.01, **kwargs) -> HedgePolicy:
+    policy = HedgePolicy(min_samples=20, **kwargs)
+    for _ in range(20):
+        policy._start()
+        policy._latencies.append(latency)
+    return policy
+
+
+def test_no_threshold_until_warmed_up():
+    assert HedgePolicy(min_samples=20).threshold() is None
+    assert warmed_up(0.01).threshold() == 0.01
+
+
+def test_hedge_wins_when_primary_slow():
+    policy = warmed_up(max_rate=0.5)
+    attempts = []
+
+    async def attempt():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(10)  # the primary is stuck
+        return len(attempts)
+
+    start = time.perf_counter()
+    assert asyncio.run(policy.acall(attempt)) == 2
+    assert time.perf_counter() - start < 1
+
+
+def test_hedge_rate_capped():
+    policy = warmed_up(max_rate=0.01)  # less than one in 20 requests
+
+    def attempt():
+        time.sleep(0.05)
+        return "primary"
+
+    assert policy.call(attempt) == "primary"
+    assert not any(policy._hedged)
+
+
+def test_primary_runs_in_calling_thread_without_hedge():
+    policy = HedgePolicy(min_samples=20)  # too few samples to hedge
+
+    assert policy.call(threading.current_thread) is threading.current_thread()
+
+
+def test_latency_of_losers_recorded():
+    policy = warmed_up(max_rate=0.5)
+    slow = threading.Event()
+
+    def attempt():
+        if not slow.is_set():
+            slow.set()
+            time.sleep(0.2)  # the primary is slow, and loses
+            return "primary"
+        return "hedge"
+
+    assert policy.call(attempt) == "hedge"
+    deadline = time.monotonic() + 5
+    while max(policy._latencies) < 0.2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
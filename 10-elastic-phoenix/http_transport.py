@@ -0,0 +1,239 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Process-wide HTTP connection pools for OpenAI clients. Sharing a pool keeps
+connections alive between clients, so only the first request pays for TCP and
+TLS setup.
+
+The pool is configured by these ENV variables:
+* OPENAI_POOL_MAX_CONNECTIONS - maximum open connections (default 100)
+* OPENAI_POOL_MAX_KEEPALIVE - maximum idle connections kept (default 20)
+* OPENAI_POOL_KEEPALIVE_EXPIRY - seconds an idle connection is kept (default 5)
+* OPENAI_HTTP2 - "true" to negotiate HTTP/2 (default false)
+* OPENAI_CONNECT_TIMEOUT - seconds to establish a connection (default 5)
+* OPENAI_READ_TIMEOUT - seconds to wait for a response (default 600)
+
+Requests are paced by a RateLimiter shared by every client using these pools,
+including the eval model in eval_job.py. When a RetryPolicy retries a request,
+the attempt count and time backed off are added to the span of the request.
+Hedging and backend failover make several attempts per call, each in an
+attempt_span, which is where their requests record these instead.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+import httpx
+from openai import DefaultAsyncHttpxClient, DefaultHttpxClient
+from opentelemetry import metrics, trace
+from opentelemetry.metrics import CallbackOptions, Observation
+from opentelemetry.trace import Span
+from rate_limiter import RateLimiter, estimate_tokens
+from retry_policy import current_attempt
+
+_lock = threading.Lock()
+_http_client: httpx.Client | None = None
+# Async connections are bound to the event loop which opened them.
+_async_http_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, httpx.AsyncClient
+] = weakref.WeakKeyDictionary()
+_unbound_async_http_clients: weakref.WeakSet[httpx.AsyncClient] = (
+    weakref.WeakSet()
+)
+rate_limiter = RateLimiter()
+tracer = trace.get_tracer(__name__)
+
+# The span of the attempt requests are sent for, as concurrent attempts can't
+# rely on whichever span is current on the thread.
+_attempt_span: ContextVar[Optional[Span]] = ContextVar(
+    "attempt_span", default=None
+)
+
+
+@contextmanager
+def attempt_span(name: str, **attributes) -> Iterator[Span]:
+    """Starts a span for one attempt of a call, on which the requests it
+    sends record their server, rate limit wait and retries."""
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        token = _attempt_span.set(span)
+        try:
+            yield span
+        finally:
+            _attempt_span.reset(token)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(
+            os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "20")
+        ),
+        keepalive_expiry=float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "5")),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    read = float(os.getenv("OPENAI_READ_TIMEOUT", "600"))
+    return httpx.Timeout(
+        read, connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    )
+
+
+def _http2() -> bool:
+    return os.getenv("OPENAI_HTTP2", "false").lower() == "true"
+
+
+def _model_and_tokens(request: httpx.Request) -> tuple[Optional[str], int]:
+    """Returns the model of an OpenAI request and its estimated tokens."""
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return None, 0
+    if not isinstance(body, dict):
+        return None, 0
+    max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+    tokens = estimate_tokens(body.get("messages") or [], max_tokens or 0)
+    return body.get("model"), tokens
+
+
+def _record_attempt(request: httpx.Request, waited: float) -> None:
+    span = _attempt_span.get()
+    if span is None:
+        # A single attempt, so the current span is the one of the call.
+        span = trace.get_current_span()
+    # Record which server was used, as there can be several backends.
+    span.set_attribute("server.address", request.url.host)
+    if request.url.port:
+        span.set_attribute("server.port", request.url.port)
+    if waited:
+        span.set_attribute("ratelimit.wait", waited)
+    attempt, backed_off = current_attempt.get()
+    if attempt > 1:
+        span.set_attribute("retry.count", attempt - 1)
+        span.set_attribute("retry.backoff", backed_off)
+
+
+def _limit_request(request: httpx.Request) -> None:
+    model, tokens = _model_and_tokens(request)
+    waited = rate_limiter.acquire(model, tokens) if model else 0.0
+    _record_attempt(request, waited)
+
+
+async def _alimit_request(request: httpx.Request) -> None:
+    model, tokens = _model_and_tokens(request)
+    waited = await rate_limiter.aacquire(model, tokens) if model else 0.0
+    _record_attempt(request, waited)
+
+
+def _update_limits(response: httpx.Response) -> None:
+    model, _ = _model_and_tokens(response.request)
+    if model:
+        rate_limiter.update(model, response.headers)
+
+
+async def _aupdate_limits(response: httpx.Response) -> None:
+    _update_limits(response)
+
+
+def _event_hooks() -> dict:
+    return {"request": [_limit_request], "response": [_update_limits]}
+
+
+def _async_event_hooks() -> dict:
+    return {"request": [_alimit_request], "response": [_aupdate_limits]}
+
+
+def http_client() -> httpx.Client:
+    """Returns the HTTP client shared by synchronous OpenAI clients."""
+    global _http_client
+    with _lock:
+        if _http_client is None or _http_client.is_closed:
+            _http_client = DefaultHttpxClient(
+                limits=_limits(),
+                timeout=_timeout(),
+                http2=_http2(),
+                event_hooks=_event_hooks(),
+            )
+        return _http_client
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """Returns the HTTP client shared by async OpenAI clients on the running
+    event loop. Outside a loop, returns a new client with the same settings,
+    for a loop started later, such as the one run by run_evals."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        client = DefaultAsyncHttpxClient(
+            limits=_limits(),
+            timeout=_timeout(),
+            http2=_http2(),
+            event_hooks=_async_event_hooks(),
+        )
+        _unbound_async_http_clients.add(client)
+        return client
+    with _lock:
+        client = _async_http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = DefaultAsyncHttpxClient(
+                limits=_limits(),
+                timeout=_timeout(),
+                http2=_http2(),
+                event_hooks=_async_event_hooks(),
+            )
+            _async_http_clients[loop] = client
+        return client
+
+
+def _pools():
+    # httpx doesn't expose pool state, so read it from the underlying httpcore
+    # connection pool, when there is one.
+    clients = [
+        _http_client,
+        *_async_http_clients.values(),
+        *_unbound_async_http_clients,
+    ]
+    for client in clients:
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is not None:
+            yield pool
+
+
+def _observe_connections(options: CallbackOptions):
+    active = idle = 0
+    for pool in _pools():
+        for connection in pool.connections:
+            if connection.is_idle():
+                idle += 1
+            else:
+                active += 1
+    yield Observation(active, {"http.connection.state": "active"})
+    yield Observation(idle, {"http.connection.state": "idle"})
+
+
+def _observe_pending(options: CallbackOptions):
+    pending = sum(len(getattr(pool, "_requests", ())) for pool in _pools())
+    yield Observation(pending)
+
+
+meter = metrics.get_meter(__name__)
+meter.create_observable_up_down_counter(
+    "http.client.open_connections",
+    callbacks=[_observe_connections],
+    unit="{connection}",
+    description="Connections in the shared OpenAI HTTP pool.",
+)
+meter.create_observable_up_down_counter(
+    "http.client.pending_requests",
+    callbacks=[_observe_pending],
+    unit="{request}",
+    description="Requests waiting for or using a connection from the pool.",
+)
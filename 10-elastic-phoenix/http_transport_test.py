@@ -0,0 +1,53 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+
+import http_transport
+import httpx
+from client import OpenAIClient
+from http_transport import async_http_client, attempt_span, http_client
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+
+
+def test_clients_share_pool(default_openai_env):
+    assert OpenAIClient().client._client is OpenAIClient().client._client
+    assert OpenAIClient().client._client is http_client()
+
+
+def test_async_pool_per_event_loop():
+    async def get_clients():
+        return async_http_client(), async_http_client()
+
+    first, second = asyncio.run(get_clients())
+    assert first is second
+    # A new loop cannot reuse connections of the last one.
+    assert asyncio.run(get_clients())[0] is not first
+
+
+def test_pool_configured_by_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_POOL_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "1.5")
+    monkeypatch.setattr(http_transport, "_http_client", None)
+
+    pool = http_client()._transport._pool
+    assert pool._max_connections == 7
+    assert pool._keepalive_expiry == 1.5
+
+
+def test_attempt_recorded_on_its_span(monkeypatch):
+    tracer = TracerProvider().get_tracer(__name__)
+    monkeypatch.setattr(http_transport, "tracer", tracer)
+    request = httpx.Request("POST", "http://backend:8080/v1/chat/completions")
+
+    with attempt_span("attempt") as span:
+        # Another attempt's span being current doesn't matter.
+        with trace.use_span(tracer.start_span("other")) as other:
+            http_transport._record_attempt(request, 1.5)
+
+    assert span.attributes["server.address"] == "backend"
+    assert span.attributes["server.port"] == 8080
+    assert span.attributes["ratelimit.wait"] == 1.5
+    assert "server.address" not in other.attributes
@@ -0,0 +1,117 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Compares the CombinedJudge with separate evaluators on the same answers, so
+you can tell if it is safe to set EVAL_JUDGE=combined. For each eval, it
+reports how often the labels agree, and the answers they disagree on. It also
+reports how long each took and how many judge calls each made.
+
+This calls the real judge model, configured like eval_job.py. Run it like
+this:
+    python judge_benchmark.py
+"""
+
+import os
+import time
+
+import pandas as pd
+from combined_evaluator import CombinedJudge
+from dotenv import load_dotenv
+from eval_job import EVAL_NAMES
+from judge_runner import JudgeRunner
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import (
+    HallucinationEvaluator,
+    OpenAIModel,
+    QAEvaluator,
+)
+
+# Answers to questions about oceans, good and bad, by question and reference.
+EXAMPLES = {
+    ("Which ocean contains Bouvet Island?", "Atlantic Ocean"): [
+        "South Atlantic Ocean.",
+        "Atlantic Ocean",
+        "The Indian Ocean.",
+        "North Atlantic Ocean.",
+        "The Bouvet Sea.",
+        "I don't know.",
+    ],
+    ("Which ocean contains Tahiti?", "Pacific Ocean"): [
+        "South Pacific Ocean",
+        "Tahiti is in the Atlantic Ocean.",
+    ],
+    ("Which ocean contains Madagascar?", "Indian Ocean"): [
+        "Indian Ocean",
+        "The Southern Ocean, near Antarctica.",
+    ],
+    ("Which ocean contains Svalbard?", "Arctic Ocean"): [
+        "The Arctic Ocean.",
+        "The Arctic Ocean, where 30,000 polar bears live on Svalbard.",
+    ],
+    ("Which ocean contains the South Sandwich Islands?", "Atlantic Ocean"): [
+        "The Southern Ocean",
+    ],
+    ("Which ocean contains Iceland?", "Atlantic Ocean"): [
+        "The North Atlantic Ocean, between Greenland and Norway.",
+    ],
+    ("Which ocean contains Hawaii?", "Pacific Ocean"): [
+        "Hawaii isn't in an ocean, it's a US state.",
+    ],
+}
+
+
+def agreement(name, separate, combined, dataframe):
+    agree = separate["label"] == combined["label"]
+    print(f"{name}: {agree.mean():.0%} agree")
+    for i in dataframe.index[~agree]:
+        print(
+            f"\t{dataframe.at[i, 'output']!r}: separate "
+            f"{separate.at[i, 'label']}, combined {combined.at[i, 'label']}"
+        )
+
+
+def main():
+    load_dotenv(dotenv_path="../.env", override=False)
+
+    eval_model = OpenAIModel(
+        model=os.getenv("EVAL_MODEL", "o3-mini"), temperature=0.0
+    )
+    evaluators = [
+        QAEvaluator(eval_model),
+        HallucinationEvaluator(eval_model),
+        OceanEvaluator(eval_model),
+    ]
+    dataframe = pd.DataFrame(
+        [
+            {"input": question, "output": answer, "reference": reference}
+            for (question, reference), answers in EXAMPLES.items()
+            for answer in answers
+        ]
+    )
+
+    results = {}
+    for name in ("separate", "combined"):
+        runner = JudgeRunner()
+        judge = runner if name == "separate" else CombinedJudge(runner)
+        start = time.perf_counter()
+        try:
+            results[name] = judge(
+                dataframe=dataframe,
+                evaluators=evaluators,
+                provide_explanation=True,
+            )
+        finally:
+            runner.close()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {runner.stats.summary(len(dataframe), elapsed)}")
+
+    for name, separate, combined in zip(
+        EVAL_NAMES, results["separate"], results["combined"]
+    ):
+        agreement(name, separate, combined, dataframe)
+
+
+if __name__ == "__main__":
+    main()
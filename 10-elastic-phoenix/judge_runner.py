@@ -0,0 +1,239 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Runs the LLM judge calls of eval_job.py on one event loop, instead of through
+run_evals. All calls share the async connection pool of http_transport.py,
+and concurrency is limited per evaluator and per judge model, so together the
+evaluators can use the judge quota without going over it.
+
+Settings are read from ENV variables, the most specific first:
+* EVAL_<EVALUATOR>_<SETTING>, e.g. EVAL_QA_CONCURRENCY
+* JUDGE_<MODEL>_<SETTING>, e.g. JUDGE_O3_MINI_TIMEOUT
+* EVAL_<SETTING>
+
+SETTING is one of:
+* CONCURRENCY - concurrent calls (default 20)
+* TIMEOUT - seconds before a call is abandoned and retried (default 120)
+* MAX_RETRIES - retries of a call which failed for a transient reason
+  (default 3)
+
+JUDGE_<MODEL>_CONCURRENCY also limits the calls to that model across all
+evaluators, for when they share its quota. phoenix-evals also throttles each
+model, starting at 10 requests per second and adapting to rate limit errors.
+JUDGE_<MODEL>_RATE changes where it starts, e.g. to the quota of the model.
+
+A call which still fails for a transient reason after its retries, e.g. a
+timeout, leaves its row without a label. Other errors, e.g. a bad API key or
+an unknown model, are raised, so the job stops before recording spans as
+failed.
+"""
+
+import asyncio
+import contextlib
+import functools
+import os
+import re
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import pandas as pd
+from http_transport import async_http_client
+from phoenix.evals import LLMEvaluator
+from phoenix.evals.models import BaseModel
+from phoenix.evals.models.rate_limiters import RateLimiter, RateLimitError
+from retry_policy import RetryPolicy, is_retryable
+
+T = TypeVar("T")
+
+DEFAULTS = {"CONCURRENCY": "20", "TIMEOUT": "120", "MAX_RETRIES": "3"}
+
+
+def _env_name(value: str) -> str:
+    return re.sub(r"[^A-Z0-9]+", "_", value.upper()).strip("_")
+
+
+def evaluator_name(evaluator: LLMEvaluator) -> str:
+    """Returns the name of the evaluator in ENV variables, e.g. QA."""
+    return _env_name(type(evaluator).__name__.removesuffix("Evaluator"))
+
+
+@dataclass(frozen=True)
+class JudgeSettings:
+    concurrency: int
+    timeout: float
+    max_retries: int
+
+    @classmethod
+    def from_env(cls, name: str, model: str) -> "JudgeSettings":
+        """Returns the settings of the evaluator name judged by model."""
+
+        def setting(key: str) -> str:
+            for variable in (
+                f"EVAL_{name}_{key}",
+                f"JUDGE_{_env_name(model)}_{key}",
+            ):
+                if value := os.getenv(variable):
+                    return value
+            return os.getenv(f"EVAL_{key}", DEFAULTS[key])
+
+        return cls(
+            concurrency=int(setting("CONCURRENCY")),
+            timeout=float(setting("TIMEOUT")),
+            max_retries=int(setting("MAX_RETRIES")),
+        )
+
+
+class JudgeStats:
+    """Latency of each successful judge call, and count of failed ones."""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.failures = 0
+
+    def summary(self, spans: int, elapsed: float) -> str:
+        text = f"{spans / elapsed:.1f} spans/s"
+        if len(self.latencies) >= 2:
+            p = statistics.quantiles(self.latencies, n=100, method="inclusive")
+            text += (
+                f", {len(self.latencies)} judge calls with latency "
+                f"p50 {p[49]:.2f}s, p95 {p[94]:.2f}s, p99 {p[98]:.2f}s"
+            )
+        if self.failures:
+            text += f", {self.failures} failed"
+        return text
+
+
+class JudgeRunner:
+    """A drop-in for run_evals, keeping one event loop, and so one connection
+    pool, for every call. Call close when done."""
+
+    def __init__(self) -> None:
+        self.stats = JudgeStats()
+        self._runner = asyncio.Runner()
+        self._settings: dict[tuple[str, str], JudgeSettings] = {}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._prepared: set[int] = set()
+        self._rate_limiters: dict[str, RateLimiter] = {}
+
+    def close(self) -> None:
+        self._runner.close()
+
+    def _limits(
+        self, name: str, model: str
+    ) -> tuple[JudgeSettings, list[asyncio.Semaphore]]:
+        if (settings := self._settings.get((name, model))) is None:
+            settings = JudgeSettings.from_env(name, model)
+            self._settings[(name, model)] = settings
+        keys = {f"evaluator {name}": settings.concurrency}
+        if value := os.getenv(f"JUDGE_{_env_name(model)}_CONCURRENCY"):
+            keys[f"model {model}"] = int(value)
+        limits = []
+        for key, concurrency in keys.items():
+            if (semaphore := self._semaphores.get(key)) is None:
+                semaphore = asyncio.Semaphore(concurrency)
+                self._semaphores[key] = semaphore
+            limits.append(semaphore)
+        return settings, limits
+
+    def _prepare(self, model: BaseModel) -> None:
+        """Swaps the async OpenAI client of model for one using the pool of
+        this loop, as OpenAIModel has no option for an HTTP client."""
+        if id(model) in self._prepared:
+            return
+        model._async_client = model._async_client.with_options(
+            http_client=async_http_client()
+        )
+        if rate := os.getenv(f"JUDGE_{_env_name(model.model)}_RATE"):
+            model.initial_rate_limit = float(rate)
+            # Copies of a model, e.g. of TieredJudge, share its quota.
+            limiter = self._rate_limiters.get(model.model)
+            if limiter is None:
+                model._init_rate_limiter()
+                limiter = self._rate_limiters[model.model] = model._rate_limiter
+            model._rate_limiter = limiter
+        self._prepared.add(id(model))
+
+    async def call(
+        self, name: str, model: BaseModel, fn: Callable[[], Awaitable[T]]
+    ) -> Optional[T]:
+        """Returns the result of a judge call, or None if it failed for a
+        transient reason. name is the evaluator, as in ENV variables."""
+        self._prepare(model)
+        settings, limits = self._limits(name, model.model)
+
+        async def attempt() -> T:
+            start = time.perf_counter()
+            result = await asyncio.wait_for(fn(), settings.timeout)
+            self.stats.latencies.append(time.perf_counter() - start)
+            return result
+
+        retry = RetryPolicy(max_attempts=settings.max_retries + 1)
+        async with contextlib.AsyncExitStack() as stack:
+            # The evaluator's limit is first, so a call waiting for it doesn't
+            # hold a slot of the model.
+            for limit in limits:
+                await stack.enter_async_context(limit)
+            try:
+                return await retry.acall(attempt)
+            except Exception as e:
+                # phoenix-evals raises RateLimitError once its throttle gives
+                # up on rate limit errors.
+                if not (is_retryable(e) or isinstance(e, RateLimitError)):
+                    raise
+                self.stats.failures += 1
+                return None
+
+    def run(self, calls: list[Awaitable[T]]) -> list[T]:
+        """Runs coroutines of call concurrently, returning their results. If
+        one raises, the rest are cancelled."""
+
+        async def gather() -> list[T]:
+            tasks = [asyncio.ensure_future(call) for call in calls]
+            try:
+                return await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        return self._runner.run(gather())
+
+    def __call__(
+        self,
+        dataframe: pd.DataFrame,
+        evaluators: list[LLMEvaluator],
+        provide_explanation: bool = False,
+        use_function_calling_if_available: bool = True,
+        **kwargs,
+    ) -> list[pd.DataFrame]:
+        records = dataframe.to_dict("records")
+        options = {
+            "provide_explanation": provide_explanation,
+            "use_function_calling_if_available": (
+                use_function_calling_if_available
+            ),
+        }
+        calls = [
+            self.call(
+                evaluator_name(evaluator),
+                evaluator._model,
+                functools.partial(evaluator.aevaluate, record, **options),
+            )
+            for evaluator in evaluators
+            for record in records
+        ]
+        results = iter(self.run(calls))
+        failed = (None, None, None)
+        return [
+            pd.DataFrame(
+                [next(results) or failed for _ in records],
+                index=dataframe.index,
+                columns=["label", "score", "explanation"],
+            )
+            for _ in evaluators
+        ]
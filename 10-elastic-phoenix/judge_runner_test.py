@@ -0,0 +1,154 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import copy
+
+import pandas as pd
+import pytest
+from judge_runner import JudgeRunner, JudgeSettings
+from phoenix.evals import HallucinationEvaluator, OpenAIModel, QAEvaluator
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("EVAL_CONCURRENCY", "5")
+    monkeypatch.setenv("EVAL_QA_TIMEOUT", "10")
+    monkeypatch.setenv("JUDGE_O3_MINI_TIMEOUT", "30")
+    monkeypatch.setenv("JUDGE_O3_MINI_MAX_RETRIES", "1")
+
+    assert JudgeSettings.from_env("QA", "o3-mini") == JudgeSettings(
+        concurrency=5, timeout=10, max_retries=1
+    )
+    assert JudgeSettings.from_env("HALLUCINATION", "gpt-4o") == JudgeSettings(
+        concurrency=5, timeout=120, max_retries=3
+    )
+
+
+class FakeEvaluations:
+    """Answers aevaluate of evaluators after a delay, tracking concurrency."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.active = {}
+        self.max_active = {}
+        self.max_total = 0
+
+    def patch(self, monkeypatch, evaluator):
+        name = type(evaluator).__name__
+
+        async def aevaluate(record, **kwargs):
+            self.active[name] = self.active.get(name, 0) + 1
+            self.max_active[name] = max(
+                self.max_active.get(name, 0), self.active[name]
+            )
+            self.max_total = max(self.max_total, sum(self.active.values()))
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self.active[name] -= 1
+            return "correct", 1, f"{name} {record['input']}"
+
+        monkeypatch.setattr(evaluator, "aevaluate", aevaluate)
+
+
+def test_limits_concurrency(monkeypatch, default_openai_env):
+    monkeypatch.setenv("EVAL_QA_CONCURRENCY", "2")
+    monkeypatch.setenv("EVAL_HALLUCINATION_CONCURRENCY", "4")
+    model = OpenAIModel(model="o3-mini")
+    evaluators = [QAEvaluator(model), HallucinationEvaluator(model)]
+    fake = FakeEvaluations()
+    for evaluator in evaluators:
+        fake.patch(monkeypatch, evaluator)
+    spans = pd.DataFrame({"input": range(10)}, index=range(10))
+
+    runner = JudgeRunner()
+    try:
+        qa, hallucination = runner(spans, evaluators)
+    finally:
+        runner.close()
+
+    assert fake.max_active == {"QAEvaluator": 2, "HallucinationEvaluator": 4}
+    assert list(qa["explanation"]) == [f"QAEvaluator {i}" for i in range(10)]
+    assert list(hallucination["label"]) == ["correct"] * 10
+    assert len(runner.stats.latencies) == 20
+
+
+def test_model_limits_concurrency(monkeypatch, default_openai_env):
+    monkeypatch.setenv("JUDGE_O3_MINI_CONCURRENCY", "3")
+    model = OpenAIModel(model="o3-mini")
+    evaluators = [QAEvaluator(model), HallucinationEvaluator(model)]
+    fake = FakeEvaluations()
+    for evaluator in evaluators:
+        fake.patch(monkeypatch, evaluator)
+    spans = pd.DataFrame({"input": range(10)}, index=range(10))
+
+    runner = JudgeRunner()
+    try:
+        runner(spans, evaluators)
+    finally:
+        runner.close()
+
+    # Both evaluators together stay within the limit of their model.
+    assert fake.max_total == 3
+
+
+def test_timeout_is_retried_then_fails(monkeypatch, default_openai_env):
+    monkeypatch.setenv("EVAL_TIMEOUT", "0.01")
+    monkeypatch.setenv("EVAL_MAX_RETRIES", "1")
+    evaluator = QAEvaluator(OpenAIModel(model="o3-mini"))
+    fake = FakeEvaluations(delay=1)
+    fake.patch(monkeypatch, evaluator)
+    spans = pd.DataFrame({"input": ["q"]}, index=["span"])
+
+    runner = JudgeRunner()
+    try:
+        (qa,) = runner(spans, [evaluator])
+    finally:
+        runner.close()
+
+    assert qa.loc["span"].isna().all()
+    assert runner.stats.failures == 1
+
+
+def test_model_copies_share_rate(monkeypatch, default_openai_env):
+    monkeypatch.setenv("JUDGE_O3_MINI_RATE", "2")
+    model = OpenAIModel(model="o3-mini")
+    labeling = copy.copy(model)
+    labeling.max_tokens = 50
+
+    async def prepare():
+        runner._prepare(model)
+        runner._prepare(labeling)
+
+    runner = JudgeRunner()
+    try:
+        runner._runner.run(prepare())
+    finally:
+        runner.close()
+
+    assert model._rate_limiter is labeling._rate_limiter
+    assert model.initial_rate_limit == 2
+
+
+def test_permanent_error_is_raised(monkeypatch, default_openai_env):
+    evaluator = QAEvaluator(OpenAIModel(model="o3-mini"))
+    spans = pd.DataFrame({"input": ["q1", "q2"]}, index=["span1", "span2"])
+
+    async def aevaluate(record, **kwargs):
+        if record["input"] == "q1":
+            raise ValueError("invalid API key")  # not worth retrying
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(evaluator, "aevaluate", aevaluate)
+
+    runner = JudgeRunner()
+    try:
+        with pytest.raises(ValueError):
+            runner(spans, [evaluator])
+        # The other call was cancelled, instead of left running.
+        assert not asyncio.all_tasks(runner._runner.get_loop())
+    finally:
+        runner.close()
+
+    assert runner.stats.failures == 0
@@ -2,8 +2,9 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import os
 import sys
-from user_feedback import add_user_feedback
+from importlib.metadata import entry_points
 
 from client import OpenAIClient
 from dotenv import load_dotenv
@@ -11,26 +12,62 @@ from opentelemetry.instrumentation import auto_instrumentation
 
 message = "Answer in up to 3 words: Which ocean contains Bouvet Island?"
 
+# The only instrumentation this app needs: OpenAI calls via OpenInference, and
+# the HTTP requests they make.
+FAST_START_INSTRUMENTATIONS = {"openai", "httpx"}
+
+
+def disable_unused_instrumentations():
+    """Disables instrumentation this app doesn't need, such as extras installed
+    by edot-bootstrap, so they aren't imported on start. This has no effect if
+    OTEL_PYTHON_DISABLED_INSTRUMENTATIONS is already set."""
+    if os.getenv("OTEL_PYTHON_DISABLED_INSTRUMENTATIONS"):
+        return
+    # Reading entry points doesn't import the instrumentation.
+    installed = {
+        e.name for e in entry_points(group="opentelemetry_instrumentor")
+    }
+    unused = installed - FAST_START_INSTRUMENTATIONS
+    os.environ["OTEL_PYTHON_DISABLED_INSTRUMENTATIONS"] = ",".join(
+        sorted(unused)
+    )
+
 
 def main():
     # Load environment variables used by OpenTelemetry and OpenAIClient().
     load_dotenv(dotenv_path="../.env", override=False)
 
+    if "--fast-start" in sys.argv:
+        disable_unused_instrumentations()
+
     # Auto-instrument this file for OpenTelemetry logs, metrics and traces.
     # You can opt out by setting the ENV variable `OTEL_SDK_DISABLED=true`.
     auto_instrumentation.initialize()
 
     client = OpenAIClient()
-    response = client.chat(message=message)
-    print(response)
+    # Print the answer as it is generated, instead of waiting for all of it.
+    stream = client.chat_stream(message=message)
+    for delta in stream:
+        print(delta, end="", flush=True)
+    print()
+    response = stream.response
 
     if "--feedback" in sys.argv and response.span_id:
+        # Deferred, as importing Phoenix takes longer than everything else.
+        from user_feedback import feedback_sink
+
         while True:
             rating = input("Are you satisfied? (y/n) ").strip().lower()
             if rating in ["y", "n"]:
                 break
             print("Invalid input. Please enter 'y' or 'n'.")
-        add_user_feedback(response.span_id, rating == "y")
+        # Logged now, to say if it was. If Phoenix is down, it is retried on
+        # exit, then lost, unless FEEDBACK_SPOOL_DIR keeps it on disk until a
+        # later run.
+        sink = feedback_sink()
+        sink.submit(response.span_id, rating == "y")
+        if sink.flush():
+            print("Feedback logged to Phoenix.")
 
 
 if __name__ == "__main__":
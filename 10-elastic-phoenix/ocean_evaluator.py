@@ -2,8 +2,10 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import re
 from collections import OrderedDict
 
+import pandas as pd
 from phoenix.evals import ClassificationTemplate, LLMEvaluator
 from phoenix.evals.models import BaseModel
 
@@ -63,6 +65,26 @@ oceans. This template distinguishes between 'correct' and 'incorrect' answers
 and includes a detailed explanation template for reasoned evaluations.
 """
 
+# Any NOAA ocean named in an answer. Answers naming none can't be "correct".
+ANY_OCEAN = re.compile(r"\b(?:atlantic|pacific|indian|arctic|southern)\b")
+
+
+def _text(value) -> str:
+    """Returns the text of a string or LLM messages, e.g. llm.output_messages
+    from Phoenix."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return value.get("message.content") or value.get("content") or ""
+    if isinstance(value, (list, tuple)) or hasattr(value, "tolist"):
+        return " ".join(_text(v) for v in value)
+    return ""
+
+
+def _normalize(values: pd.Series) -> pd.Series:
+    text = values.map(_text).str.lower().str.replace(r"\s+", " ", regex=True)
+    return text.str.strip().str.rstrip(".!")
+
 
 class OceanEvaluator(LLMEvaluator):
     """
@@ -80,3 +102,35 @@ class OceanEvaluator(LLMEvaluator):
         """
 
         super().__init__(model=model, template=OCEAN_PROMPT_TEMPLATE)
+
+    def prefilter(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Labels clear-cut answers with rules, so only the rest need the LLM.
+
+        An answer naming no NOAA ocean is "incorrect", whatever the question.
+        Whether an ocean is relevant depends on the question, so answers
+        naming one are left for the LLM, like the "reference" column is.
+
+        Args:
+            dataframe (pd.DataFrame): Rows with an "output" column.
+
+        Returns:
+            pd.DataFrame: label, score, explanation and path ("rule") columns,
+            with an empty label for rows the LLM should evaluate.
+        """
+        result = pd.DataFrame(
+            index=dataframe.index,
+            columns=["label", "score", "explanation", "path"],
+            dtype=object,
+        )
+        if "output" not in dataframe:
+            return result
+        output = _normalize(dataframe["output"])
+        unnamed = ~output.str.contains(ANY_OCEAN)
+        result.loc[unnamed] = [
+            OCEAN_PROMPT_RAILS_MAP[False],
+            0,
+            "The answer names no NOAA ocean.",
+            "rule",
+        ]
+        return result
@@ -0,0 +1,54 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import pandas as pd
+import pytest
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import OpenAIModel
+
+
+@pytest.mark.parametrize(
+    "output, label",
+    [
+        ("I don't know.", "incorrect"),
+        ("Bouvet Island is Norwegian.", "incorrect"),
+        # Whether the ocean is relevant depends on the question, so the LLM
+        # labels these, whatever the reference.
+        ("South Atlantic Ocean.", None),
+        ("The Pacific Ocean", None),
+        ("It's not the Atlantic Ocean.", None),
+        ("It's in the southern hemisphere.", None),
+    ],
+)
+def test_prefilter(default_openai_env, output, label):
+    evaluator = OceanEvaluator(OpenAIModel(model="o3-mini"))
+    spans = pd.DataFrame(
+        {"input": "Which ocean contains Bouvet Island?", "output": [output]},
+        index=["span"],
+    )
+    spans["reference"] = "Atlantic Ocean"
+
+    result = evaluator.prefilter(spans).loc["span"]
+
+    if label is None:
+        assert result.isna().all()
+    else:
+        assert (result["label"], result["path"]) == (label, "rule")
+
+
+def test_prefilter_output_messages(default_openai_env):
+    evaluator = OceanEvaluator(OpenAIModel(model="o3-mini"))
+    messages = [
+        {"message.role": "assistant", "message.content": "Paris, France."}
+    ]
+    spans = pd.DataFrame({"output": [messages]}, index=["span"])
+
+    result = evaluator.prefilter(spans).loc["span"]
+
+    assert result.to_dict() == {
+        "label": "incorrect",
+        "score": 0,
+        "explanation": "The answer names no NOAA ocean.",
+        "path": "rule",
+    }
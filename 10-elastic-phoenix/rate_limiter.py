@@ -0,0 +1,168 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Paces OpenAI requests so they don't exceed the rate limit, instead of failing
+with 429 once it is exceeded.
+
+OpenAI responses include headers like x-ratelimit-remaining-requests and
+x-ratelimit-reset-requests, per model. These describe a token bucket: how much
+is left now and how long until it is full again. RateLimiter tracks a bucket
+of requests and one of tokens per model, and waits before a request if either
+bucket doesn't have enough left. Responses without these headers, such as from
+Ollama, leave requests unlimited.
+
+State is kept in a file locked with fcntl, so that threads and processes on
+the same host share the same budget. The file defaults to one in the temp
+directory, and can be changed with the ENV variable OPENAI_RATELIMIT_STATE. Set
+it to an empty value to only share state between threads.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Mapping, Optional
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> float:
+    """Parses durations in the format of OpenAI reset headers, e.g. "1m30s"
+    or "5ms", to seconds."""
+    return sum(
+        float(amount) * _UNITS[unit]
+        for amount, unit in _DURATION.findall(value)
+    )
+
+
+def estimate_tokens(messages: list[dict], max_tokens: int = 0) -> int:
+    """Estimates tokens counted against the limit, assuming about 4 characters
+    per token. The next response corrects any difference."""
+    characters = sum(len(str(m.get("content") or "")) for m in messages)
+    return characters // 4 + max_tokens
+
+
+def _available(bucket: dict, now: float) -> float:
+    # Buckets refill linearly until they reach their limit at the reset time.
+    refilled = bucket["remaining"] + bucket["rate"] * (now - bucket["updated"])
+    return min(bucket["limit"], refilled)
+
+
+class RateLimiter:
+    def __init__(self, state_path: Optional[str] = None) -> None:
+        if state_path is None:
+            state_path = os.getenv(
+                "OPENAI_RATELIMIT_STATE",
+                os.path.join(tempfile.gettempdir(), "openai-ratelimit.json"),
+            )
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._state: dict = {}
+
+    def _load(self, file) -> dict:
+        if file is None:
+            return self._state
+        file.seek(0)
+        content = file.read()
+        return json.loads(content) if content else {}
+
+    def _save(self, file, state: dict) -> None:
+        if file is None:
+            self._state = state
+            return
+        file.seek(0)
+        file.truncate()
+        file.write(json.dumps(state))
+        file.flush()
+
+    def _transaction(self, update) -> float:
+        """Applies update to the shared state, holding locks for both threads
+        and processes."""
+        with self._lock:
+            if not self.state_path:
+                return update(self._state, None)
+            with open(self.state_path, "a+") as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    return update(self._load(file), file)
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def try_acquire(self, model: str, tokens: int) -> float:
+        """Takes one request and the estimated tokens from the buckets of the
+        model, returning zero. If there isn't enough left, takes nothing and
+        returns the seconds to wait before trying again."""
+
+        def update(state: dict, file) -> float:
+            if not (buckets := state.get(model)):
+                return 0.0  # unlimited, so there is nothing to save
+            now = time.time()
+            wait = 0.0
+            for name, cost in (("requests", 1), ("tokens", tokens)):
+                if not (bucket := buckets.get(name)):
+                    continue
+                missing = min(cost, bucket["limit"]) - _available(bucket, now)
+                if missing > 0:
+                    wait = max(wait, missing / max(bucket["rate"], 1e-6))
+            if wait > 0:
+                return wait
+            for name, cost in (("requests", 1), ("tokens", tokens)):
+                if bucket := buckets.get(name):
+                    bucket["remaining"] = _available(bucket, now) - cost
+                    bucket["updated"] = now
+            self._save(file, state)
+            return 0.0
+
+        return self._transaction(update)
+
+    def acquire(self, model: str, tokens: int) -> float:
+        """Blocks until the request can be made, returning seconds waited."""
+        waited = 0.0
+        while wait := self.try_acquire(model, tokens):
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self, model: str, tokens: int) -> float:
+        """Like acquire, but doesn't block the event loop."""
+        waited = 0.0
+        while wait := self.try_acquire(model, tokens):
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def update(self, model: str, headers: Mapping[str, str]) -> None:
+        """Replaces the buckets of the model with what the server reported."""
+        buckets = {}
+        for name in ("requests", "tokens"):
+            limit = headers.get(f"x-ratelimit-limit-{name}")
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            reset = headers.get(f"x-ratelimit-reset-{name}")
+            if limit is None or remaining is None or reset is None:
+                continue
+            limit, remaining = float(limit), float(remaining)
+            reset_seconds = parse_duration(reset)
+            rate = (limit - remaining) / reset_seconds if reset_seconds else 0
+            buckets[name] = {
+                "limit": limit,
+                "remaining": remaining,
+                # If nothing is used yet, assume the limit is per minute.
+                "rate": rate or limit / 60,
+                "updated": time.time(),
+            }
+        if not buckets:
+            return
+
+        def update(state: dict, file) -> float:
+            state[model] = buckets
+            self._save(file, state)
+            return 0.0
+
+        self._transaction(update)
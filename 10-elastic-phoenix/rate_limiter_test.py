@@ -0,0 +1,52 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import pytest
+from rate_limiter import RateLimiter, parse_duration
+
+
+def ratelimit_headers(remaining_requests: int, reset_requests: str) -> dict:
+    return {
+        "x-ratelimit-limit-requests": "10000",
+        "x-ratelimit-remaining-requests": str(remaining_requests),
+        "x-ratelimit-reset-requests": reset_requests,
+        "x-ratelimit-limit-tokens": "200000",
+        "x-ratelimit-remaining-tokens": "199982",
+        "x-ratelimit-reset-tokens": "5ms",
+    }
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("5ms", 0.005), ("8.64s", 8.64), ("1m30s", 90), ("2h", 7200)],
+)
+def test_parse_duration(value, expected):
+    assert parse_duration(value) == pytest.approx(expected)
+
+
+def test_unlimited_without_headers():
+    limiter = RateLimiter(state_path="")
+    limiter.update("qwen2.5:0.5b", {})
+
+    assert limiter.try_acquire("qwen2.5:0.5b", tokens=1000) == 0
+
+
+def test_waits_when_exhausted():
+    limiter = RateLimiter(state_path="")
+    limiter.update("gpt-4o-mini", ratelimit_headers(0, "1m"))
+
+    # 10000 requests refill over a minute, so the next is in 6ms.
+    assert limiter.try_acquire("gpt-4o-mini", tokens=20) == pytest.approx(
+        0.006, rel=0.1
+    )
+    # Other models have their own limits
+    assert limiter.try_acquire("o3-mini", tokens=20) == 0
+
+
+def test_state_shared_between_processes(tmp_path):
+    state_path = str(tmp_path / "ratelimit.json")
+    RateLimiter(state_path).update("gpt-4o-mini", ratelimit_headers(1, "1h"))
+
+    assert RateLimiter(state_path).try_acquire("gpt-4o-mini", tokens=20) == 0
+    assert RateLimiter(state_path).try_acquire("gpt-4o-mini", tokens=20) > 0
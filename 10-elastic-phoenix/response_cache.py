@@ -0,0 +1,142 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Caches chat completions which are deterministic enough to reuse. The client
+sends temperature=0, so the same messages to the same model and base URL give
+the same answer, and there's no need to pay latency or tokens for it twice.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Protocol
+
+
+def cache_key(
+    base_url: str, model: str, messages: list[dict], temperature: float
+) -> str:
+    """Returns a stable hash of everything that affects the completion."""
+    payload = json.dumps(
+        [base_url, model, messages, temperature],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Cache(Protocol):
+    def get(self, key: str) -> Optional[str]: ...
+
+    def put(self, key: str, content: str) -> None: ...
+
+
+class LRUCache:
+    """In-process cache which evicts the least recently used entry when full,
+    and any entry older than ttl seconds."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, content = entry
+            if time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return content
+
+    def put(self, key: str, content: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk cache, so answers survive restarts and are shared by processes
+    on the same host."""
+
+    def __init__(self, path: str, ttl: float = 86400) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, created REAL NOT NULL"
+            ")"
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content FROM responses WHERE key = ? AND created > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, content: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, content, time.time()),
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class ResponseCache:
+    """Looks up the in-process tier first, then the optional disk tier. Disk
+    hits are promoted to memory."""
+
+    def __init__(self, memory: Cache, disk: Optional[Cache] = None) -> None:
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str) -> Optional[str]:
+        if (content := self.memory.get(key)) is not None:
+            return content
+        if (
+            self.disk is not None
+            and (content := self.disk.get(key)) is not None
+        ):
+            self.memory.put(key, content)
+            return content
+        return None
+
+    def put(self, key: str, content: str) -> None:
+        self.memory.put(key, content)
+        if self.disk is not None:
+            self.disk.put(key, content)
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Returns a cache configured by ENV variables, or None if
+        CHAT_CACHE_SIZE is unset or zero."""
+        size = int(os.getenv("CHAT_CACHE_SIZE", "0"))
+        if size <= 0:
+            return None
+        ttl = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+        disk = None
+        if path := os.getenv("CHAT_CACHE_PATH"):
+            disk = SQLiteCache(path, ttl=ttl)
+        return cls(LRUCache(max_size=size, ttl=ttl), disk)
@@ -0,0 +1,48 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+from response_cache import LRUCache, ResponseCache, SQLiteCache, cache_key
+
+messages = [{"role": "user", "content": "Which ocean contains Bouvet Island?"}]
+
+
+def test_cache_key():
+    key = cache_key("https://api.openai.com/v1", "gpt-4o-mini", messages, 0)
+
+    assert key == cache_key(
+        "https://api.openai.com/v1", "gpt-4o-mini", messages, 0
+    )
+    assert key != cache_key(
+        "http://localhost:11434/v1", "gpt-4o-mini", messages, 0
+    )
+    assert key != cache_key("https://api.openai.com/v1", "gpt-4o", messages, 0)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put("a", "Atlantic")
+    cache.put("b", "Pacific")
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("c", "Indian")
+
+    assert cache.get("a") == "Atlantic"
+    assert cache.get("b") is None
+    assert cache.get("c") == "Indian"
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(ttl=0)
+    cache.put("a", "Atlantic")
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_response_cache_promotes_disk_hits(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.db"))
+    disk.put("a", "Atlantic")
+    memory = LRUCache()
+
+    assert ResponseCache(memory, disk).get("a") == "Atlantic"
+    assert memory.get("a") == "Atlantic"
@@ -0,0 +1,189 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Retries OpenAI requests which failed for transient reasons: rate limiting
+(429), server errors (5xx), timeouts and connection errors.
+
+Delays follow the Retry-After header when the server sends one, otherwise
+exponential backoff with full jitter. All policies share a RetryBudget, so
+that retries add at most a fraction of extra load. When a partial outage fails
+most requests, retries stop once the budget is spent instead of multiplying
+the load on a struggling server.
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+from opentelemetry import metrics
+
+T = TypeVar("T")
+
+meter = metrics.get_meter(__name__)
+retries_counter = meter.create_counter(
+    "openai.client.retries",
+    unit="{retry}",
+    description="Retries of failed OpenAI requests.",
+)
+backoff_histogram = meter.create_histogram(
+    "openai.client.retry.backoff",
+    unit="s",
+    description="Time waited before retrying an OpenAI request.",
+)
+
+# The current attempt and time backed off so far, read by the HTTP hooks in
+# http_transport.py to add them to the span of the request.
+current_attempt: ContextVar[tuple[int, float]] = ContextVar(
+    "current_attempt", default=(0, 0.0)
+)
+
+
+class RetryBudget:
+    """Allows retries up to ratio of requests, plus min_per_second so that
+    retries still work when there is little traffic."""
+
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        min_per_second: float = 1.0,
+        max_balance: float = 10.0,
+    ) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._balance = max_balance
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _deposit(self, amount: float) -> None:
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._balance = min(self.max_balance, self._balance + amount)
+        self._updated = now
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._deposit(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Returns True and spends one retry if the budget allows it."""
+        with self._lock:
+            self._deposit(0)
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+retry_budget = RetryBudget(
+    ratio=float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", "0.1"))
+)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(
+        error,
+        (TimeoutError, openai.APITimeoutError, openai.APIConnectionError),
+    ):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Returns the seconds the server asked to wait, if it did."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    if value := response.headers.get("retry-after-ms"):
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    if value := response.headers.get("retry-after"):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, date.timestamp() - time.time())
+    return None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int | None = None,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        budget: RetryBudget = retry_budget,
+    ) -> None:
+        self.max_attempts = max_attempts or int(
+            os.getenv("OPENAI_MAX_ATTEMPTS", "3")
+        )
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Returns seconds to wait before retrying after the failed attempt
+        (starting at 1), or None to give up."""
+        if attempt >= self.max_attempts or not is_retryable(error):
+            return None
+        delay = retry_after(error)
+        if delay is None:
+            ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay = random.uniform(0, ceiling)
+        elif delay > self.max_delay:
+            return None  # better to fail now than to hold the caller that long
+        if not self.budget.try_spend():
+            return None
+        retries_counter.add(1, {"error.type": type(error).__name__})
+        backoff_histogram.record(delay)
+        return delay
+
+    def call(self, fn: Callable[[], T]) -> T:
+        self.budget.record_request()
+        backed_off = 0.0
+        attempt = 1
+        while True:
+            token = current_attempt.set((attempt, backed_off))
+            try:
+                return fn()
+            except Exception as e:
+                if (delay := self.backoff(attempt, e)) is None:
+                    raise
+            finally:
+                current_attempt.reset(token)
+            time.sleep(delay)
+            backed_off += delay
+            attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self.budget.record_request()
+        backed_off = 0.0
+        attempt = 1
+        while True:
+            token = current_attempt.set((attempt, backed_off))
+            try:
+                return await fn()
+            except Exception as e:
+                if (delay := self.backoff(attempt, e)) is None:
+                    raise
+            finally:
+                current_attempt.reset(token)
+            await asyncio.sleep(delay)
+            backed_off += delay
+            attempt += 1
@@ -0,0 +1,74 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import httpx
+import openai
+import pytest
+from retry_policy import RetryBudget, RetryPolicy
+
+request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status_code: int, headers: dict | None = None):
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def test_backoff_uses_retry_after():
+    policy = RetryPolicy(max_attempts=3)
+
+    assert policy.backoff(1, status_error(429, {"retry-after": "2"})) == 2
+    assert (
+        policy.backoff(1, status_error(503, {"retry-after-ms": "20"})) == 0.02
+    )
+
+
+def test_backoff_gives_up():
+    policy = RetryPolicy(max_attempts=2, max_delay=30)
+
+    assert policy.backoff(1, status_error(400)) is None
+    assert policy.backoff(2, status_error(500)) is None  # attempts exhausted
+    assert policy.backoff(1, status_error(429, {"retry-after": "60"})) is None
+
+
+def test_backoff_has_jitter():
+    policy = RetryPolicy(max_attempts=5, base_delay=1, max_delay=30)
+    delays = {
+        policy.backoff(3, openai.APITimeoutError(request)) for _ in range(5)
+    }
+
+    assert all(0 <= d <= 4 for d in delays)
+    assert len(delays) > 1
+
+
+def test_budget_limits_retries():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_balance=1)
+    policy = RetryPolicy(max_attempts=3, budget=budget)
+
+    assert policy.backoff(1, status_error(500, {"retry-after": "0"})) == 0
+    assert policy.backoff(1, status_error(500, {"retry-after": "0"})) is None
+    budget.record_request()
+    budget.record_request()
+    assert policy.backoff(1, status_error(500, {"retry-after": "0"})) == 0
+
+
+def test_call_retries_until_success():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise status_error(502, {"retry-after": "0"})
+        return "Atlantic Ocean"
+
+    assert RetryPolicy(max_attempts=3).call(flaky) == "Atlantic Ocean"
+    assert len(attempts) == 3
+
+
+def test_call_raises_when_not_retryable():
+    def bad_request():
+        raise status_error(400)
+
+    with pytest.raises(openai.APIStatusError):
+        RetryPolicy().call(bad_request)
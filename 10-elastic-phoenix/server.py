@@ -0,0 +1,234 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Serves AsyncOpenAIClient over HTTP, so that many users can chat and give
+feedback without a process each:
+* POST /chat {"message": "..."} returns {"answer": "...", "span_id": "..."}
+* POST /feedback {"span_id": "...", "good": true} annotates the span soon
+
+At most max_concurrency chats call OpenAI at a time, and up to max_queue more
+wait their turn. Past that, /chat returns 429 so load balancers and clients
+back off instead of piling up requests that would time out anyway.
+
+With a batch window, identical messages arriving within it, or while it is
+answered, share one answer. Shared answers don't take a place in the queue.
+
+Run it like this, then try curl -d '{"message": "hi"}' localhost:8080/chat
+    python server.py --port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from http import HTTPStatus
+from typing import Optional
+
+import openai
+from client import AsyncOpenAIClient, ChatResponse
+from dotenv import load_dotenv
+from main import disable_unused_instrumentations
+from opentelemetry import propagate, trace
+from opentelemetry.instrumentation import auto_instrumentation
+
+tracer = trace.get_tracer(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when the queue is full."""
+
+
+class ChatServer:
+    def __init__(
+        self,
+        client: AsyncOpenAIClient | None = None,
+        max_concurrency: int | None = None,
+        max_queue: int | None = None,
+        batch_window: float | None = None,
+    ) -> None:
+        self.client = client or AsyncOpenAIClient()
+        self.max_concurrency = max_concurrency or self.client.max_concurrency
+        if max_queue is None:
+            max_queue = int(os.getenv("CHAT_SERVER_MAX_QUEUE", "100"))
+        self.max_queue = max_queue
+        if batch_window is None:
+            batch_window = float(os.getenv("CHAT_SERVER_BATCH_WINDOW", "0"))
+        self.batch_window = batch_window
+        self.pending = 0  # chats in flight or queued
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._batches: dict[str, asyncio.Future] = {}
+
+    async def chat(self, message: str) -> ChatResponse:
+        """Answers the message, raising Overloaded if the queue is full."""
+        if self.batch_window and (batch := self._batches.get(message)):
+            return await asyncio.shield(batch)
+        if self.pending >= self.max_concurrency + self.max_queue:
+            raise Overloaded()
+        self.pending += 1
+        try:
+            if not self.batch_window:
+                async with self._semaphore:
+                    return await self.client.achat(message)
+            return await self._batched_chat(message)
+        finally:
+            self.pending -= 1
+
+    async def _batched_chat(self, message: str) -> ChatResponse:
+        batch = asyncio.get_running_loop().create_future()
+        self._batches[message] = batch
+        try:
+            await asyncio.sleep(self.batch_window)
+            async with self._semaphore:
+                response = await self.client.achat(message)
+        except BaseException as e:
+            batch.set_exception(e)
+            batch.exception()  # don't warn if there were no followers
+            raise
+        finally:
+            del self._batches[message]
+        batch.set_result(response)
+        return response
+
+    async def route(
+        self, method: str, path: str, body: bytes
+    ) -> tuple[int, Optional[dict]]:
+        """Returns the status and JSON body of the response."""
+        if method != "POST" or path not in ("/chat", "/feedback"):
+            return HTTPStatus.NOT_FOUND, {"error": "not found"}
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "invalid JSON"}
+        if not isinstance(request, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "expected a JSON object"}
+
+        if path == "/feedback":
+            if not request.get("span_id") or "good" not in request:
+                return HTTPStatus.BAD_REQUEST, {"error": "missing span_id"}
+            # Deferred, as importing Phoenix takes longer than everything else.
+            from user_feedback import feedback_sink
+
+            feedback_sink().submit(request["span_id"], bool(request["good"]))
+            return HTTPStatus.ACCEPTED, None
+
+        if not isinstance(message := request.get("message"), str):
+            return HTTPStatus.BAD_REQUEST, {"error": "missing message"}
+        try:
+            response = await self.chat(message)
+        except Overloaded:
+            return HTTPStatus.TOO_MANY_REQUESTS, {"error": "queue is full"}
+        except openai.OpenAIError as e:
+            return HTTPStatus.BAD_GATEWAY, {"error": str(e)}
+        return HTTPStatus.OK, {
+            "answer": response.content,
+            "span_id": response.span_id,
+            "cached": response.cached,
+        }
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serves HTTP/1.1 requests on one connection until it closes."""
+        try:
+            while (request := await _read_request(reader)) is not None:
+                method, path, headers, body = request
+                with tracer.start_as_current_span(
+                    f"{method} {path}",
+                    context=propagate.extract(headers),
+                    kind=trace.SpanKind.SERVER,
+                ) as span:
+                    try:
+                        status, payload = await self.route(method, path, body)
+                    except Exception as e:
+                        span.record_exception(e)
+                        span.set_status(trace.StatusCode.ERROR, repr(e))
+                        status = HTTPStatus.INTERNAL_SERVER_ERROR
+                        payload = {"error": "internal error"}
+                    span.set_attribute("http.response.status_code", status)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass  # the client went away
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port, backlog=1024)
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[tuple[str, str, dict[str, str], bytes]]:
+    """Returns the method, path, headers and body of the next request, or None
+    if the connection closed or the request can't be parsed."""
+    try:
+        if not (request_line := await reader.readline()):
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while (line := await reader.readline()).strip():
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ValueError):
+        return None  # the client went away or sent something we can't parse
+    return method, path, headers, body
+
+
+def _response(status: int, payload: Optional[dict], keep_alive: bool) -> bytes:
+    body = b"" if payload is None else json.dumps(payload).encode()
+    headers = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    if payload is not None:
+        headers.append("Content-Type: application/json")
+    headers.append(f"Content-Length: {len(body)}")
+    if status == HTTPStatus.TOO_MANY_REQUESTS:
+        headers.append("Retry-After: 1")
+    if not keep_alive:
+        headers.append("Connection: close")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def serve_forever(server: ChatServer, host: str, port: int) -> None:
+    listener = await server.serve(host, port)
+    port = listener.sockets[0].getsockname()[1]  # in case port was 0
+    print(f"Serving chat on http://{host}:{port}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves chat over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, help="requests in flight")
+    parser.add_argument("--max-queue", type=int, help="requests waiting")
+    parser.add_argument("--batch-window", type=float, help="seconds")
+    parser.add_argument("--fast-start", action="store_true")
+    args = parser.parse_args()
+
+    # Load environment variables used by OpenTelemetry and AsyncOpenAIClient().
+    load_dotenv(dotenv_path="../.env", override=False)
+    if args.fast_start:
+        disable_unused_instrumentations()
+    auto_instrumentation.initialize()
+
+    server = ChatServer(
+        AsyncOpenAIClient(max_concurrency=args.concurrency),
+        max_queue=args.max_queue,
+        batch_window=args.batch_window,
+    )
+    try:
+        asyncio.run(serve_forever(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
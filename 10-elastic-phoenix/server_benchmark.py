@@ -0,0 +1,134 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Load tests server.py against a fake OpenAI API, so the results show the cost
+of the server instead of the model. Each scenario sends concurrent chats, some
+identical, and reports throughput, latency percentiles, how many were refused
+with 429 and how many requests reached the OpenAI API.
+
+Run it like this:
+    python server_benchmark.py
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from fake_openai import spawn
+
+REQUESTS = 500
+USERS = 100  # concurrent connections
+DISTINCT_MESSAGES = 20
+OPENAI_DELAY = 0.05  # seconds the fake API takes to answer
+
+
+async def post_chat(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, message: str
+) -> int:
+    """Sends a chat on a keep-alive connection, returning the status. This is
+    much cheaper than an HTTP client, so the load generator isn't slower than
+    the server it measures."""
+    body = json.dumps({"message": message}).encode()
+    writer.write(
+        b"POST /chat HTTP/1.1\r\nHost: localhost\r\n"
+        + f"Content-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()).strip():
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def load(port: int) -> tuple[list[float], int, float]:
+    """Returns latencies of successful chats, the count refused and the
+    elapsed time."""
+    latencies, refused = [], 0
+    messages = iter(range(REQUESTS))
+
+    async def user():
+        nonlocal refused
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for i in messages:
+            start = time.perf_counter()
+            status = await post_chat(
+                reader, writer, f"Question {i % DISTINCT_MESSAGES}"
+            )
+            if status == 429:
+                refused += 1
+            elif status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                raise RuntimeError(f"unexpected status {status}")
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(USERS)))
+    return latencies, refused, time.perf_counter() - start
+
+
+def openai_requests() -> int:
+    stats_url = os.environ["OPENAI_BASE_URL"].removesuffix("/v1") + "/stats"
+    return httpx.get(stats_url).json()["requests"]
+
+
+def spawn_server(*args: str) -> tuple[subprocess.Popen, int]:
+    """Runs server.py in another process, returning it and its port."""
+    env = {
+        **os.environ,
+        # Measure the server, not exporting to a collector.
+        "OTEL_TRACES_EXPORTER": "none",
+        "OTEL_METRICS_EXPORTER": "none",
+        "OTEL_LOGS_EXPORTER": "none",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--port", "0", "--fast-start", *args],
+        stdout=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    url = process.stdout.readline().split()[-1]
+    return process, int(url.rsplit(":", 1)[1])
+
+
+async def scenario(name: str, *args: str) -> None:
+    before = openai_requests()
+    server, port = spawn_server("--concurrency", "10", *args)
+    try:
+        latencies, refused, elapsed = await load(port)
+    finally:
+        server.terminate()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<24} {len(latencies) / elapsed:7.1f} chats/s"
+        f"  p50 {quantiles[49] * 1000:6.1f}ms  p99 {quantiles[98] * 1000:6.1f}ms"
+        f"  429s {refused:4d}  OpenAI requests {openai_requests() - before:4d}"
+    )
+
+
+async def main():
+    openai, base_url = spawn(delay=OPENAI_DELAY)
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="unused")
+    try:
+        await scenario("no batching", "--max-queue", "1000")
+        await scenario(
+            "batch window 10ms", "--max-queue", "1000", "--batch-window", "0.01"
+        )
+        await scenario("small queue", "--max-queue", "10")
+    finally:
+        openai.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
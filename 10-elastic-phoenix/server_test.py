@@ -0,0 +1,119 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+
+import httpx
+import pytest
+import user_feedback
+from client import ChatResponse
+from server import ChatServer, Overloaded
+
+
+class BlockingClient:
+    """Answers with the message once released."""
+
+    max_concurrency = 1
+
+    def __init__(self):
+        self.messages = []
+        self.release = asyncio.Event()
+
+    async def achat(self, message: str) -> ChatResponse:
+        self.messages.append(message)
+        await self.release.wait()
+        return ChatResponse(message.upper(), span_id="00000000499602d2")
+
+
+def test_chat_overloaded():
+    async def test():
+        client = BlockingClient()
+        server = ChatServer(client, max_queue=1, batch_window=0)
+        first = asyncio.create_task(server.chat("a"))
+        queued = asyncio.create_task(server.chat("b"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded):
+            await server.chat("c")
+
+        client.release.set()
+        assert [r.content for r in await asyncio.gather(first, queued)] == [
+            "A",
+            "B",
+        ]
+        assert server.pending == 0
+
+    asyncio.run(test())
+
+
+def test_chat_batches_identical_messages():
+    async def test():
+        client = BlockingClient()
+        server = ChatServer(client, max_queue=0, batch_window=0.01)
+        tasks = [asyncio.create_task(server.chat("a")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        client.release.set()
+
+        responses = await asyncio.gather(*tasks)
+        assert [r.content for r in responses] == ["A"] * 3
+        # Followers neither took a place in the queue nor made a request.
+        assert client.messages == ["a"]
+
+    asyncio.run(test())
+
+
+def test_http(monkeypatch):
+    feedback = []
+
+    class ListSink:
+        error = None
+
+        def submit(self, span_id, good):
+            if self.error:
+                raise self.error
+            feedback.append((span_id, good))
+
+    monkeypatch.setattr(user_feedback, "feedback_sink", ListSink)
+
+    async def test():
+        client = BlockingClient()
+        client.release.set()
+        listener = await ChatServer(client, batch_window=0).serve(
+            "127.0.0.1", 0
+        )
+        port = listener.sockets[0].getsockname()[1]
+        async with (
+            listener,
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http,
+        ):
+            chat = await http.post("/chat", json={"message": "hi"})
+            assert chat.status_code == 200
+            assert chat.json() == {
+                "answer": "HI",
+                "span_id": "00000000499602d2",
+                "cached": False,
+            }
+
+            response = await http.post(
+                "/feedback", json={"span_id": chat.json()["span_id"], "good": 1}
+            )
+            assert response.status_code == 202
+            assert feedback == [("00000000499602d2", True)]
+
+            assert (await http.post("/chat", content="{")).status_code == 400
+            for path in ("/chat", "/feedback"):
+                response = await http.post(path, content="[1]")
+                assert response.status_code == 400
+            assert (await http.get("/chat")).status_code == 404
+
+            # Errors of the app get a response, rather than a dropped
+            # connection.
+            ListSink.error = ValueError("feedback sink is closed")
+            response = await http.post(
+                "/feedback", json={"span_id": "00000000499602d2", "good": 1}
+            )
+            assert response.status_code == 500
+            assert response.json() == {"error": "internal error"}
+
+    asyncio.run(test())
@@ -0,0 +1,96 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Coalesces concurrent identical calls, so that a burst of the same question
+results in one upstream request. The first caller for a key is the leader and
+makes the call; callers arriving before it completes wait and share its result.
+"""
+
+import asyncio
+import threading
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(Generic[T]):
+    """Coalesces calls made from different threads."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call[T]] = {}
+
+    def do(self, key: str, fn: Callable[[], T]) -> tuple[T, bool]:
+        """Returns the result of fn and whether this caller was the leader."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, True
+
+
+class AsyncSingleFlight(Generic[T]):
+    """Coalesces calls made from tasks on the same event loop."""
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Future[T]] = {}
+
+    async def do(
+        self, key: str, fn: Callable[[], Awaitable[T]]
+    ) -> tuple[T, bool]:
+        """Returns the result of fn and whether this caller was the leader."""
+        while (future := self._calls.get(key)) is not None:
+            try:
+                # Shield, so a waiter being cancelled doesn't cancel the others.
+                return await asyncio.shield(future), False
+            except asyncio.CancelledError:
+                # If the leader was cancelled, not this caller, try again, so
+                # one of the waiters becomes the leader.
+                if (
+                    not future.cancelled()
+                    or asyncio.current_task().cancelling()
+                ):
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved, in case nobody was waiting
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, True
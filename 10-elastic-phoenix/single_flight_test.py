@@ -0,0 +1,98 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_shares_call():
+    flights = SingleFlight()
+    calls = []
+    started, release = threading.Event(), threading.Event()
+
+    def answer():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "Atlantic Ocean"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flights.do, "key", answer) for _ in range(3)]
+        started.wait()
+        time.sleep(0.1)  # give the others time to join the leader
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [
+        ("Atlantic Ocean", False),
+        ("Atlantic Ocean", False),
+        ("Atlantic Ocean", True),
+    ]
+
+
+def test_single_flight_raises_leader_error():
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do("key", fail)
+    # Failures aren't remembered
+    assert flights.do("key", lambda: "Atlantic Ocean") == (
+        "Atlantic Ocean",
+        True,
+    )
+
+
+def test_async_single_flight_shares_call():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "Atlantic Ocean"
+
+    async def ask_three_times():
+        return await asyncio.gather(
+            *(flights.do("key", answer) for _ in range(3))
+        )
+
+    results = asyncio.run(ask_three_times())
+
+    assert len(calls) == 1
+    assert [leader for _, leader in results] == [True, False, False]
+
+
+def test_async_single_flight_leader_cancelled():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "Atlantic Ocean"
+
+    async def cancel_leader():
+        leader = asyncio.create_task(flights.do("key", answer))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.create_task(flights.do("key", answer)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(cancel_leader())
+
+    # A waiter took over as the leader, instead of being cancelled too.
+    assert len(calls) == 2
+    assert results == [("Atlantic Ocean", True), ("Atlantic Ocean", False)]
@@ -0,0 +1,73 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Measures how long main.py takes to start, with and without --fast-start:
+* import time: how long `import main` takes
+* time to first request: from starting the process until its first request
+  reaches the (fake) OpenAI API
+
+Run it like this:
+    python startup_benchmark.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from fake_openai import FakeOpenAIServer
+
+RUNS = 5
+
+
+def import_time() -> float:
+    code = (
+        "import time; t = time.perf_counter(); import main; "
+        "print(time.perf_counter() - t)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip())
+
+
+def time_to_first_request(args: list[str], env: dict) -> float:
+    server = FakeOpenAIServer().start()
+    try:
+        env = {**env, "OPENAI_BASE_URL": server.base_url}
+        start = time.time()
+        subprocess.run(
+            [sys.executable, "main.py", *args],
+            env=env,
+            capture_output=True,
+            check=True,
+        )
+        return server.first_request_at - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "unused",
+        # Measure instrumentation, not exporting to a collector.
+        "OTEL_TRACES_EXPORTER": "none",
+        "OTEL_METRICS_EXPORTER": "none",
+        "OTEL_LOGS_EXPORTER": "none",
+    }
+    import_times = [import_time() for _ in range(RUNS)]
+    print(f"import main: {statistics.median(import_times):.3f}s")
+    for name, args in (("default", []), ("fast start", ["--fast-start"])):
+        times = [time_to_first_request(args, env) for _ in range(RUNS)]
+        print(
+            f"time to first request ({name}): {statistics.median(times):.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Judges labels first, and asks for explanations only where they matter. Most
+answers pass, and their step by step explanations are most of the output
+tokens and latency of a judge call, yet are rarely read.
+
+TieredJudge wraps a judge with the signature of run_evals, e.g. CombinedJudge.
+The first pass uses the short prompts without explanation, and stops the judge
+model after EVAL_LABEL_MAX_TOKENS (default 50). The second pass asks for
+explanations of rows labeled as failing, e.g. "incorrect" or "hallucinated",
+or which couldn't be labeled, and its labels replace those of the first.
+
+Reasoning models, like o3-mini, count reasoning in the limit, so they have no
+limit unless EVAL_LABEL_MAX_TOKENS is set.
+"""
+
+import copy
+import os
+import re
+from typing import Callable, Optional
+
+import pandas as pd
+from phoenix.evals import LLMEvaluator, run_evals
+from phoenix.evals.models import BaseModel
+
+# Labels which aren't explained. Anything else, including unparsable output or
+# a failed call, is.
+PASSING_LABELS = {"correct", "factual"}
+COLUMNS = ["label", "score", "explanation"]
+REASONING_MODEL = re.compile(r"o\d")
+
+
+def label_max_tokens(model: BaseModel) -> Optional[int]:
+    """Returns the output tokens to allow the judge model for a label."""
+    if value := os.getenv("EVAL_LABEL_MAX_TOKENS"):
+        return int(value)
+    return None if REASONING_MODEL.match(model.model) else 50
+
+
+def _results(evaluated: pd.DataFrame) -> pd.DataFrame:
+    return evaluated.reindex(columns=COLUMNS).astype(
+        {"label": object, "explanation": object}
+    )
+
+
+class TieredJudge:
+    """A drop-in for run_evals, which only asks judge for explanations of rows
+    which didn't pass."""
+
+    def __init__(self, judge: Optional[Callable] = None) -> None:
+        self.judge = judge or run_evals
+        # Part of eval cache keys, as passing rows are cached without an
+        # explanation.
+        self.template = f"tiered {getattr(self.judge, 'template', '')}"
+        self._models: dict[int, BaseModel] = {}
+
+    def _labeling(self, evaluator: LLMEvaluator) -> LLMEvaluator:
+        """Returns a copy of evaluator, with a model which stops after a label.
+        Evaluators sharing a model share its copy too."""
+        model = evaluator._model
+        if (labeling_model := self._models.get(id(model))) is None:
+            labeling_model = copy.copy(model)
+            labeling_model.max_tokens = label_max_tokens(model)
+            self._models[id(model)] = labeling_model
+        labeling = copy.copy(evaluator)
+        labeling._model = labeling_model
+        return labeling
+
+    def __call__(
+        self,
+        dataframe: pd.DataFrame,
+        evaluators: list[LLMEvaluator],
+        provide_explanation: bool = False,
+        **kwargs,
+    ) -> list[pd.DataFrame]:
+        evals = self.judge(
+            dataframe=dataframe,
+            evaluators=[self._labeling(e) for e in evaluators],
+            provide_explanation=False,
+            **kwargs,
+        )
+        evals = [_results(evaluated) for evaluated in evals]
+        if not provide_explanation:
+            return evals
+
+        # Rows needing the same evaluators explained are judged together.
+        groups = {}
+        for position in range(len(dataframe)):
+            indices = tuple(
+                i
+                for i, evaluated in enumerate(evals)
+                if evaluated["label"].iat[position] not in PASSING_LABELS
+            )
+            if indices:
+                groups.setdefault(indices, []).append(position)
+        for indices, positions in groups.items():
+            explained = self.judge(
+                dataframe=dataframe.iloc[positions],
+                evaluators=[evaluators[i] for i in indices],
+                provide_explanation=True,
+                **kwargs,
+            )
+            for i, evaluated in zip(indices, explained):
+                # Where explaining failed, the label of the first pass stays.
+                evaluated = _results(evaluated).dropna(subset=["label"])
+                evals[i].loc[evaluated.index] = evaluated
+        return evals
@@ -0,0 +1,73 @@
+#
+# Copyright Elasticsearch B.V. and contributors
+# SPDX-License-Identifier: Apache-2.0
+#
+import pandas as pd
+from ocean_evaluator import OceanEvaluator
+from phoenix.evals import OpenAIModel, QAEvaluator
+from tiered_judge import TieredJudge, label_max_tokens
+
+LABELS = {"Atlantic Ocean": "correct", "Indian Ocean": "incorrect"}
+
+
+class FakeJudge:
+    """Labels outputs by LABELS, which fails for others unless explaining."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, dataframe, evaluators, provide_explanation, **kwargs):
+        self.calls.append(
+            (
+                list(dataframe.index),
+                len(evaluators),
+                provide_explanation,
+                evaluators[0]._model.max_tokens,
+            )
+        )
+        labels = [
+            LABELS.get(output, "incorrect" if provide_explanation else None)
+            for output in dataframe["output"]
+        ]
+        explanation = "step by step" if provide_explanation else None
+        return [
+            pd.DataFrame(
+                {"label": labels, "score": 1, "explanation": explanation},
+                index=dataframe.index,
+            )
+            for _ in evaluators
+        ]
+
+
+def test_explains_only_rows_which_did_not_pass(default_openai_env):
+    model = OpenAIModel(model="gpt-4o-mini")
+    evaluators = [QAEvaluator(model), OceanEvaluator(model)]
+    dataframe = pd.DataFrame(
+        {
+            "input": "Which ocean contains Bouvet Island?",
+            "output": ["Atlantic Ocean", "Indian Ocean", "unparsable"],
+        },
+        index=["a", "b", "c"],
+    )
+    fake_judge = FakeJudge()
+
+    qa, ocean = TieredJudge(fake_judge)(
+        dataframe=dataframe, evaluators=evaluators, provide_explanation=True
+    )
+
+    # Labels first, with a small limit, then explanations of the failing.
+    assert fake_judge.calls == [
+        (["a", "b", "c"], 2, False, 50),
+        (["b", "c"], 2, True, None),
+    ]
+    assert model.max_tokens is None  # only the copy is limited
+    assert list(qa["label"]) == ["correct", "incorrect", "incorrect"]
+    assert list(qa["explanation"]) == [None, "step by step", "step by step"]
+    assert ocean.equals(qa)
+
+
+def test_label_max_tokens(monkeypatch, default_openai_env):
+    assert label_max_tokens(OpenAIModel(model="gpt-4o-mini")) == 50
+    assert label_max_tokens(OpenAIModel(model="o3-mini")) is None
+    monkeypatch.setenv("EVAL_LABEL_MAX_TOKENS", "1000")
+    assert label_max_tokens(OpenAIModel(model="o3-mini")) == 1000
@@ -2,16 +2,189 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import atexit
+import os
+import sys
+import threading
+from collections import deque
+from functools import cache
+
 import phoenix.client as px
+from feedback_spool import Spool
+from opentelemetry import metrics
+
+meter = metrics.get_meter(__name__)
+dropped_counter = meter.create_counter(
+    "feedback.dropped",
+    unit="{annotation}",
+    description="User feedback dropped as the buffer was full.",
+)
+
+
+def _annotation(span_id: str, good: bool) -> dict:
+    return {
+        "name": "user feedback",
+        "span_id": span_id,
+        "annotator_kind": "HUMAN",
+        "result": {
+            "label": "thumbs-up" if good else "thumbs-down",
+            "score": 1 if good else 0,
+        },
+    }
+
+
+@cache
+def phoenix_client() -> px.Client:
+    """Returns a client shared by all feedback, so connections are reused."""
+    return px.Client()
 
 
 def add_user_feedback(span_id: str, good: bool) -> None:
     """Add user feedback annotation to a span in Phoenix."""
-    phoenix_client = px.Client()
-    phoenix_client.annotations.add_span_annotation(
-        annotation_name="user feedback",
-        annotator_kind="HUMAN",
-        span_id=span_id,
-        label="thumbs-up" if good else "thumbs-down",
-        score=1 if good else 0,
+    phoenix_client().annotations.log_span_annotations(
+        span_annotations=[_annotation(span_id, good)]
     )
+
+
+class FeedbackSink:
+    """Buffers user feedback and logs it to Phoenix in bulk from a background
+    thread, once batch_size annotations are buffered or every interval
+    seconds. Buffered feedback is flushed when the process exits.
+
+    If Phoenix is unavailable, feedback stays buffered and is retried, up to
+    max_buffer annotations, after which the oldest are dropped. With a spool,
+    configured by FEEDBACK_SPOOL_DIR, feedback is buffered on disk instead,
+    so none is lost, even if the process exits before Phoenix is back.
+    Without one, feedback still unsent on exit is reported on stderr."""
+
+    def __init__(
+        self,
+        client: px.Client | None = None,
+        batch_size: int | None = None,
+        interval: float | None = None,
+        max_buffer: int = 10000,
+        spool: Spool | None = None,
+    ) -> None:
+        self.client = client or phoenix_client()
+        self.batch_size = batch_size or int(
+            os.getenv("FEEDBACK_BATCH_SIZE", "100")
+        )
+        self.interval = interval or float(
+            os.getenv("FEEDBACK_FLUSH_INTERVAL", "1")
+        )
+        self.max_buffer = max_buffer
+        self.spool = spool if spool is not None else Spool.from_env()
+        self._buffer: deque[dict] = deque()
+        self._spooled = 0  # count since the last drain
+        self._wake = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="feedback-sink", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, span_id: str, good: bool) -> None:
+        """Buffers feedback to log soon, without waiting for Phoenix."""
+        annotation = _annotation(span_id, good)
+        if self.spool is not None:
+            self.spool.append(annotation)
+        with self._wake:
+            if self.spool is not None:
+                self._spooled += 1
+            else:
+                self._buffer.append(annotation)
+                self._trim()
+            if self._pending() >= self.batch_size:
+                self._wake.notify()
+
+    def _pending(self) -> int:
+        return self._spooled if self.spool is not None else len(self._buffer)
+
+    def _trim(self) -> None:
+        while len(self._buffer) > self.max_buffer:
+            self._buffer.popleft()
+            dropped_counter.add(1)
+
+    def _take(self) -> list[dict]:
+        with self._wake:
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _log(self, batch: list[dict]) -> None:
+        self.client.annotations.log_span_annotations(span_annotations=batch)
+
+    def _send(self, batch: list[dict]) -> bool:
+        """Logs the batch, putting it back in the buffer if that fails."""
+        try:
+            self._log(batch)
+            return True
+        except Exception:
+            with self._wake:
+                self._buffer.extendleft(reversed(batch))
+                self._trim()
+            return False
+
+    def _run(self) -> None:
+        failed = False
+        while True:
+            with self._wake:
+                # After a failure, wait even if the buffer is full.
+                if not self._closed and (
+                    failed or self._pending() < self.batch_size
+                ):
+                    self._wake.wait(self.interval)
+                if self._closed:
+                    return
+            if self.spool is not None:
+                failed = not self._drain()
+            elif batch := self._take():
+                failed = not self._send(batch)
+
+    def _drain(self) -> bool:
+        """Logs spooled feedback, returning False if that failed."""
+        with self._wake:
+            self._spooled = 0
+        try:
+            self.spool.drain(self._log, self.batch_size)
+            return True
+        except Exception:
+            return False  # what failed stays spooled for the next drain
+
+    def flush(self) -> bool:
+        """Logs all buffered feedback, blocking until done or failed.
+        Returns True if it was all logged."""
+        if self.spool is not None:
+            return self._drain()
+        while batch := self._take():
+            if not self._send(batch):
+                return False
+        return True
+
+    def close(self) -> None:
+        """Stops the background thread and flushes what is left."""
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+        if not self.flush():
+            if self.spool is not None:
+                print(
+                    "User feedback not logged to Phoenix, kept in "
+                    f"{self.spool.directory} for a later run",
+                    file=sys.stderr,
+                )
+            else:
+                print(
+                    f"{len(self._buffer)} user feedback not logged to "
+                    "Phoenix, and lost. Set FEEDBACK_SPOOL_DIR to keep it.",
+                    file=sys.stderr,
+                )
+        if self.spool is not None:
+            self.spool.close()
+
+
+@cache
+def feedback_sink() -> FeedbackSink:
+    """Returns the sink shared by this process."""
+    return FeedbackSink()
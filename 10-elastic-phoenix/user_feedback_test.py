@@ -2,11 +2,106 @@
 # Copyright Elasticsearch B.V. and contributors
 # SPDX-License-Identifier: Apache-2.0
 #
+import os
+import threading
+from types import SimpleNamespace
+
 import pytest
-from user_feedback import add_user_feedback
+from feedback_spool import Spool
+from user_feedback import FeedbackSink, add_user_feedback
 
 
 @pytest.mark.vcr
 @pytest.mark.parametrize("good", [True, False])
 def test_add_user_feedback(default_phoenix_env, good):
     add_user_feedback(span_id="00000000499602d2", good=good)
+
+
+class FakeAnnotations:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.logged = threading.Event()
+
+    def log_span_annotations(self, span_annotations):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Phoenix is down")
+        self.batches.append([a["span_id"] for a in span_annotations])
+        self.logged.set()
+
+
+def fake_client(failures=0):
+    return SimpleNamespace(annotations=FakeAnnotations(failures))
+
+
+def test_sink_flushes_full_batches():
+    client = fake_client()
+    sink = FeedbackSink(client, batch_size=2, interval=60)
+    for span_id in ("a", "b", "c"):
+        sink.submit(span_id, good=True)
+
+    # The first batch is full, so it doesn't wait for the interval.
+    assert client.annotations.logged.wait(5)
+    assert client.annotations.batches == [["a", "b"]]
+
+    sink.close()
+    assert client.annotations.batches == [["a", "b"], ["c"]]
+
+
+def test_sink_flushes_on_interval():
+    client = fake_client()
+    sink = FeedbackSink(client, batch_size=100, interval=0.01)
+    sink.submit("a", good=False)
+
+    assert client.annotations.logged.wait(5)
+    assert client.annotations.batches == [["a"]]
+    sink.close()
+
+
+def test_sink_retries_failures():
+    client = fake_client(failures=1)
+    sink = FeedbackSink(client, batch_size=100, interval=60)
+    sink.close()
+    sink.submit("a", good=True)
+
+    sink.flush()
+    assert client.annotations.batches == []
+    sink.flush()
+    assert client.annotations.batches == [["a"]]
+
+
+def test_sink_drops_oldest_when_full():
+    client = fake_client()
+    sink = FeedbackSink(client, batch_size=100, interval=60, max_buffer=2)
+    sink.close()
+    for span_id in ("a", "b", "c"):
+        sink.submit(span_id, good=True)
+
+    sink.flush()
+    assert client.annotations.batches == [["b", "c"]]
+
+
+def test_sink_spools_until_phoenix_is_back(tmp_path):
+    client = fake_client(failures=1)
+    sink = FeedbackSink(client, interval=60, spool=Spool(str(tmp_path)))
+    sink.close()  # stop the background thread, to flush deterministically
+    sink.submit("a", good=True)
+
+    sink.flush()
+    assert client.annotations.batches == []
+    assert len(os.listdir(tmp_path)) == 1
+    sink.flush()
+    assert client.annotations.batches == [["a"]]
+    assert os.listdir(tmp_path) == []
+
+
+def test_sink_reports_lost_feedback(capsys):
+    client = fake_client(failures=2)
+    sink = FeedbackSink(client, batch_size=100, interval=60)
+    sink.submit("a", good=True)
+
+    assert not sink.flush()
+    sink.close()
+
+    assert "1 user feedback not logged" in capsys.readouterr().err